@@ -0,0 +1,54 @@
+import json
+import os
+import quat
+from l2_squared_error import POSITIONS, quaternion_mean
+
+
+class Calibration:
+    # Reference rotation of every IMU recorded in a neutral pose: hand flat, fingers extended.
+    # A reading q of an IMU is first corrected by its reference, q * r^-1, which removes how the IMU sits
+    # on the glove, then expressed relative to the corrected hand so that the orientation of the whole
+    # hand drops out. In the neutral pose every IMU reads identity, whoever wears the glove and however.
+    def __init__(self, references: dict):
+        self.references = {p: list(references[p]) for p in POSITIONS}
+        self.inverse = quat.conjugate(quat.normalise([references[p] for p in POSITIONS]))
+        self.hand_index = POSITIONS.index('H')
+
+    @classmethod
+    def record(cls, frames: list):
+        # references from a burst of frames held in the neutral pose
+        return cls({p: list(quaternion_mean([Q_list[p] for Q_list in frames])) for p in POSITIONS})
+
+    @classmethod
+    def load(cls, file_name='calibration.json'):
+        # None when the glove has not been calibrated
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, 'r') as f:
+            return cls(json.load(f))
+
+    def save(self, file_name='calibration.json'):
+        with open(file_name, 'w') as f:
+            f.write(json.dumps(self.references, indent=2))
+
+    def corrected(self, Q):
+        # Q: (..., IMU, 4) readings in POSITIONS order, mounting removed in one product
+        return quat.multiply(quat.normalise(Q), self.inverse)
+
+    def relative(self, Q):
+        # Q: (..., IMU, 4) readings in POSITIONS order, every IMU relative to the hand, hand is identity
+        corrected = self.corrected(Q)
+        hand = quat.conjugate(corrected[..., self.hand_index:self.hand_index + 1, :])
+        return quat.multiply(hand, corrected)
+
+    def apply(self, Q_list: dict):
+        # hand-relative frame for the classifiers, IMUs outside POSITIONS are kept as read
+        relative = self.relative([Q_list[p] for p in POSITIONS])
+        frame = dict(Q_list)
+        for p, q in zip(POSITIONS, relative.tolist()):
+            frame[p] = q
+        return frame
+
+    def hand(self, Q_list: dict):
+        # orientation of the hand relative to the neutral pose, for the robot controls
+        return quat.multiply(quat.normalise(Q_list['H']), self.inverse[self.hand_index])
@@ -0,0 +1,143 @@
+import threading
+import time
+import numpy as np
+import quat
+
+try:
+    import curses
+except ImportError:
+    # windows without windows-curses, the same screen is printed instead
+    curses = None
+
+NAMES = {'T': 'Thumb', 'I': 'Index', 'M': 'Middle', 'R': 'Ring', 'L': 'Little', 'H': 'Hand', 'A': 'Arm'}
+
+
+class Dashboard:
+    # Operator screen refreshed at a fixed rate from the latest snapshot of the stream.
+    # Ingestion only stores references and counts frames, Euler angles, template scores and all
+    # formatting are computed by the render thread for the frame on screen, never for every frame.
+    def __init__(self, title='', scorer=None, sensitivity=None, refresh_hz=10):
+        # scorer: frame -> [(gesture, score)], e.g. L2Classifier.scores, run at the refresh rate
+        # sensitivity: scores at or below it are marked, the best one is the prediction if none is set
+        self.title = title
+        self.scorer = scorer
+        self.sensitivity = sensitivity
+        self.period = 1 / refresh_hz
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.accelerations = {}
+        self.latest_prediction = None
+        self.latest_command = ''
+        self.frames = 0
+        self.dropped = 0
+        self.running = False
+        self.thread = None
+
+    # ingestion side, called for every frame
+
+    def frame(self, Q_list: dict, accelerations: dict = None):
+        with self.lock:
+            self.latest = Q_list
+            if accelerations is not None:
+                self.accelerations = accelerations
+            self.frames += 1
+
+    def drop(self, count=1):
+        with self.lock:
+            self.dropped += count
+
+    def prediction(self, gesture):
+        with self.lock:
+            self.latest_prediction = gesture
+
+    def command(self, text):
+        with self.lock:
+            self.latest_command = text
+
+    # render side
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.render, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(latest=self.latest, accelerations=self.accelerations, prediction=self.latest_prediction,
+                        command=self.latest_command, frames=self.frames, dropped=self.dropped)
+
+    def lines(self, snapshot, frame_rate, height):
+        lines = [f'{self.title}  {frame_rate:6.1f} frames/s  {snapshot["frames"]} frames  '
+                 f'{snapshot["dropped"]} dropped  (q to quit)', '']
+        frame = snapshot['latest']
+        positions = [p for p in NAMES if p in frame]
+        if positions:
+            # one batch conversion for every IMU on screen
+            angles = np.degrees(quat.to_euler(quat.normalise([frame[p] for p in positions])))
+            for p, (roll, pitch, yaw) in zip(positions, angles):
+                line = f'{NAMES[p]:6s}| roll:{roll:8.2f}, pitch:{pitch:8.2f}, yaw:{yaw:8.2f}'
+                if p in snapshot['accelerations']:
+                    ax, ay, az = snapshot['accelerations'][p]
+                    line += f'  AX:{ax:8.3f}, AY:{ay:8.3f}, AZ:{az:8.3f}'
+                lines.append(line)
+        scores = []
+        if self.scorer is not None and frame:
+            try:
+                scores = self.scorer(frame)
+            except KeyError:
+                # frame without every IMU the scorer needs
+                scores = []
+        prediction = snapshot['prediction']
+        if prediction is None and scores and self.sensitivity is not None:
+            best_gesture, best_score = min(scores, key=lambda score: score[1])
+            prediction = best_gesture if best_score <= self.sensitivity else 404
+        lines += ['', f'Prediction: {"-" if prediction is None else prediction}    '
+                      f'Command: {snapshot["command"]}']
+        if scores:
+            lines += ['', 'Gesture      score']
+            room = max(0, height - len(lines) - 1)
+            for gesture, score in sorted(scores, key=lambda score: score[1])[:room]:
+                mark = '*' if self.sensitivity is not None and score <= self.sensitivity else ' '
+                lines.append(f'{gesture:>7} {mark} {score:9.3f}')
+        return lines
+
+    def render(self):
+        if curses is None:
+            self.render_plain()
+        else:
+            curses.wrapper(self.render_curses)
+        self.running = False
+
+    def rates(self):
+        # frame rate over each refresh period, smoothed so that the number stays readable
+        last_frames, last_time, frame_rate = 0, time.monotonic(), 0.0
+        while self.running:
+            snapshot = self.snapshot()
+            now = time.monotonic()
+            instant = (snapshot['frames'] - last_frames) / max(now - last_time, 1e-6)
+            frame_rate = instant if frame_rate == 0 else 0.7 * frame_rate + 0.3 * instant
+            last_frames, last_time = snapshot['frames'], now
+            yield snapshot, frame_rate
+
+    def render_curses(self, screen):
+        curses.curs_set(0)
+        screen.nodelay(True)
+        for snapshot, frame_rate in self.rates():
+            height, width = screen.getmaxyx()
+            screen.erase()
+            for row, line in enumerate(self.lines(snapshot, frame_rate, height)[:height]):
+                screen.addnstr(row, 0, line, width - 1)
+            screen.refresh()
+            if screen.getch() in (ord('q'), ord('Q')):
+                return
+            time.sleep(self.period)
+
+    def render_plain(self):
+        for snapshot, frame_rate in self.rates():
+            print(u'{}[2J{}[;H'.format(chr(27), chr(27)) + '\n'.join(self.lines(snapshot, frame_rate, 40)))
+            time.sleep(self.period)
@@ -1,21 +1,76 @@
+import hashlib
+import json
+import os
 import torch
 from torch.utils.data import Dataset
 import numpy as np
+from l2_squared_error import l2_vector, l2_vectors
 
 # gesture_database = [
 #     ('test gesture 1', np.array([[0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0]])),
 #     ('test gesture 2', np.array([[0, 0, 0], [1, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0]]))
 # ]
 
+# bump whenever features() changes so that stale caches are not picked up
+FEATURE_VERSION = 1
+
+
+def load_frames(file_name, calibration=None):
+    # dataset.json maps gesture index to one recorded frame or a list of frames,
+    # a frame maps IMU identifier to its quaternion as read, calibration is applied here if given
+    with open(file_name, 'r') as f:
+        content = json.load(f)
+    frames = []
+    for tag, samples in content.items():
+        if isinstance(samples, dict):
+            samples = [samples]
+        for sample in samples:
+            frames.append((int(tag), sample if calibration is None else calibration.apply(sample)))
+    return frames
+
+
+def features(Q_list):
+    # pairwise quaternion distances between the hand and fingers, same as the l2 method
+    return l2_vector(Q_list).astype(np.float32)
+
+
+def feature_cache_name(file_name, calibration=None):
+    # cache is keyed by the contents of the source file and the calibration, changing either invalidates it
+    with open(file_name, 'rb') as f:
+        digest = hashlib.sha1(f.read())
+    if calibration is not None:
+        digest.update(json.dumps(calibration.references, sort_keys=True).encode())
+    digest = digest.hexdigest()
+    return f'{os.path.splitext(file_name)[0]}.features.v{FEATURE_VERSION}.{digest[:16]}.npy'
+
 
 class GestureDataset(Dataset):
-    def __init__(self, data):
+    def __init__(self, data, feature_matrix=None):
+        # data: list of (gesture index, frame), features are computed once for all frames
         self.data = data
+        self.tags = torch.tensor([tag for tag, _ in data], dtype=torch.long)
+        if feature_matrix is None:
+            feature_matrix = l2_vectors([Q_list for _, Q_list in data]).astype(np.float32) if data else \
+                np.empty((0, 0), dtype=np.float32)
+        self.features = torch.from_numpy(np.ascontiguousarray(feature_matrix, dtype=np.float32))
+
+    @classmethod
+    def from_file(cls, file_name, use_cache=True, calibration=None):
+        data = load_frames(file_name, calibration)
+        if not use_cache:
+            return cls(data)
+        cache_name = feature_cache_name(file_name, calibration)
+        if os.path.exists(cache_name):
+            feature_matrix = np.load(cache_name)
+            if len(feature_matrix) == len(data):
+                return cls(data, feature_matrix)
+        dataset = cls(data)
+        np.save(cache_name, dataset.features.numpy())
+        return dataset
 
     def __len__(self):
         return len(self.data)
 
     def __getitem__(self, idx):
-        angles = np.array(self.data[idx][1]).astype('float')
-        sample = {'tag': self.data[idx][0], 'angles': angles}
-        return sample
+        # idx is an index or a list of indices, a whole batch is gathered in one indexing operation
+        return self.features[idx], self.tags[idx]
@@ -1,115 +1,113 @@
 import threading
-import numpy as np
 import subprocess
 import time
-from l2_squared_error import l2_squared_error_to_file
-from pyquaternion import Quaternion
+from l2_squared_error import l2_squared_error_to_file, l2_vector, l2_scorer, L2Classifier, burst_template, merge_template
+from l2_squared_error import POSITIONS as L2_POSITIONS
+import quat
 from serial import Serial
 import json
+import os
+import struct
+from motion import POSITIONS as MOTION_POSITIONS
+from calibration import Calibration
+from dashboard import Dashboard
 
+# frames averaged into one l2 template or stored in the dataset per sample
+BURST_FRAMES = 20
 
-def Q2Euler(Q: Quaternion):
-    qw, qx, qy, qz = Q.elements
-    sinr_cosp = 2 * (qw * qx + qy * qz)
-    cosr_cosp = 1 - 2 * (qx * qx + qy * qy)
-    roll = np.arctan2(sinr_cosp, cosr_cosp)
 
-    sinp = 2 * (qw * qy - qz * qx)
-    if np.abs(sinp) >= 1:
-        pitch = np.copysign(np.pi / 2, sinp)
-    else:
-        pitch = np.arcsin(sinp)
-
-    siny_cosp = 2 * (qw * qz + qx * qy)
-    cosy_cosp = 1 - 2 * (qy * qy + qz * qz)
-    yaw = np.arctan2(siny_cosp, cosy_cosp)
-
-    return np.array([roll, pitch, yaw])
+def quaternion_rotation_matrix(Q):
+    # transpose of the rotation matrix, rotates from the world frame into the IMU frame
+    return quat.rotation_matrix(Q).T
 
 
-def quaternion_rotation_matrix(Q: Quaternion):
-    a, b, c, d = Q.elements
-    r00 = 2 * a ** 2 - 1 + 2 * b ** 2
-    r01 = 2 * b * c + 2 * a * d
-    r02 = 2 * b * d - 2 * a * c
-    r10 = 2 * b * c - 2 * a * d
-    r11 = 2 * a ** 2 - 1 + 2 * c ** 2
-    r12 = 2 * c * d + 2 * a * b
-    r20 = 2 * b * d + 2 * a * c
-    r21 = 2 * c * d - 2 * a * b
-    r22 = 2 * a ** 2 - 1 + 2 * d ** 2
-    rot_matrix = np.array([[r00, r01, r02],
-                           [r10, r11, r12],
-                           [r20, r21, r22]])
-    return rot_matrix
+def Qdis(Q1, Q2):
+    return quat.distance(Q1, Q2)
 
 
-def Qdis(Q1: Quaternion, Q2: Quaternion):
-    return Quaternion.distance(Q1, Q2)
+def load_l2_scorer():
+    with open('gesture_l2.json', 'r') as f:
+        classifier = L2Classifier(json.load(f), 4)
+    return l2_scorer(classifier, Calibration.load('calibration.json'))
 
 
 def display(port):
     g = 9.8
-
-    QT = Quaternion()
-    QI = Quaternion()
-    QM = Quaternion()
-    QR = Quaternion()
-    QL = Quaternion()
-    QH = Quaternion()
-    # QA = Quaternion()
-
-    while True:
+    # l2 scores are shown when templates have been recorded
+    recorded = os.path.exists('gesture_l2.json') and os.path.getsize('gesture_l2.json') > 0
+    scorer = load_l2_scorer() if recorded else None
+    dashboard = Dashboard('Mode 0', scorer, sensitivity=4)
+    dashboard.start()
+    port.reset_input_buffer()
+    while dashboard.running:
         report = port.read_until(expected=b"\r\n")
-        # os.system('clear')
-        print(u'{}[2J{}[;H'.format(chr(27), chr(27)), end='')
         if len(report) % 15 != 2:
+            dashboard.drop()
             continue
+        Q_list = {}
+        accelerations = {}
+        malformed = False
         index = 0
-        to_report = ''
         while index < len(report) - 2:
-            identifier, quaternions, accelerometers = report[index:index + 1], report[index + 1:index + 9], report[index + 9:index + 15]
+            identifier = report[index:index + 1]
+            q0, q1, q2, q3, ax, ay, az = struct.unpack_from('<7h', report, index + 1)
             index += 15
-            q0 = np.short(quaternions[1] << 8 | quaternions[0]) / 32768
-            q1 = np.short(quaternions[3] << 8 | quaternions[2]) / 32768
-            q2 = np.short(quaternions[5] << 8 | quaternions[4]) / 32768
-            q3 = np.short(quaternions[7] << 8 | quaternions[6]) / 32768
-            Q = Quaternion([q0, q1, q2, q3])
-            ax = np.short((accelerometers[1]) << 8 | accelerometers[0]) / 32768 * 16 * g
-            ay = np.short((accelerometers[3]) << 8 | accelerometers[2]) / 32768 * 16 * g
-            az = np.short((accelerometers[5]) << 8 | accelerometers[4]) / 32768 * 16 * g
-
-            roll, pitch, yaw = Q2Euler(Q) / np.pi * 180
-
-            if identifier == b'T':  # Thumb
-                to_report += 'Thumb '
-                QT = Q
-            elif identifier == b'I':  # Index
-                to_report += 'Index '
-                QI = Q
-            elif identifier == b'M':  # Middle
-                to_report += 'Middle'
-                QM = Q
-            elif identifier == b'R':  # Ring
-                to_report += 'Ring  '
-                QR = Q
-            elif identifier == b'L':  # Little
-                to_report += 'Little'
-                QL = Q
-            elif identifier == b'H':  # Hand
-                to_report += 'Hand  '
-                QH = Q
-            # elif identifier == b'A':  # Arm
-            #     to_report += "Arm   "
-            #     QA = Q
-            to_report += f'| roll:{roll:8.3f}, pitch:{pitch:8.3f}, yaw:{yaw:8.3f}. Q0:{q0:8.3f}, Q1:{q1:8.3f}, Q2:{q2:8.3f}, Q3:{q3:8.3f}, AX:{ax:8.3f}, AY:{ay:8.3f}, AZ:{az:8.3f}\n'
-        print(to_report)
+            if identifier == b"G":
+                # gesture classified on the glove, not a sensor
+                continue
+            if identifier not in [b"T", b"I", b"M", b"R", b"L", b"H", b"A"]:
+                malformed = True
+                break
+            Q_list[identifier.decode()] = [q0 / 32768, q1 / 32768, q2 / 32768, q3 / 32768]
+            accelerations[identifier.decode()] = (ax / 32768 * 16 * g, ay / 32768 * 16 * g, az / 32768 * 16 * g)
+        if malformed:
+            dashboard.drop()
+            continue
+        dashboard.frame(Q_list, accelerations)
+    dashboard.stop()
 
 def keyboard_thread():
     input()
     return
 
 
+def capture_burst(port, prompt):
+    # BURST_FRAMES complete frames read after <Enter> is pressed
+    press_thread = threading.Thread(target=keyboard_thread)
+    press_thread.start()
+    print(prompt)
+    frames = []
+    while len(frames) < BURST_FRAMES:
+        report = port.read_until(expected=b"\r\n")
+        if len(report) % 15 != 2:
+            continue
+        if not press_thread.is_alive():
+            Q_list = {}
+            index = 0
+            while index < len(report) - 2:
+                identifier = report[index:index + 1]
+                q0, q1, q2, q3 = struct.unpack_from('<4h', report, index + 1)
+                index += 15
+                if identifier == b"G":
+                    # gesture classified on the glove, not a sensor
+                    continue
+                Q = [q0 / 32768, q1 / 32768, q2 / 32768, q3 / 32768]
+                if identifier not in [b"T", b"I", b"M", b"R", b"L", b"H", b"A"]:
+                    print(f" Invalid Identifier <{identifier}>")
+                    continue
+                Q_list[identifier.decode()] = Q
+            if all(p in Q_list for p in L2_POSITIONS):
+                frames.append(Q_list)
+    return frames
+
+
+def calibrate(port):
+    # neutral pose: hand flat, fingers extended, templates are recorded relative to it
+    frames = capture_burst(port, "Hold the hand flat with fingers extended, press <Enter> to calibrate")
+    Calibration.record(frames).save('calibration.json')
+    print('Calibration saved to calibration.json, record the l2 templates again and retrain with --calibration to match it')
+
+
 def collect(port, mode):
     if mode == 'Mode 1':
         file_name = 'dataset.json'
@@ -118,42 +116,94 @@ def collect(port, mode):
     else:
         print('Mode Error!')
         return
+    # samples are merged into what is already on disk, nothing is re-recorded
     content = {}
+    if os.path.exists(file_name) and os.path.getsize(file_name) > 0:
+        with open(file_name, 'r') as f:
+            content = json.load(f)
+    # the dataset is stored as read and calibrated when loaded, l2 templates are stored calibrated
+    calibration = Calibration.load('calibration.json') if mode == 'Mode 2' else None
+    if mode == 'Mode 2' and calibration is None:
+        print('No calibration.json, templates are stored as read, Mode 5 calibrates')
+    # l2 templates are indexed as they are sampled to flag gestures too close to tell apart
+    classifier = L2Classifier(content, 4) if mode == 'Mode 2' else None
+    while True:
+        idx = input(f'Gesture idx: ')
+        if idx == '' or idx[-1] == 'q':
+            break
+        if not idx.isnumeric():
+            print(f"Invalid input <{idx}>")
+            continue
+        idx = int(idx)
+        replace = False
+        if mode == 'Mode 2' and str(idx) in content:
+            replace = input(f'Gesture {idx} exists, <Enter> to merge, r to replace: ') == 'r'
+        frames = capture_burst(port, f"Press <Enter> to Sample Gesture Index <{idx}>, hold it for {BURST_FRAMES} frames")
+        if calibration is not None:
+            frames = [calibration.apply(Q_list) for Q_list in frames]
+        if mode == 'Mode 1':
+            samples = content.get(str(idx), [])
+            content[str(idx)] = ([samples] if isinstance(samples, dict) else samples) + frames
+        else:
+            template = burst_template(frames)
+            if str(idx) in content and not replace:
+                template = merge_template(content[str(idx)], template)
+            for other, l2 in classifier.neighbours(l2_vector(template)):
+                if other != idx:
+                    print(f'Warning: Gesture {idx} is within sensitivity of Gesture {other} (l2: {l2:.3f})')
+            classifier.add(idx, template)
+            content[str(idx)] = template
+        print(f'Get {len(frames)} Samples For Gesture {idx}')
     with open(file_name, 'w') as f:
-        while True:
-            idx = input(f'Gesture idx: ')
-            if idx == '' or idx[-1] == 'q':
-                break
-            if not idx.isnumeric():
-                print(f"Invalid input <{idx}>")
+        f.write(json.dumps(content, indent=2))
+
+def record_motion(port):
+    # motion templates are appended to gesture_motion.json, every recording of a gesture is kept
+    file_name = 'gesture_motion.json'
+    content = {}
+    if os.path.exists(file_name):
+        with open(file_name, 'r') as f:
+            content = json.load(f)
+    while True:
+        idx = input(f'Gesture idx: ')
+        if idx == '' or idx[-1] == 'q':
+            break
+        if not idx.isnumeric():
+            print(f"Invalid input <{idx}>")
+            continue
+        input(f"Press <Enter> to Start Recording Gesture Index <{idx}>")
+        press_thread = threading.Thread(target=keyboard_thread)
+        press_thread.start()
+        print(f"Press <Enter> to Stop Recording")
+        port.reset_input_buffer()
+        frames = []
+        while press_thread.is_alive():
+            report = port.read_until(expected=b"\r\n")
+            if len(report) % 15 != 2:
                 continue
-            idx = int(idx)
-            press_thread = threading.Thread(target=keyboard_thread)
-            press_thread.start()
-            print(f"Press <Enter> to Sample Gesture Index <{idx}>")
-            while True:
-                report = port.read_until(expected=b"\r\n")
-                if len(report) % 15 != 2:
+            Q_list = {}
+            index = 0
+            while index < len(report) - 2:
+                identifier = report[index:index + 1]
+                q0, q1, q2, q3 = struct.unpack_from('<4h', report, index + 1)
+                index += 15
+                if identifier == b"G":
+                    # gesture classified on the glove, not a sensor
                     continue
-                if not press_thread.is_alive():
-                    Q_list = {}
-                    index = 0
-                    while index < len(report) - 2:
-                        identifier, quaternions = report[index:index + 1], report[index + 1:index + 9]
-                        index += 15
-                        q0 = np.short(quaternions[1] << 8 | quaternions[0]) / 32768
-                        q1 = np.short(quaternions[3] << 8 | quaternions[2]) / 32768
-                        q2 = np.short(quaternions[5] << 8 | quaternions[4]) / 32768
-                        q3 = np.short(quaternions[7] << 8 | quaternions[6]) / 32768
-                        Q = list(np.array([q0, q1, q2, q3]))
-                        if identifier not in [b"T", b"I", b"M", b"R", b"L", b"H", b"A"]:
-                            print(f" Invalid Identifier <{identifier}>")
-                            continue
-                        Q_list[identifier.decode()] = Q
-                    content[idx] = Q_list
-                    print(f'Get Sample For Gesture {idx}')
-                    break
-        f.write(json.dumps(content, indent=2))
+                Q = [q0 / 32768, q1 / 32768, q2 / 32768, q3 / 32768]
+                if identifier not in [b"T", b"I", b"M", b"R", b"L", b"H", b"A"]:
+                    print(f" Invalid Identifier <{identifier}>")
+                    continue
+                Q_list[identifier.decode()] = Q
+            if all(p in Q_list for p in MOTION_POSITIONS):
+                frames.append(Q_list)
+        if len(frames) < 2:
+            print('Recording too short, discarded')
+            continue
+        content.setdefault(str(int(idx)), []).append(frames)
+        print(f'Recorded {len(frames)} frames for Gesture {idx}')
+    with open(file_name, 'w') as f:
+        f.write(json.dumps(content))
 
 def to_file(port: Serial):
     content = {}
@@ -176,13 +226,13 @@ def to_file(port: Serial):
                 Q_list = {}
                 index = 0
                 while index < len(report) - 2:
-                    identifier, quaternions = report[index:index + 1], report[index + 1:index + 9]
+                    identifier = report[index:index + 1]
+                    q0, q1, q2, q3 = struct.unpack_from('<4h', report, index + 1)
                     index += 15
-                    q0 = np.short(quaternions[1] << 8 | quaternions[0]) / 32768
-                    q1 = np.short(quaternions[3] << 8 | quaternions[2]) / 32768
-                    q2 = np.short(quaternions[5] << 8 | quaternions[4]) / 32768
-                    q3 = np.short(quaternions[7] << 8 | quaternions[6]) / 32768
-                    Q = list(np.array([q0, q1, q2, q3]))
+                    if identifier == b"G":
+                        # gesture classified on the glove, not a sensor
+                        continue
+                    Q = [q0 / 32768, q1 / 32768, q2 / 32768, q3 / 32768]
                     if identifier not in [b"T", b"I", b"M", b"R", b"L", b"H", b"A"]:
                         print(f" Invalid Identifier <{identifier}>")
                         continue
@@ -215,6 +265,8 @@ def main():
         print('// Mode 1 for collecting gesture data for building dataset')
         print('// Mode 2 for defining gestures used for l2 algorithm')
         print('// Mode 3 for collecting gesture data to file')
+        print('// Mode 4 for recording motion gestures used for dtw algorithm')
+        print('// Mode 5 for calibrating the neutral pose')
         ret = input('Select mode: ')
         if ret[-1] == 'q':
             exit(1)
@@ -226,6 +278,10 @@ def main():
             collect(ser, 'Mode 2')
         elif ret[-1] == '3':
             to_file(ser)
+        elif ret[-1] == '4':
+            record_motion(ser)
+        elif ret[-1] == '5':
+            calibrate(ser)
         else:
             print('Error: Mode Unsupported!')
 
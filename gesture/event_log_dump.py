@@ -0,0 +1,59 @@
+import argparse
+import binascii
+import struct
+import time
+from serial import Serial
+
+# Record layout of driver/event_log.py on the controllers
+RECORD_FORMAT = '<IIBB22s'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+LEVEL_NAMES = ('I', 'W', 'E')
+CODE_NAMES = ('BOOT', 'EXPECT', 'ASSERT', 'DROPPED')
+
+BEGIN_MARKER = 'EVENT LOG BEGIN'
+END_MARKER = 'EVENT LOG END'
+
+
+def decode_record(record):
+    seq, time_ms, level, code, payload = struct.unpack(RECORD_FORMAT, record)
+    return {
+        'seq': seq,
+        'time_ms': time_ms,
+        'level': LEVEL_NAMES[level] if level < len(LEVEL_NAMES) else str(level),
+        'code': CODE_NAMES[code] if code < len(CODE_NAMES) else str(code),
+        'payload': payload.rstrip(b'\x00').decode(errors='replace'),
+    }
+
+
+def read_records(port: Serial, timeout=10.0):
+    # interrupt whatever is running and ask the REPL to dump the log
+    port.write(b'\x03\x03')
+    time.sleep(0.2)
+    port.reset_input_buffer()
+    port.write(b'import driver.utils as utils; utils.dump_event_log()\r\n')
+    records = []
+    started = False
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        line = port.readline().decode(errors='replace').strip()
+        if line == BEGIN_MARKER:
+            started = True
+        elif line == END_MARKER:
+            return records
+        elif started and len(line) == RECORD_SIZE * 2:
+            records.append(decode_record(binascii.unhexlify(line)))
+    raise TimeoutError('event log dump did not finish')
+
+
+def main(args):
+    port = Serial(args.port, 115200, timeout=1)
+    for record in read_records(port):
+        print('{seq:>8} {time_ms:>10} {level} {code:<8} {payload}'.format(**record))
+    port.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dump the event log of a controller')
+    parser.add_argument('port', type=str, help='serial port of the controller, e.g. /dev/ttyUSB0')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,159 @@
+import argparse
+import os
+import struct
+import sys
+import numpy as np
+import torch
+from dataset import GestureDataset
+from neural import load_model
+
+# Fixed-point model blob, run by primary_controller controller_main functionality/gesture_model.py
+#   header: magic(2) version(1) layer_count(1) input_scale(f32)
+#   layer:  in(u16) out(u16) relu(u8) multiplier(i32) shift(u8) output_scale(f32)
+#           weights(int8 x out x in, row-major) biases(int32 x out)
+# Both sides must agree on every constant below
+MAGIC = b'GM'
+VERSION = 1
+HEADER_FORMAT = '<2sBBf'
+LAYER_FORMAT = '<HHBiBf'
+INT8_MAX = 127
+# glove report records: identifier(1) quaternion(4 x int16) accelerometer(3 x int16), quaternions in 1/32768
+REPORT_FORMAT = '<c4h3h'
+QUATERNION_SCALE = 32768
+# requantisation multipliers are kept below 2^11 so that accumulator times multiplier stays
+# within MicroPython small integers
+MULTIPLIER_BITS = 11
+
+FIRMWARE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'primary_controller', 'controller_main')
+
+
+def linear_layers(net):
+    # (linear, followed by relu) for every linear layer of the network
+    modules = list(net.model)
+    layers = []
+    for i, module in enumerate(modules):
+        if isinstance(module, torch.nn.Linear):
+            relu = i + 1 < len(modules) and isinstance(modules[i + 1], torch.nn.ReLU)
+            layers.append((module, relu))
+    return layers
+
+
+def activation_ranges(net, features):
+    # largest absolute value of the input and of every layer output over the calibration set
+    ranges = [features.abs().max().item()]
+    x = features
+    with torch.no_grad():
+        for linear, relu in linear_layers(net):
+            x = linear(x)
+            if relu:
+                x = torch.relu(x)
+            ranges.append(x.abs().max().item())
+    return [r if r > 0 else 1.0 for r in ranges]
+
+
+def quantize_multiplier(real):
+    # real ~= multiplier / 2^shift with multiplier in [2^(bits - 1), 2^bits)
+    shift = 0
+    while real * (1 << shift) < (1 << (MULTIPLIER_BITS - 1)) and shift < 62:
+        shift += 1
+    multiplier = int(round(real * (1 << shift)))
+    if multiplier >= 1 << MULTIPLIER_BITS:
+        multiplier //= 2
+        shift -= 1
+    return multiplier, shift
+
+
+def export(net, features):
+    ranges = activation_ranges(net, features)
+    input_scale = ranges[0] / INT8_MAX
+    layers = linear_layers(net)
+    blob = bytearray(struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(layers), input_scale))
+    scale_in = input_scale
+    for n, (linear, relu) in enumerate(layers):
+        weight = linear.weight.detach().numpy().astype(np.float64)
+        bias = linear.bias.detach().numpy().astype(np.float64)
+        weight_scale = max(np.abs(weight).max(), 1e-12) / INT8_MAX
+        weight_q = np.clip(np.round(weight / weight_scale), -INT8_MAX, INT8_MAX).astype(np.int8)
+        accumulator_scale = weight_scale * scale_in
+        bias_q = np.round(bias / accumulator_scale).astype(np.int32)
+        if n == len(layers) - 1:
+            # logits stay as accumulators, dequantised by the output scale
+            multiplier, shift, output_scale = 0, 0, accumulator_scale
+        else:
+            output_scale = ranges[n + 1] / INT8_MAX
+            multiplier, shift = quantize_multiplier(accumulator_scale / output_scale)
+        out_size, in_size = weight.shape
+        blob += struct.pack(LAYER_FORMAT, in_size, out_size, int(relu), multiplier, shift, output_scale)
+        blob += weight_q.tobytes()
+        blob += bias_q.astype('<i4').tobytes()
+        scale_in = output_scale
+    return bytes(blob)
+
+
+def report(Q_list, positions):
+    # raw glove report of a frame, the way the glove reads it over I2C, accelerometers left at 0
+    records = bytearray()
+    for identifier in positions.decode():
+        q = np.clip(np.round(np.asarray(Q_list[identifier]) * QUATERNION_SCALE), -32768, 32767).astype(int)
+        records += struct.pack(REPORT_FORMAT, identifier.encode(), *q.tolist(), 0, 0, 0)
+    return bytes(records)
+
+
+def verify(blob_path, net, dataset):
+    # run the firmware module itself on the host, from raw reports of the dataset frames through
+    # load_report and compute_features, and compare against the float model on the host features
+    sys.path.insert(0, FIRMWARE_DIR)
+    from functionality.gesture_model import GestureModel
+    model = GestureModel.load(blob_path)
+    if model is None:
+        print('Exported blob rejected by the firmware loader')
+        return False
+    features = dataset.features
+    with torch.no_grad():
+        probabilities = torch.softmax(net(features), dim=1)
+    expected_gestures = torch.argmax(probabilities, dim=1)
+    agree = 0
+    incomplete = 0
+    feature_error = 0
+    confidence_error = 0
+    for i, (_, Q_list) in enumerate(dataset.data):
+        records = report(Q_list, GestureModel.POSITIONS)
+        if not model.load_report(records + b'\r\n', len(records)):
+            incomplete += 1
+            continue
+        firmware_features = model.compute_features()
+        feature_error = max(feature_error, np.abs(np.array(firmware_features) - features[i].numpy()).max())
+        gesture, confidence = model.infer()
+        agree += gesture == expected_gestures[i].item()
+        confidence_error = max(confidence_error, abs(confidence - 100 * probabilities[i].max().item()))
+    print(f'Fixed-point agrees with PyTorch on {agree}/{len(features)} frames, '
+          f'max feature error {feature_error:.2e}, max confidence error {confidence_error:.1f}%')
+    if incomplete:
+        print(f'{incomplete} reports missing an IMU the firmware needs')
+    return agree == len(features)
+
+
+def main(args):
+    net = load_model(args.model)
+    if net.calibration is not None:
+        # the glove classifies raw readings, it has no calibration to apply
+        print(f'{args.model} was trained on calibrated frames, train it without --calibration for the glove')
+        sys.exit(1)
+    dataset = GestureDataset.from_file(args.dataset)
+    blob = export(net, dataset.features)
+    with open(args.output, 'wb') as f:
+        f.write(blob)
+    print(f'Exported {len(blob)} bytes to {args.output}, copy it to data/gesture.model on controller_main')
+    if args.verify and not verify(args.output, net, dataset):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the neural model to the glove')
+    parser.add_argument('--model', type=str, default='gesture_neural.pt', help='model trained by neural.py')
+    parser.add_argument('--dataset', type=str, default='dataset.json', help='frames used to calibrate activation ranges')
+    parser.add_argument('--output', type=str, default='gesture.model', help='fixed-point model blob')
+    parser.add_argument('--verify', action='store_true', help='compare the firmware inference against PyTorch')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,64 @@
+import struct
+import time
+
+# Binary feedback message, applied by primary_controller controller_peripheral functionality/feedback.py
+#   sync(1) count(1) count x [opcode(1) argument(int8)]
+# Both sides must agree on every constant below
+SYNC = 0xFB
+MAX_ACTIONS = 255
+
+# opcodes
+MOTOR = 1            # argument: vibration pattern, 0 slight, 1 medium, 2 heavy, 3 double, 4 triple
+BUZZER = 2           # argument: sound pattern, 0 double, 1 triple, 2 long, 3 double long
+VOLUME_RELATIVE = 3  # argument: volume change in percent
+VOLUME_ABSOLUTE = 4  # argument: volume in percent
+
+
+def encode(actions):
+    # actions: list of (opcode, argument), argument within int8
+    if len(actions) > MAX_ACTIONS:
+        raise ValueError(f'at most {MAX_ACTIONS} actions per message')
+    frame = bytearray([SYNC, len(actions)])
+    for opcode, argument in actions:
+        frame += struct.pack('Bb', opcode, argument)
+    return bytes(frame)
+
+
+def decode(frame):
+    # host side decoding for debugging, returns None on a malformed message
+    if len(frame) < 2 or frame[0] != SYNC or len(frame) != 2 + 2 * frame[1]:
+        return None
+    return [struct.unpack_from('Bb', frame, i) for i in range(2, len(frame), 2)]
+
+
+class FeedbackThrottle:
+    # Suppresses redundant feedback: an action is sent again only after its repeat interval has passed
+    # since it was last sent, while actions not sent recently go out at once
+    def __init__(self, port, interval_s=1.0, clock=time.monotonic):
+        self.port = port
+        self.interval_s = interval_s
+        self.clock = clock
+        self.last_sent = {}
+        self.sent_count = 0
+        self.suppressed_count = 0
+
+    def filter(self, actions, interval_s=None):
+        interval_s = self.interval_s if interval_s is None else interval_s
+        now = self.clock()
+        allowed = []
+        for action in actions:
+            last = self.last_sent.get(action)
+            if last is not None and now - last < interval_s:
+                self.suppressed_count += 1
+                continue
+            self.last_sent[action] = now
+            allowed.append(action)
+        return allowed
+
+    def send(self, *actions, interval_s=None):
+        # all actions that pass the throttle go out as one message
+        allowed = self.filter(actions, interval_s)
+        if allowed:
+            self.port.write(encode(allowed))
+            self.sent_count += 1
+        return allowed
@@ -1,26 +1,125 @@
 import numpy as np
-from pyquaternion import Quaternion
 from itertools import combinations
+from template_index import TemplateIndex
+import quat
 
+POSITIONS = ['T', 'I', 'M', 'R', 'L', 'H']
 
-def Qdis(Q1: Quaternion, Q2: Quaternion):
-    return Quaternion.sym_distance(Q1, Q2)
+
+def Qdis(Q1, Q2):
+    return quat.sym_distance(Q1, Q2)
 
 
 def l2_vector(Q_finger: dict):
-    f = list()
-    f.append(Quaternion(Q_finger['T']))
-    f.append(Quaternion(Q_finger['I']))
-    f.append(Quaternion(Q_finger['M']))
-    f.append(Quaternion(Q_finger['R']))
-    f.append(Quaternion(Q_finger['L']))
-    f.append(Quaternion(Q_finger['H']))
-
-    l2_v = list()
-    for i in range(len(f)):
-        for j in range(i):
-            l2_v.append(Qdis(f[i], f[j]))
-    return np.array(l2_v)
+    # symmetrised distance between every pair of IMUs, (T, I), (T, M), (I, M), ...
+    return quat.pairwise_sym_distance([Q_finger[p] for p in POSITIONS])
+
+
+def l2_vectors(frames: list):
+    # l2_vector of many frames at once, frames x 15
+    return quat.pairwise_sym_distance([[Q_list[p] for p in POSITIONS] for Q_list in frames])
+
+
+def quaternion_mean(quaternions, weights=None):
+    # Markley mean: eigenvector of the largest eigenvalue of sum(w q q^T), unlike the component mean
+    # it does not depend on the sign of each sample and stays a unit quaternion
+    Q = quat.normalise(quaternions)
+    w = np.ones(len(Q)) if weights is None else np.asarray(weights, dtype=np.float64)
+    _, eigenvectors = np.linalg.eigh((Q * w[:, None]).T @ Q)
+    mean = eigenvectors[:, -1]
+    # keep the sign of the samples so that templates stay readable
+    if np.dot(mean, Q[0]) < 0:
+        mean = -mean
+    return mean
+
+
+def burst_template(frames: list):
+    # average template of a burst of frames, with the mean and variance of every l2 feature
+    template = {p: list(quaternion_mean([Q_list[p] for Q_list in frames])) for p in POSITIONS}
+    vectors = l2_vectors(frames)
+    template['samples'] = len(frames)
+    template['feature_mean'] = list(vectors.mean(axis=0))
+    template['variance'] = list(vectors.var(axis=0))
+    return template
+
+
+def merge_template(old: dict, new: dict):
+    # combine two templates of the same gesture as if all their samples had been captured at once,
+    # templates without statistics count as one sample
+    n_old, n_new = old.get('samples', 1), new.get('samples', 1)
+    merged = {p: list(quaternion_mean([old[p], new[p]], [n_old, n_new])) for p in POSITIONS}
+    mean_old = np.array(old.get('feature_mean', l2_vector(old)))
+    mean_new = np.array(new.get('feature_mean', l2_vector(new)))
+    var_old = np.array(old.get('variance', np.zeros(len(mean_old))))
+    var_new = np.array(new.get('variance', np.zeros(len(mean_new))))
+    n = n_old + n_new
+    delta = mean_new - mean_old
+    merged['samples'] = n
+    merged['feature_mean'] = list(mean_old + delta * n_new / n)
+    merged['variance'] = list((n_old * var_old + n_new * var_new + delta ** 2 * n_old * n_new / n) / n)
+    return merged
+
+
+def feature_scale(database: dict):
+    # Mahalanobis-style weights from the variance of the features pooled over every template,
+    # applied by scaling the features once so that the distance stays euclidean for the index.
+    # Normalised to an average weight of one to keep the meaning of sensitivity
+    total, dof = 0, 0
+    for template in database.values():
+        if template.get('samples', 1) > 1 and 'variance' in template:
+            # stored variances are over the burst, n * variance is the sum of squared deviations
+            total = total + template['samples'] * np.array(template['variance'])
+            dof += template['samples'] - 1
+    if dof == 0:
+        return 1
+    pooled = total / dof
+    # features that hardly vary in the recordings must not dominate the distance
+    pooled = np.maximum(pooled, 0.01 * pooled.mean() + 1e-12)
+    return np.sqrt(pooled.mean() / pooled)
+
+
+class L2Classifier:
+    # nearest template by l2 distance, templates are kept in a vantage-point index so that
+    # a frame far from every gesture is rejected without comparing it to all of them.
+    # Features are weighted by the pooled variance of templates captured in bursts
+    def __init__(self, database: dict, sensitivity):
+        self.scale = feature_scale(database)
+        self.index = TemplateIndex([l2_vector(quaternions) * self.scale for quaternions in database.values()],
+                                   [int(gesture_idx) for gesture_idx in database])
+        self.sensitivity = sensitivity
+
+    def add(self, gesture_idx, quaternions: dict):
+        # a new template of a gesture replaces the previous one, weights are kept as built
+        self.index.remove(int(gesture_idx))
+        self.index.insert(l2_vector(quaternions) * self.scale, int(gesture_idx))
+
+    def classify(self, vector):
+        # sensitivity bounds the squared l2, the index works on the distance itself
+        nearest = self.index.nearest(vector * self.scale, np.sqrt(self.sensitivity))
+        if nearest is None:
+            return 404
+        return nearest[0]
+
+    def scores(self, vector):
+        # (gesture index, squared l2) of every template, for display rather than classification
+        alive = [i for i, alive in enumerate(self.index.alive) if alive]
+        if not alive:
+            return []
+        l2 = np.sum((self.index.vectors[alive] - vector * self.scale) ** 2, axis=1)
+        return [(self.index.labels[i], float(d)) for i, d in zip(alive, l2)]
+
+    def neighbours(self, vector):
+        # (gesture index, squared l2) of every template within sensitivity
+        return [(gesture_idx, distance ** 2)
+                for gesture_idx, distance in self.index.within(vector * self.scale, np.sqrt(self.sensitivity))]
+
+
+def l2_scorer(classifier: L2Classifier, calibration=None):
+    # scores of a raw frame against every template, calibrated first when the glove has been
+    def scorer(Q_list: dict):
+        frame = Q_list if calibration is None else calibration.apply(Q_list)
+        return classifier.scores(l2_vector(frame))
+    return scorer
 
 
 def l2_squared_error(curr_gesture: dict, database: dict, sensitivity):
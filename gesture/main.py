@@ -2,11 +2,18 @@ import argparse
 import json
 import time
 import threading
+import struct
 import subprocess
 import numpy as np
 from serial import Serial
-from l2_squared_error import l2_squared_error
-from pyquaternion import Quaternion
+from l2_squared_error import l2_vector, l2_scorer, L2Classifier
+from temporal import TemporalRecognizer
+from motion import MotionMatcher
+from calibration import Calibration
+from dashboard import Dashboard
+from robot_protocol import RobotEncoder, to_fixed
+import feedback
+import quat
 
 retry_s = 2
 
@@ -38,25 +45,6 @@ controllerPort = "/tmp/ttyBLE10"
 robotPort = "/tmp/ttyBLE11"
 
 
-def Q2Euler(Q: Quaternion):
-    qw, qx, qy, qz = Q.elements
-    sinr_cosp = 2 * (qw * qx + qy * qz)
-    cosr_cosp = 1 - 2 * (qx * qx + qy * qy)
-    roll = np.arctan2(sinr_cosp, cosr_cosp)
-
-    sinp = 2 * (qw * qy - qz * qx)
-    if np.abs(sinp) >= 1:
-        pitch = np.copysign(np.pi / 2, sinp)
-    else:
-        pitch = np.arcsin(sinp)
-
-    siny_cosp = 2 * (qw * qz + qx * qy)
-    cosy_cosp = 1 - 2 * (qy * qy + qz * qz)
-    yaw = np.arctan2(siny_cosp, cosy_cosp)
-
-    return np.array([roll, pitch, yaw])
-
-
 def main(args):
     controller_ble_thread = threading.Thread(target=controller_ble_connect)
     robot_ble_thread = threading.Thread(target=robot_ble_connect)
@@ -73,41 +61,110 @@ def main(args):
 
     Q_list = dict()
 
-    with open('gesture_l2.json', 'r') as f:
-        l2_database = json.load(f)
-
+    if args.method == 'neural':
+        # imported here so that the l2 method does not depend on torch
+        from neural import NeuralClassifier
+        classifier = NeuralClassifier(args.model, args.threshold)
+        frames = []
+    elif args.method == 'l2':
+        with open('gesture_l2.json', 'r') as f:
+            l2_database = json.load(f)
+        l2_classifier = L2Classifier(l2_database, 4)
+    elif args.method == 'motion':
+        matcher = MotionMatcher.from_file('gesture_motion.json', threshold=args.dtw_threshold)
+
+    calibration = Calibration.load(args.calibration)
+    if calibration is None:
+        print(f'No calibration at {args.calibration}, IMU readings are used as read')
+    # pose classifiers see frames calibrated the way their templates or training set were,
+    # the neural model carries its own calibration, glove and motion methods use raw readings
+    pose_calibration = None
+    if args.method == 'l2':
+        pose_calibration = calibration
+    elif args.method == 'neural':
+        pose_calibration = classifier.calibration
+
+    recognizer = None
+    if args.window > 0 and args.method != 'motion':
+        # every frame is classified once and votes within the window, commands follow the vote
+        if args.method == 'neural':
+            classify = classifier.classify
+        elif args.method == 'l2':
+            classify = l2_classifier.classify
+        else:
+            classify = None
+        recognizer = TemporalRecognizer(classify, window=args.window)
+
+    # l2 scores of the frame on screen are computed by the dashboard, not by the control loop
+    scorer = l2_scorer(l2_classifier, pose_calibration) if args.method == 'l2' else None
+    dashboard = Dashboard(f'Method {args.method}', scorer, sensitivity=4)
+    dashboard.start()
+
+    encoder = RobotEncoder()
     count = 0
-    feedback_count = 0
+    throttle = feedback.FeedbackThrottle(controller)
     init_z = 0
     flag_init = True
-    while True:
+    stable = None
+    while dashboard.running:
         controller.flush()
         robot.flush()
         count += 1
         report = controller.read_until(expected=b"\r\n")
         if len(report) % 15 != 2:
+            dashboard.drop()
             continue
         Q_list = {}
+        glove_result = None
+        malformed = False
         index = 0
         while index < len(report) - 2:
             identifier, quaternions = report[index:index + 1], report[index + 1:index + 9]
             index += 15
-            q0 = np.short(quaternions[1] << 8 | quaternions[0]) / 32768
-            q1 = np.short(quaternions[3] << 8 | quaternions[2]) / 32768
-            q2 = np.short(quaternions[5] << 8 | quaternions[4]) / 32768
-            q3 = np.short(quaternions[7] << 8 | quaternions[6]) / 32768
-            Q = list(np.array([q0, q1, q2, q3]))
-            if identifier not in [b"T", b"I", b"M", b"R", b"L", b"H", b"A"]:
-                print(f" Invalid Identifier <{identifier}>")
+            if identifier == b"G":
+                # gesture classified on the glove: gesture, confidence in percent
+                glove_result = (quaternions[0], quaternions[1])
                 continue
-            Q_list[identifier.decode()] = Q
-        # print(f"Hand: {Q2Euler(Quaternion(Q_list['H']))}")
-        if args.method == 'neural':
-            print('use neural')
+            q0, q1, q2, q3 = struct.unpack_from('<4h', quaternions)
+            if identifier not in [b"T", b"I", b"M", b"R", b"L", b"H", b"A"]:
+                malformed = True
+                break
+            Q_list[identifier.decode()] = [q0 / 32768, q1 / 32768, q2 / 32768, q3 / 32768]
+        if malformed:
+            # one drop per report, its frame misses the IMUs of the bad record
+            dashboard.drop()
+            continue
+        dashboard.frame(Q_list)
+        # print(f"Hand: {quat.to_euler(Q_list['H'])}")
+        frame = Q_list if pose_calibration is None else pose_calibration.apply(Q_list)
+        gesture = None
+        if recognizer is not None:
+            if args.method == 'glove':
+                if glove_result is not None:
+                    stable = recognizer.update_label(
+                        glove_result[0] if glove_result[1] >= args.threshold * 100 else 404)
+            else:
+                stable = recognizer.update(l2_vector(frame))
+            if count % 3 == 0:
+                gesture = stable
+        elif args.method == 'neural':
+            # frames between two decisions are classified together in one batch
+            frames.append(frame)
+            if count % 3 == 0:
+                gesture = classifier.predict(frames)
+                frames = []
+        elif args.method == 'motion':
+            # a motion is acted on once, on the frame it completes
+            gesture = matcher.update(Q_list)
         elif args.method == 'l2' and count % 3 == 0:
-            gesture = l2_squared_error(Q_list, l2_database, 4)
-            angle = Q2Euler(Quaternion(Q_list["H"]))
-            print(f'\nPrediction: {gesture}')
+            gesture = l2_classifier.classify(l2_vector(frame))
+        elif args.method == 'glove' and count % 3 == 0 and glove_result is not None:
+            gesture, confidence = glove_result
+            if confidence < args.threshold * 100:
+                gesture = 404
+        if gesture is not None:
+            angle = quat.to_euler(Q_list["H"] if calibration is None else calibration.hand(Q_list))
+            dashboard.prediction(gesture)
             z_move = angle[2] - init_z
             if z_move < -np.pi:
                 z_move += 2 * np.pi
@@ -116,30 +173,18 @@ def main(args):
 
             if gesture == 404:
                 # Feedback System
-                if feedback_count >= 10:
-                    feedback_count = 0
-                    controller.write(b"b,0")
-                else:
-                    feedback_count += 1
+                throttle.send((feedback.BUZZER, 0))
             if gesture == 0:
                 # Feedback System
-                if feedback_count >= 10:
-                    feedback_count = 0
-                    controller.write(b"b,1")
-                else:
-                    feedback_count += 1
+                throttle.send((feedback.BUZZER, 1))
                 # Force hold & init z
                 flag_init = False
                 init_z = angle[2]
-                print("hld|")
-                robot.write(b'hld|')
+                dashboard.command("hld|")
+                robot.write(encoder.encode(hold=True))
             if not flag_init and gesture == 1:
                 # Feedback System
-                if feedback_count >= 10:
-                    feedback_count = 0
-                    controller.write(b"b,2\nm,1")
-                else:
-                    feedback_count += 1
+                throttle.send((feedback.BUZZER, 2), (feedback.MOTOR, 1))
                 # Dead Zone
                 if abs(angle[1] * 220) < 35:
                     angle[1] = 0
@@ -147,39 +192,37 @@ def main(args):
                     angle[0] = 0
                 if abs(z_move * 100) < 25:
                     z_move = 0
-                ch0, ch1, ch2 = int(-angle[1] * 150), int(angle[0] * 150), int(-z_move * 100)
-                ch0_bytes = ch0.to_bytes(2, "big", signed=True)
-                ch1_bytes = ch1.to_bytes(2, "big", signed=True)
-                ch2_bytes = ch2.to_bytes(2, "big", signed=True)
-                buffer = b'chs|' + ch0_bytes + ch1_bytes + ch2_bytes
-                print(buffer)
-                robot.write(buffer)
+                chassis = (to_fixed(-angle[1], 150), to_fixed(angle[0], 150), to_fixed(-z_move, 100))
+                dashboard.command(f"chs|{chassis}")
+                robot.write(encoder.encode(chassis=chassis))
             if not flag_init and gesture == 2:
                 # Feedback System
-                if feedback_count >= 5:
-                    feedback_count = 0
-                    controller.write(b"m,3")
-                else:
-                    feedback_count += 1
+                throttle.send((feedback.MOTOR, 3), interval_s=0.5)
                 # Dead Zone
                 if abs(angle[0] * 150) < 20:
                     angle[0] = 0
                 if abs(z_move * 100) < 22:
                     z_move = 0
-                ch3, ch2 = int(angle[0] * 150), int(-z_move * 100)
-                ch3_bytes = ch3.to_bytes(2, "big", signed=True)
-                ch2_bytes = ch2.to_bytes(2, "big", signed=True)
-                buffer = b'gim|' + ch3_bytes + ch2_bytes
-                print(buffer)
-                robot.write(buffer)
+                gimbal = (to_fixed(angle[0], 150), to_fixed(-z_move, 100))
+                dashboard.command(f"gim|{gimbal}")
+                robot.write(encoder.encode(gimbal=gimbal))
             if not flag_init and gesture == 3:
-                print("sho|")
-                robot.write(b"sho|")
-            print(u'{}[2J{}[;H'.format(chr(27), chr(27)), end='')
+                dashboard.command("sho|")
+                robot.write(encoder.encode(shoot=True))
+    dashboard.stop()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='ECE 445 Project')
-    parser.add_argument('--method', type=str, default='l2', help='gesture recognition method, [l2]')
+    parser.add_argument('--method', type=str, default='l2', help='gesture recognition method, [l2, neural, glove, motion]')
+    parser.add_argument('--model', type=str, default='gesture_neural.pt', help='model trained by neural.py')
+    parser.add_argument('--window', type=int, default=0,
+                        help='frames voting on each gesture, 0 to act on single predictions')
+    parser.add_argument('--threshold', type=float, default=0.6,
+                        help='minimum probability for a neural or glove prediction, 404 below')
+    parser.add_argument('--calibration', type=str, default='calibration.json',
+                        help='neutral pose recorded in Mode 5 of esp32.py, for l2 templates and hand angles')
+    parser.add_argument('--dtw_threshold', type=float, default=0.2,
+                        help='maximum dtw distance per frame for a motion gesture')
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,180 @@
+import json
+import numpy as np
+import quat
+
+# IMUs a motion frame is built from, each contributes its rotation matrix
+POSITIONS = ['T', 'I', 'M', 'R', 'L', 'H']
+FRAME_SIZE = 9 * len(POSITIONS)
+
+
+def frame_vector(Q_list):
+    # rotation matrices of all IMUs side by side, unlike quaternions they do not jump between q and -q
+    # and their squared distance grows smoothly with the angle between two orientations
+    return quat.rotation_matrix([Q_list[p] for p in POSITIONS]).reshape(-1)
+
+
+def load_templates(file_name):
+    # gesture_motion.json maps gesture index to a list of recordings, a recording is a list of frames
+    with open(file_name, 'r') as f:
+        content = json.load(f)
+    templates = []
+    for tag, recordings in content.items():
+        for frames in recordings:
+            templates.append((int(tag), np.array([frame_vector(Q_list) for Q_list in frames])))
+    return templates
+
+
+def envelope(sequence, band):
+    # upper and lower bound of every dimension within the warping band around each frame
+    length = len(sequence)
+    upper = np.empty_like(sequence)
+    lower = np.empty_like(sequence)
+    for i in range(length):
+        window = sequence[max(0, i - band):min(length, i + band + 1)]
+        upper[i] = window.max(axis=0)
+        lower[i] = window.min(axis=0)
+    return upper, lower
+
+
+def dtw(cost, band, bound=np.inf, tail=None):
+    # DTW over a squared distance matrix (candidate frames x template frames) inside a Sakoe-Chiba band,
+    # abandoned as soon as every path of a row, plus the lower bound of the rows left, reaches bound
+    length = len(cost)
+    rows = cost.tolist()
+    previous = [np.inf] * length
+    for i in range(length):
+        row = rows[i]
+        current = [np.inf] * length
+        left = np.inf
+        row_min = np.inf
+        for j in range(max(0, i - band), min(length, i + band + 1)):
+            if i == 0 and j == 0:
+                best = 0.0
+            else:
+                best = left
+                if previous[j] < best:
+                    best = previous[j]
+                if j > 0 and previous[j - 1] < best:
+                    best = previous[j - 1]
+            left = row[j] + best
+            current[j] = left
+            if left < row_min:
+                row_min = left
+        if row_min + (tail[i + 1] if tail is not None else 0) >= bound:
+            return np.inf
+        previous = current
+    return previous[-1]
+
+
+class MotionMatcher:
+    # Matches the live stream against recorded motion templates with subsequence DTW: the last m frames,
+    # m being the template length, are compared to every template each frame. Candidates go through
+    # LB_Kim, then LB_Keogh, then DTW with early abandoning, each step only runs when the previous bound
+    # is below the best distance so far, so most templates never reach the quadratic step.
+    # Distances are normalised by the template length, a match needs a distance below threshold.
+    def __init__(self, templates=(), threshold=0.2, band_ratio=0.1, prune=True):
+        self.threshold = threshold
+        self.band_ratio = band_ratio
+        self.prune = prune
+        self.labels = []
+        self.sequences = []
+        self.bands = []
+        self.envelopes = []
+        self.lengths = np.empty(0, dtype=np.int64)
+        self.firsts = np.empty((0, FRAME_SIZE))
+        self.lasts = np.empty((0, FRAME_SIZE))
+        self.capacity = 0
+        self.history = np.empty((0, FRAME_SIZE))
+        self.head = 0
+        self.filled = 0
+        # candidates stopped at each stage, for the benchmark
+        self.stats = {'lb_kim': 0, 'lb_keogh': 0, 'abandoned': 0, 'dtw': 0}
+        for label, sequence in templates:
+            self.add_template(label, sequence)
+
+    @classmethod
+    def from_file(cls, file_name, **kwargs):
+        return cls(load_templates(file_name), **kwargs)
+
+    def add_template(self, label, sequence):
+        # sequence: frames x FRAME_SIZE, see frame_vector
+        sequence = np.ascontiguousarray(sequence, dtype=np.float64)
+        if sequence.ndim != 2 or sequence.shape[1] != FRAME_SIZE or len(sequence) < 2:
+            raise ValueError('a template needs at least 2 frames of FRAME_SIZE values')
+        band = max(1, int(np.ceil(self.band_ratio * len(sequence))))
+        self.labels.append(label)
+        self.sequences.append(sequence)
+        self.bands.append(band)
+        self.envelopes.append(envelope(sequence, band))
+        self.lengths = np.append(self.lengths, len(sequence))
+        self.firsts = np.vstack([self.firsts, sequence[:1]])
+        self.lasts = np.vstack([self.lasts, sequence[-1:]])
+        if len(sequence) > self.capacity:
+            self.capacity = len(sequence)
+            self.reset()
+
+    def reset(self):
+        # history is stored twice in a row so that the last m frames are always one contiguous slice
+        self.history = np.zeros((2 * self.capacity, FRAME_SIZE))
+        self.head = 0
+        self.filled = 0
+
+    def update(self, Q_list):
+        # add one frame, returns the matched gesture or None
+        return self.update_vector(frame_vector(Q_list))
+
+    def update_vector(self, vector):
+        if self.capacity == 0:
+            return None
+        self.history[self.head] = vector
+        self.history[self.head + self.capacity] = vector
+        newest = self.head + self.capacity
+        self.head = (self.head + 1) % self.capacity
+        self.filled = min(self.filled + 1, self.capacity)
+        label, _ = self.search(newest)
+        if label is not None:
+            # the frames of a matched motion must not match again
+            self.reset()
+        return label
+
+    def search(self, newest):
+        # best (label, normalised distance) among templates ending at history[newest]
+        ready = np.nonzero(self.lengths <= self.filled)[0]
+        if len(ready) == 0:
+            return None, np.inf
+        lengths = self.lengths[ready]
+        # LB_Kim: first and last frames are on every warping path, computed for all templates at once
+        lb_kim = np.sum((self.history[newest - lengths + 1] - self.firsts[ready]) ** 2, axis=1) + \
+            np.sum((self.history[newest] - self.lasts[ready]) ** 2, axis=1)
+        lb_kim /= lengths
+        best_label, best = None, self.threshold
+        # most promising templates first so that the bound tightens early
+        order = np.argsort(lb_kim, kind='stable')
+        for rank, k in enumerate(order):
+            if self.prune and lb_kim[k] >= best:
+                # sorted, every remaining template is pruned too
+                self.stats['lb_kim'] += len(order) - rank
+                break
+            n = ready[k]
+            length = int(lengths[k])
+            candidate = self.history[newest - length + 1:newest + 1]
+            bound = best * length
+            tail = None
+            if self.prune:
+                # LB_Keogh: candidate frames outside the template envelope, kept per row for DTW
+                upper, lower = self.envelopes[n]
+                rows = np.sum(np.maximum(candidate - upper, 0) ** 2 + np.maximum(lower - candidate, 0) ** 2,
+                              axis=1)
+                tail = np.append(np.cumsum(rows[::-1])[::-1], 0.0)
+                if tail[0] >= bound:
+                    self.stats['lb_keogh'] += 1
+                    continue
+            template = self.sequences[n]
+            cost = np.sum((candidate[:, None, :] - template[None, :, :]) ** 2, axis=2)
+            distance = dtw(cost, self.bands[n], bound if self.prune else np.inf, tail)
+            if distance >= bound:
+                self.stats['abandoned' if distance == np.inf else 'dtw'] += 1
+                continue
+            self.stats['dtw'] += 1
+            best_label, best = self.labels[n], distance / length
+        return best_label, best
@@ -0,0 +1,119 @@
+import argparse
+import time
+import numpy as np
+from motion import MotionMatcher, POSITIONS, FRAME_SIZE
+import quat
+
+# Synthetic benchmark of the motion matcher: a library of random smooth trajectories, several recordings
+# of each gesture, and a stream of idle motion with time-warped, noisy copies of some templates played into it.
+# The pruned matcher must report exactly what the exhaustive one does.
+
+
+def rotation_step(rng, scale):
+    # small random rotation as a quaternion
+    axis = rng.normal(size=3)
+    axis /= np.linalg.norm(axis)
+    angle = rng.normal(scale=scale)
+    return np.concatenate([[np.cos(angle / 2)], np.sin(angle / 2) * axis])
+
+
+def trajectory(rng, length, scale, start=None):
+    # every IMU turns with its own slowly changing angular velocity
+    frames = np.empty((length, len(POSITIONS), 4))
+    q = [rotation_step(rng, np.pi) for _ in POSITIONS] if start is None else list(start)
+    velocity = [rotation_step(rng, scale) for _ in POSITIONS]
+    for t in range(length):
+        for p in range(len(POSITIONS)):
+            velocity[p] = quat.normalise(quat.multiply(velocity[p], rotation_step(rng, scale / 4)))
+            q[p] = quat.multiply(q[p], velocity[p])
+            frames[t, p] = q[p]
+    return frames
+
+
+def to_vectors(frames):
+    return quat.rotation_matrix(frames).reshape(len(frames), FRAME_SIZE)
+
+
+def warp(rng, frames, noise):
+    # replay with local speed changes and sensor noise, over as many frames as the original
+    speed = np.clip(1 + np.cumsum(rng.normal(scale=0.05, size=len(frames) - 1)), 0.75, 1.25)
+    positions = np.concatenate([[0], np.cumsum(speed)]) * (len(frames) - 1) / np.sum(speed)
+    warped = np.array([frames[int(round(x))] for x in positions])
+    warped = warped + rng.normal(scale=noise, size=warped.shape)
+    return quat.normalise(warped)
+
+
+def build(args, rng):
+    templates = []
+    for label in range(args.gestures):
+        length = int(rng.integers(args.min_length, args.max_length + 1))
+        base = trajectory(rng, length, 0.1)
+        for _ in range(args.templates // args.gestures):
+            recording = warp(rng, base, args.spread)
+            templates.append((label, recording))
+    stream = []
+    expected = []
+    while len(stream) < args.frames:
+        idle = trajectory(rng, int(rng.integers(20, 60)), 0.02)
+        stream.extend(to_vectors(idle))
+        label, recording = templates[int(rng.integers(len(templates)))]
+        stream.extend(to_vectors(warp(rng, recording, args.noise)))
+        expected.append((len(stream) - 1, label))
+    templates = [(label, to_vectors(frames)) for label, frames in templates]
+    return templates, np.array(stream[:args.frames]), expected
+
+
+def run(matcher, stream):
+    matches = []
+    times = []
+    for t, vector in enumerate(stream):
+        start = time.perf_counter()
+        label = matcher.update_vector(vector)
+        times.append(time.perf_counter() - start)
+        if label is not None:
+            matches.append((t, label))
+    return matches, np.array(times) * 1000
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    templates, stream, expected = build(args, rng)
+    print(f'{len(templates)} templates of {args.gestures} gestures, {args.min_length}-{args.max_length} frames, '
+          f'{len(stream)} frames, '
+          f'{len(expected)} motions played')
+
+    pruned = MotionMatcher(templates, threshold=args.threshold)
+    pruned_matches, pruned_times = run(pruned, stream)
+    candidates = sum(pruned.stats.values())
+    print(f'pruned:     {pruned_times.mean():7.3f} ms/frame mean, {pruned_times.max():7.3f} ms max')
+    for stage, count in pruned.stats.items():
+        print(f'  stopped at {stage:9s} {count:8d} ({100 * count / max(candidates, 1):5.1f}%)')
+
+    if not args.skip_exhaustive:
+        exhaustive = MotionMatcher(templates, threshold=args.threshold, prune=False)
+        exhaustive_matches, exhaustive_times = run(exhaustive, stream)
+        print(f'exhaustive: {exhaustive_times.mean():7.3f} ms/frame mean, {exhaustive_times.max():7.3f} ms max, '
+              f'speedup {exhaustive_times.mean() / pruned_times.mean():.1f}x')
+        print('same matches as exhaustive search' if pruned_matches == exhaustive_matches
+              else 'MISMATCH with exhaustive search')
+
+    expected_ends = dict(expected)
+    hits = sum(1 for t, label in pruned_matches
+               if any(expected_ends.get(end) == label for end in range(t, t + args.max_length)))
+    print(f'{len(pruned_matches)} matches, {hits} of them on a played motion')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the motion gesture matcher')
+    parser.add_argument('--templates', type=int, default=300, help='size of the synthetic library')
+    parser.add_argument('--gestures', type=int, default=30, help='gestures the templates are recordings of')
+    parser.add_argument('--frames', type=int, default=1000, help='length of the stream')
+    parser.add_argument('--min_length', type=int, default=20, help='shortest template in frames')
+    parser.add_argument('--max_length', type=int, default=50, help='longest template in frames')
+    parser.add_argument('--spread', type=float, default=0.03, help='noise between recordings of a gesture')
+    parser.add_argument('--noise', type=float, default=0.01, help='sensor noise of played motions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='match threshold of the matcher')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip_exhaustive', action='store_true', help='only run the pruned matcher')
+    args = parser.parse_args()
+    main(args)
@@ -4,10 +4,12 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.utils.data as data
-from dataset import GestureDataset
+from dataset import GestureDataset, features
+from calibration import Calibration
 
 learning_rate = 0.005
 num_lables = 8
+unknown_gesture = 404
 
 
 class NeuralNet(nn.Module):
@@ -37,20 +39,25 @@ class NeuralNet(nn.Module):
         return loss
 
 
-def fit(train_set, train_labels, dev_set, n_iter, batch_size=100):
-    net = NeuralNet(learning_rate, nn.CrossEntropyLoss(), train_set.shape[1], num_lables)
+def fit(train_loader, dev_loader, n_iter, lrate=learning_rate):
+    in_size = train_loader.dataset[0][0].shape[0]
+    net = NeuralNet(lrate, nn.CrossEntropyLoss(), in_size, num_lables)
 
     losses = np.empty(n_iter)
     for epoch in range(n_iter):
-        batch_set = train_set.split(batch_size)
-        batch_labels = train_labels.split(batch_size)
-        for i in range(len(batch_set) - 1):
-            net.step(batch_set[i], batch_labels[i])
-        losses[epoch] = net.step(batch_set[-1], batch_labels[-1])
+        epoch_loss = 0
+        for batch_set, batch_labels in train_loader:
+            epoch_loss += net.step(batch_set, batch_labels).item() * len(batch_labels)
+        losses[epoch] = epoch_loss / len(train_loader.dataset)
 
-    yhats = torch.argmax(net.forward(dev_set), dim=1).tolist()
+    yhats = []
+    dev_labels = []
+    with torch.no_grad():
+        for batch_set, batch_labels in dev_loader:
+            yhats += torch.argmax(net.forward(batch_set), dim=1).tolist()
+            dev_labels += batch_labels.tolist()
 
-    return losses, yhats, net
+    return losses, np.array(yhats), np.array(dev_labels), net
 
 
 def compute_accuracies(predicted_labels, dev_set, dev_labels):
@@ -72,25 +79,98 @@ def compute_accuracies(predicted_labels, dev_set, dev_labels):
     return accuracy, f1, precision, recall
 
 
-def load_json():
-    return list()
-
-
-def load_dataset():
-    dataset = GestureDataset
-    X = A['data']
-    Y = A['label']
-
-    data.random_split(dataset, [len(dataset)])
-
-    # animals = [2, 3, 4, 5, 6, 7]
-    # Y = np.array([float(Y[i] in animals) for i in range(len(Y))])
-    # Y_test = np.array([float(Y_test[i] in animals) for i in range(len(Y_test))])
-
-    return X, Y, X_test, Y_test
+def load_dataset(file_name, dev_ratio, seed=0, use_cache=True, calibration=None):
+    dataset = GestureDataset.from_file(file_name, use_cache, calibration)
+    dev_size = int(len(dataset) * dev_ratio)
+    generator = torch.Generator().manual_seed(seed)
+    return data.random_split(dataset, [len(dataset) - dev_size, dev_size], generator=generator)
+
+
+def batch_loader(dataset, batch_size, shuffle=False):
+    # the sampler yields whole batches of indices, each batch is fetched with a single __getitem__
+    sampler = data.RandomSampler(dataset) if shuffle else data.SequentialSampler(dataset)
+    return data.DataLoader(dataset, sampler=data.BatchSampler(sampler, batch_size, drop_last=False),
+                           batch_size=None)
+
+
+def save_model(net, file_name, calibration=None):
+    # the calibration the model was trained with is stored along, frames must be calibrated the same way
+    torch.save({'in_size': net.model[0].in_features, 'out_size': net.model[-1].out_features,
+                'state_dict': net.state_dict(),
+                'calibration': None if calibration is None else calibration.references}, file_name)
+
+
+def load_model(file_name):
+    checkpoint = torch.load(file_name)
+    net = NeuralNet(learning_rate, nn.CrossEntropyLoss(), checkpoint['in_size'], checkpoint['out_size'])
+    net.load_state_dict(checkpoint['state_dict'])
+    net.eval()
+    references = checkpoint.get('calibration')
+    net.calibration = None if references is None else Calibration(references)
+    return net
+
+
+class NeuralClassifier:
+    # classifies a batch of frames in one forward pass, the frames vote by averaged probability
+    def __init__(self, file_name, threshold=0.6):
+        self.net = load_model(file_name)
+        self.threshold = threshold
+        # frames are classified after this calibration, None for a model trained on raw readings
+        self.calibration = self.net.calibration
+
+    def predict(self, frames):
+        batch = torch.from_numpy(np.stack([features(Q_list) for Q_list in frames]))
+        with torch.no_grad():
+            probabilities = torch.softmax(self.net(batch), dim=1).mean(dim=0)
+        confidence, gesture = torch.max(probabilities, dim=0)
+        if confidence.item() < self.threshold:
+            return unknown_gesture
+        return gesture.item()
+
+    def classify(self, feature_vector):
+        # single frame given as features, for the temporal recognizer, l2_vector and smoothed
+        # features are float64 while the network is float32
+        batch = torch.as_tensor(feature_vector, dtype=torch.float32).unsqueeze(0)
+        with torch.no_grad():
+            probabilities = torch.softmax(self.net(batch), dim=1)[0]
+        confidence, gesture = torch.max(probabilities, dim=0)
+        if confidence.item() < self.threshold:
+            return unknown_gesture
+        return gesture.item()
+
+
+def main(args):
+    calibration = None
+    if args.calibration:
+        calibration = Calibration.load(args.calibration)
+        if calibration is None:
+            print(f'No calibration at {args.calibration}')
+            return
+    train_set, dev_set = load_dataset(args.dataset, args.dev_ratio, use_cache=not args.no_cache,
+                                      calibration=calibration)
+    if len(dev_set) == 0:
+        print('Dataset too small to hold out a dev set')
+        return
+    train_loader = batch_loader(train_set, args.batch_size, shuffle=True)
+    dev_loader = batch_loader(dev_set, args.batch_size)
+    losses, yhats, dev_labels, net = fit(train_loader, dev_loader, args.max_iter, args.lrate)
+    print(f'Final training loss: {losses[-1]:.4f}')
+    print(f'Dev accuracy: {np.mean(yhats == dev_labels):.4f} on {len(dev_labels)} frames')
+    save_model(net, args.output, calibration)
+    print(f'Model saved to {args.output}')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Neural Method')
-    parser.add_argument('--lrate', type=float, help='learning rate')
-    parser.add_argument('--max_iter', types=int, help='maximum iterations')
+    parser.add_argument('--lrate', type=float, default=learning_rate, help='learning rate')
+    parser.add_argument('--max_iter', type=int, default=200, help='maximum iterations')
+    parser.add_argument('--batch_size', type=int, default=32, help='training batch size')
+    parser.add_argument('--dev_ratio', type=float, default=0.2, help='fraction of frames held out for dev')
+    parser.add_argument('--dataset', type=str, default='dataset.json', help='recorded gesture frames')
+    parser.add_argument('--no_cache', action='store_true', help='recompute features instead of using the cache')
+    parser.add_argument('--output', type=str, default='gesture_neural.pt', help='trained model file')
+    parser.add_argument('--calibration', type=str, default='',
+                        help='neutral pose recorded in Mode 5 of esp32.py, applied to the dataset and stored '
+                             'with the model, leave out for models exported to the glove')
+    args = parser.parse_args()
+    main(args)
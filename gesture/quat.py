@@ -0,0 +1,86 @@
+import math
+import numpy as np
+
+# Quaternion math on arrays of shape (..., 4) with (w, x, y, z) in the last axis.
+# Results match pyquaternion, without building a Quaternion object per IMU per frame.
+
+
+def normalise(q):
+    q = np.asarray(q, dtype=np.float64)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def conjugate(q):
+    q = np.asarray(q, dtype=np.float64)
+    return q * np.array([1.0, -1.0, -1.0, -1.0])
+
+
+def multiply(a, b):
+    # hamilton product a * b
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    w1, x1, y1, z1 = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    w2, x2, y2, z2 = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+    return np.stack([w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2], axis=-1)
+
+
+def to_euler(q):
+    # (roll, pitch, yaw) in radians, pitch saturates at +-pi/2 in gimbal lock
+    q = np.asarray(q, dtype=np.float64)
+    if q.ndim == 1:
+        # a single quaternion per frame, math is several times faster than numpy on 0-d values
+        qw, qx, qy, qz = q.tolist()
+        return np.array([math.atan2(2 * (qw * qx + qy * qz), 1 - 2 * (qx * qx + qy * qy)),
+                         math.asin(min(1.0, max(-1.0, 2 * (qw * qy - qz * qx)))),
+                         math.atan2(2 * (qw * qz + qx * qy), 1 - 2 * (qy * qy + qz * qz))])
+    qw, qx, qy, qz = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    roll = np.arctan2(2 * (qw * qx + qy * qz), 1 - 2 * (qx * qx + qy * qy))
+    pitch = np.arcsin(np.clip(2 * (qw * qy - qz * qx), -1, 1))
+    yaw = np.arctan2(2 * (qw * qz + qx * qy), 1 - 2 * (qy * qy + qz * qz))
+    return np.stack([roll, pitch, yaw], axis=-1)
+
+
+def rotation_matrix(q):
+    # (..., 3, 3) rotation matrices of the normalised quaternions
+    w, x, y, z = np.moveaxis(normalise(q), -1, 0)
+    return np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+                     2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+                     2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)],
+                    axis=-1).reshape(w.shape + (3, 3))
+
+
+def distance(q0, q1):
+    # intrinsic geodesic distance, norm of log(q0^-1 q1): the log of the norm ratio combined with
+    # the angle between q0 and q1 on the hypersphere, q and -q are pi apart
+    q0 = np.asarray(q0, dtype=np.float64)
+    q1 = np.asarray(q1, dtype=np.float64)
+    n0 = np.linalg.norm(q0, axis=-1)
+    n1 = np.linalg.norm(q1, axis=-1)
+    # angle from both sine and cosine, arccos alone loses precision for close quaternions
+    dot = np.sum(q0 * q1, axis=-1)
+    cross = np.linalg.norm(multiply(conjugate(q0), q1)[..., 1:], axis=-1)
+    angle = np.arctan2(cross, dot)
+    return np.sqrt(np.log(n1 / n0) ** 2 + angle ** 2)
+
+
+def sym_distance(q0, q1):
+    # symmetrised geodesic distance, the same length as the intrinsic one
+    return distance(q0, q1)
+
+
+def absolute_distance(q0, q1):
+    # chord between q0 and the closer of q1 and -q1
+    q0 = np.asarray(q0, dtype=np.float64)
+    q1 = np.asarray(q1, dtype=np.float64)
+    return np.minimum(np.linalg.norm(q0 - q1, axis=-1), np.linalg.norm(q0 + q1, axis=-1))
+
+
+def pairwise_sym_distance(q):
+    # symmetrised distance between every pair of the n quaternions in (..., n, 4),
+    # pairs (i, j) with j < i in row order, (..., n * (n - 1) / 2)
+    q = np.asarray(q, dtype=np.float64)
+    i, j = np.tril_indices(q.shape[-2], -1)
+    return sym_distance(q[..., i, :], q[..., j, :])
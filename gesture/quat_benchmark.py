@@ -0,0 +1,100 @@
+import argparse
+import time
+import numpy as np
+from pyquaternion import Quaternion
+import quat
+from l2_squared_error import POSITIONS, l2_vector, l2_vectors
+
+# Checks quat.py against pyquaternion on random quaternions, then times the per-frame work of the
+# l2 method and of the robot control against the pyquaternion versions they replace.
+
+
+def reference_euler(q):
+    qw, qx, qy, qz = Quaternion(q).elements
+    roll = np.arctan2(2 * (qw * qx + qy * qz), 1 - 2 * (qx * qx + qy * qy))
+    sinp = 2 * (qw * qy - qz * qx)
+    pitch = np.copysign(np.pi / 2, sinp) if np.abs(sinp) >= 1 else np.arcsin(sinp)
+    yaw = np.arctan2(2 * (qw * qz + qx * qy), 1 - 2 * (qy * qy + qz * qz))
+    return np.array([roll, pitch, yaw])
+
+
+def reference_l2_vector(Q_list):
+    f = [Quaternion(Q_list[p]) for p in POSITIONS]
+    return np.array([Quaternion.sym_distance(f[i], f[j]) for i in range(len(f)) for j in range(i)])
+
+
+def check(rng, count):
+    a = rng.normal(size=(count, 4))
+    b = rng.normal(size=(count, 4))
+    # close pairs exercise the small angle path
+    b[:count // 10] = a[:count // 10] + rng.normal(scale=1e-6, size=(count // 10, 4))
+    units = quat.normalise(a)
+    errors = {
+        'multiply': max(np.abs(quat.multiply(x, y) - (Quaternion(x) * Quaternion(y)).elements).max()
+                        for x, y in zip(a, b)),
+        'normalise': max(np.abs(quat.normalise(x) - Quaternion(x).normalised.elements).max() for x in a),
+        'rotation_matrix': max(np.abs(quat.rotation_matrix(x) - Quaternion(x).rotation_matrix).max() for x in a),
+        'to_euler': max(np.abs(quat.to_euler(x) - reference_euler(x)).max() for x in units),
+        'distance': max(abs(quat.distance(x, y) - Quaternion.distance(Quaternion(x), Quaternion(y)))
+                        for x, y in zip(a, b)),
+        'sym_distance': max(abs(quat.sym_distance(x, y) - Quaternion.sym_distance(Quaternion(x), Quaternion(y)))
+                            for x, y in zip(a, b)),
+        'absolute_distance': max(abs(quat.absolute_distance(x, y) -
+                                     Quaternion.absolute_distance(Quaternion(x), Quaternion(y)))
+                                 for x, y in zip(a, b)),
+    }
+    frames = [{p: list(q) for p, q in zip(POSITIONS, rng.normal(size=(len(POSITIONS), 4)))}
+              for _ in range(count // 10)]
+    errors['l2_vector'] = max(np.abs(l2_vector(Q_list) - reference_l2_vector(Q_list)).max() for Q_list in frames)
+    errors['l2_vectors'] = np.abs(l2_vectors(frames) - np.array([reference_l2_vector(Q_list)
+                                                               for Q_list in frames])).max()
+    # batch results must be the single results stacked
+    errors['batch'] = np.abs(quat.to_euler(units) - np.array([quat.to_euler(x) for x in units])).max()
+    return errors
+
+
+def timed(function, frames, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for Q_list in frames:
+            function(Q_list)
+    return (time.perf_counter() - start) / (repeat * len(frames)) * 1e6
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    failed = False
+    for name, error in check(rng, args.count).items():
+        ok = error < args.tolerance
+        failed |= not ok
+        print(f'{name:18s} max error {error:.2e} {"ok" if ok else "FAIL"}')
+
+    frames = [{p: list(q) for p, q in zip(POSITIONS, quat.normalise(rng.normal(size=(len(POSITIONS), 4))))}
+              for _ in range(args.frames)]
+    print(f'\nper frame over {args.frames} frames, microseconds')
+    for name, old, new in [
+            ('l2_vector', reference_l2_vector, l2_vector),
+            ('hand euler angles', lambda Q_list: reference_euler(Q_list['H']),
+             lambda Q_list: quat.to_euler(Q_list['H']))]:
+        old_time = timed(old, frames, args.repeat)
+        new_time = timed(new, frames, args.repeat)
+        print(f'{name:18s} pyquaternion {old_time:8.1f}  quat {new_time:8.1f}  speedup {old_time / new_time:5.1f}x')
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        l2_vectors(frames)
+    batch_time = (time.perf_counter() - start) / (args.repeat * len(frames)) * 1e6
+    print(f'{"l2_vectors batch":18s} {batch_time:8.2f} per frame, used to build datasets')
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check and benchmark quat.py against pyquaternion')
+    parser.add_argument('--count', type=int, default=2000, help='random quaternions checked')
+    parser.add_argument('--frames', type=int, default=500, help='frames timed')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=1e-8,
+                        help='maximum error against pyquaternion, which loses precision in arccos for close pairs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    main(args)
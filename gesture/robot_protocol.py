@@ -0,0 +1,79 @@
+import struct
+
+# Binary robot command frame, decoded by secondary_controller functionality/robot_protocol.py
+#   sync(1) seq(1) mask(1) chassis(3 x int16) gimbal(2 x int16) crc8(1), big-endian
+# Both sides must agree on every constant below
+SYNC = 0xA5
+FORMAT = '>BBB3h2h'
+FRAME_SIZE = struct.calcsize(FORMAT) + 1
+CRC8_POLY = 0x07
+
+# channel mask bits, several channels can be carried by one frame
+CHASSIS = 0x01
+GIMBAL = 0x02
+SHOOTER = 0x04
+HOLD = 0x08
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+
+def _crc8_table():
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC8_POLY) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table[i] = crc
+    return bytes(table)
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def to_fixed(value, scale):
+    # round to nearest and saturate, so out of range values never wrap around
+    return max(INT16_MIN, min(INT16_MAX, int(round(value * scale))))
+
+
+class RobotEncoder:
+    def __init__(self):
+        self.seq = 0
+
+    def encode(self, chassis=None, gimbal=None, shoot=False, hold=False):
+        # chassis: 3 fixed-point channels, gimbal: 2 fixed-point channels, None if not commanded
+        mask = 0
+        if chassis is not None:
+            mask |= CHASSIS
+        if gimbal is not None:
+            mask |= GIMBAL
+        if shoot:
+            mask |= SHOOTER
+        if hold:
+            mask |= HOLD
+        chassis = chassis if chassis is not None else (0, 0, 0)
+        gimbal = gimbal if gimbal is not None else (0, 0)
+        frame = struct.pack(FORMAT, SYNC, self.seq, mask, *chassis, *gimbal)
+        self.seq = (self.seq + 1) & 0xFF
+        return frame + bytes([crc8(frame)])
+
+
+def decode(frame):
+    # host side decoding for debugging, returns None on a corrupted frame
+    if len(frame) != FRAME_SIZE or frame[0] != SYNC or crc8(frame[:-1]) != frame[-1]:
+        return None
+    _, seq, mask, c0, c1, c2, g0, g1 = struct.unpack(FORMAT, frame[:-1])
+    return {
+        'seq': seq,
+        'chassis': (c0, c1, c2) if mask & CHASSIS else None,
+        'gimbal': (g0, g1) if mask & GIMBAL else None,
+        'shoot': bool(mask & SHOOTER),
+        'hold': bool(mask & HOLD),
+    }
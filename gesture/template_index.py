@@ -0,0 +1,136 @@
+import numpy as np
+
+
+class Node:
+    # inner node: templates closer to the vantage point than radius go inside, the others outside
+    # leaf: bucket of template ids, vantage is None
+    def __init__(self, vantage=None, radius=0.0, inside=None, outside=None, bucket=None):
+        self.vantage = vantage
+        self.radius = radius
+        self.inside = inside
+        self.outside = outside
+        self.bucket = bucket
+
+
+class TemplateIndex:
+    # Vantage-point tree over template feature vectors with euclidean distance.
+    # Queries prune every subtree the triangle inequality rules out, so a query with a radius, like the
+    # sensitivity of the l2 method, is answered without measuring the distance to every template.
+    # Templates are added and removed in place, only the bucket or subtree they land in is rebuilt.
+    def __init__(self, vectors=(), labels=(), leaf_size=8):
+        self.leaf_size = leaf_size
+        self.vectors = np.empty((0, 0))
+        self.labels = []
+        self.alive = []
+        self.removed = 0
+        self.root = Node(bucket=[])
+        self.evaluations = 0  # distances computed by queries, to check pruning
+        vectors = list(vectors)
+        if len(vectors) > 0:
+            self.vectors = np.array(vectors, dtype=np.float64)
+            self.labels = list(labels)
+            self.alive = [True] * len(self.labels)
+            self.root = self.build(list(range(len(self.labels))))
+
+    def __len__(self):
+        return len(self.labels) - self.removed
+
+    def build(self, ids):
+        if len(ids) <= self.leaf_size:
+            return Node(bucket=ids)
+        # the first template is as good a vantage point as a random one
+        vantage, rest = ids[0], np.array(ids[1:])
+        distances = np.linalg.norm(self.vectors[rest] - self.vectors[vantage], axis=1)
+        radius = float(np.median(distances))
+        inside = rest[distances < radius].tolist()
+        outside = rest[distances >= radius].tolist()
+        return Node(vantage, radius, self.build(inside), self.build(outside))
+
+    def ids(self, node):
+        if node.vantage is None:
+            return list(node.bucket)
+        return [node.vantage] + self.ids(node.inside) + self.ids(node.outside)
+
+    def insert(self, vector, label):
+        vector = np.asarray(vector, dtype=np.float64)
+        if len(self.labels) == 0:
+            self.vectors = vector[None, :].copy()
+        else:
+            self.vectors = np.vstack([self.vectors, vector])
+        new_id = len(self.labels)
+        self.labels.append(label)
+        self.alive.append(True)
+        parent, node = None, self.root
+        while node.vantage is not None:
+            parent = node
+            if np.linalg.norm(vector - self.vectors[node.vantage]) < node.radius:
+                node = node.inside
+            else:
+                node = node.outside
+        node.bucket.append(new_id)
+        if len(node.bucket) > self.leaf_size:
+            subtree = self.build(node.bucket)
+            if parent is None:
+                self.root = subtree
+            elif parent.inside is node:
+                parent.inside = subtree
+            else:
+                parent.outside = subtree
+
+    def remove(self, label):
+        # templates are only marked removed, the tree is rebuilt once half of it is stale
+        for i, (template_label, alive) in enumerate(zip(self.labels, self.alive)):
+            if alive and template_label == label:
+                self.alive[i] = False
+                self.removed += 1
+        if self.removed > len(self.labels) // 2:
+            keep = [i for i, alive in enumerate(self.alive) if alive]
+            self.vectors = self.vectors[keep] if keep else np.empty((0, 0))
+            self.labels = [self.labels[i] for i in keep]
+            self.alive = [True] * len(keep)
+            self.removed = 0
+            self.root = self.build(list(range(len(keep))))
+
+    def within(self, vector, radius):
+        # every (label, distance) within radius of vector, closest first
+        vector = np.asarray(vector, dtype=np.float64)
+        found = []
+        self.search(self.root, vector, lambda: radius, found.append)
+        return sorted(found, key=lambda match: match[1])
+
+    def nearest(self, vector, radius=np.inf):
+        # (label, distance) of the closest template within radius, None if there is none
+        vector = np.asarray(vector, dtype=np.float64)
+        best = [None, radius]
+
+        def visit(match):
+            if match[1] <= best[1]:
+                best[0], best[1] = match
+
+        self.search(self.root, vector, lambda: best[1], visit)
+        return None if best[0] is None else (best[0], best[1])
+
+    def search(self, node, vector, bound, visit):
+        # visit every live template within bound(), bound may shrink while searching
+        if node.vantage is None:
+            if len(node.bucket) == 0:
+                return
+            self.evaluations += len(node.bucket)
+            distances = np.linalg.norm(self.vectors[node.bucket] - vector, axis=1)
+            for i, distance in zip(node.bucket, distances):
+                if self.alive[i] and distance <= bound():
+                    visit((self.labels[i], float(distance)))
+            return
+        self.evaluations += 1
+        distance = float(np.linalg.norm(vector - self.vectors[node.vantage]))
+        if self.alive[node.vantage] and distance <= bound():
+            visit((self.labels[node.vantage], distance))
+        # closer side first, the other one only if the ball around vector crosses the boundary
+        if distance < node.radius:
+            self.search(node.inside, vector, bound, visit)
+            if distance + bound() >= node.radius:
+                self.search(node.outside, vector, bound, visit)
+        else:
+            self.search(node.outside, vector, bound, visit)
+            if distance - bound() < node.radius:
+                self.search(node.inside, vector, bound, visit)
@@ -0,0 +1,75 @@
+import numpy as np
+
+UNKNOWN_GESTURE = 404
+
+
+class TemporalRecognizer:
+    # Stabilises per-frame predictions over a sliding window of the last N frames.
+    # Features and labels of the window are kept in ring buffers with running sums and vote counts,
+    # so every frame costs one classification and O(1) bookkeeping, never a whole-window pass.
+    # The output only switches to a new gesture once it holds enter_ratio of the votes, and stays
+    # on the current one while it keeps at least exit_ratio of them.
+    def __init__(self, classify, window=8, feature_size=15, enter_ratio=0.6, exit_ratio=0.3,
+                 smooth=False):
+        # classify: features -> gesture index or UNKNOWN_GESTURE, e.g. L2Classifier.classify
+        # smooth: classify the window mean of the features instead of the newest frame
+        if not 0 < exit_ratio <= enter_ratio <= 1:
+            raise ValueError('ratios must satisfy 0 < exit_ratio <= enter_ratio <= 1')
+        self.classify = classify
+        self.window = window
+        self.smooth = smooth
+        self.enter_votes = int(np.ceil(enter_ratio * window))
+        self.exit_votes = int(np.ceil(exit_ratio * window))
+        self.features = np.zeros((window, feature_size), dtype=np.float64)
+        self.feature_sum = np.zeros(feature_size, dtype=np.float64)
+        self.labels = [None] * window
+        self.votes = {}
+        self.head = 0
+        self.filled = 0
+        self.leader = None
+        self.current = UNKNOWN_GESTURE
+
+    def reset(self):
+        self.features[:] = 0
+        self.feature_sum[:] = 0
+        self.labels = [None] * self.window
+        self.votes = {}
+        self.head = 0
+        self.filled = 0
+        self.leader = None
+        self.current = UNKNOWN_GESTURE
+
+    def update(self, feature_vector):
+        # add one frame given as features, returns the stable gesture
+        outgoing = self.features[self.head]
+        if self.filled == self.window:
+            self.feature_sum -= outgoing
+        outgoing[:] = feature_vector
+        self.feature_sum += outgoing
+        count = min(self.filled + 1, self.window)
+        label = self.classify(self.feature_sum / count if self.smooth else feature_vector)
+        return self.__push_label(label)
+
+    def update_label(self, label):
+        # add one frame already classified elsewhere, e.g. on the glove
+        return self.__push_label(label)
+
+    def __push_label(self, label):
+        outgoing = self.labels[self.head]
+        if self.filled == self.window:
+            self.votes[outgoing] -= 1
+        else:
+            self.filled += 1
+        self.labels[self.head] = label
+        self.votes[label] = self.votes.get(label, 0) + 1
+        self.head = (self.head + 1) % self.window
+        # the leader can only be overtaken by the label that just gained a vote
+        if self.leader is None or self.votes[label] > self.votes.get(self.leader, 0):
+            self.leader = label
+        elif outgoing == self.leader and outgoing != label:
+            self.leader = max(self.votes, key=self.votes.get)
+        if self.leader != self.current and self.votes[self.leader] >= self.enter_votes:
+            self.current = self.leader
+        elif self.votes.get(self.current, 0) < self.exit_votes:
+            self.current = UNKNOWN_GESTURE
+        return self.current
@@ -0,0 +1,216 @@
+import os, time, struct, _thread
+
+
+class EventLog:
+  """ Persistent event log on flash. Records have fixed size and are kept in a ring of segment
+      files, a segment is only rewritten once the ring wraps around to it. Logging only packs the
+      record into a preallocated RAM buffer and never blocks, so that it can be called from timer
+      and IRQ callbacks. Records logged while the buffer is full or in use are dropped and counted.
+      The buffer is written to flash by `poll` from a polling loop once full, or after an error.
+      Decoded by gesture/event_log_dump.py on the host """
+  # record: sequence number, time since boot in ms, level, code, payload
+  RECORD_FORMAT = "<IIBB22s"
+  RECORD_SIZE = 32
+  PAYLOAD_SIZE = 22
+
+  # levels
+  INFO, WARNING, ERROR = 0, 1, 2
+  LEVEL_NAMES = ("I", "W", "E")
+
+  # codes
+  BOOT = 0
+  EXPECT = 1
+  ASSERT = 2
+  DROPPED = 3 # payload is the number of records dropped since the last flush
+  CODE_NAMES = ("BOOT", "EXPECT", "ASSERT", "DROPPED")
+
+  # storage specifications
+  log_path = "data/log"
+  SEGMENT_COUNT = 4
+  SEGMENT_RECORDS = 64
+  BUFFER_RECORDS = 8
+
+  lock = _thread.allocate_lock() # guards the RAM buffer, never held during flash access
+  flash_lock = _thread.allocate_lock() # guards the segment files
+  initialized = False
+  seq = 0 # sequence number of the next record written, assigned on flush
+  segment = 0 # segment currently appended to
+  segment_records = 0 # records already in current segment
+  buffer = bytearray(BUFFER_RECORDS * RECORD_SIZE)
+  buffer_view = memoryview(buffer)
+  buffered = 0
+  dropped = 0 # records dropped since the last flush
+  flush_requested = False
+  # records are moved here under lock and written to flash without it, one extra for the drop count
+  write_buffer = bytearray((BUFFER_RECORDS + 1) * RECORD_SIZE)
+  write_view = memoryview(write_buffer)
+
+  @classmethod
+  def __segment_path(cls, segment: int) -> str:
+    """ Path of the segment file. Should NOT be called """
+    return f"{cls.log_path}/{segment}.bin"
+
+  @classmethod
+  def __begin(cls) -> None:
+    """ Find the segment last appended to and the next sequence number. Should NOT be called """
+    cls.initialized = True
+    try:
+      os.mkdir(cls.log_path)
+    except OSError:
+      pass
+    latest_seq = -1
+    header = bytearray(4)
+    for segment in range(cls.SEGMENT_COUNT):
+      try:
+        size = os.stat(cls.__segment_path(segment))[6]
+        if size < cls.RECORD_SIZE:
+          continue
+        with open(cls.__segment_path(segment), "rb") as f:
+          f.readinto(header)
+      except OSError:
+        continue
+      first_seq = struct.unpack_from("<I", header)[0]
+      if first_seq > latest_seq:
+        latest_seq = first_seq
+        cls.segment = segment
+        cls.segment_records = size // cls.RECORD_SIZE
+        if size % cls.RECORD_SIZE != 0:
+          # partially written record, continue in a fresh segment
+          cls.segment_records = cls.SEGMENT_RECORDS
+    if latest_seq != -1:
+      cls.seq = latest_seq + cls.segment_records
+
+  @classmethod
+  def log(cls, level: int, code: int, payload = b"") -> None:
+    """ Record an event, never blocks nor touches flash, safe in timer and IRQ callbacks
+        `level`: one of EventLog.INFO, EventLog.WARNING, EventLog.ERROR
+        `code`: code of the event
+        `payload`: short description, bytes or str, cut to 22 bytes """
+    if type(payload) == str:
+      payload = payload.encode()
+    if not cls.lock.acquire(False):
+      # buffer in use by an interrupted log or by flush, counted without the lock, may be off by one
+      cls.dropped += 1
+      return
+    if cls.buffered == cls.BUFFER_RECORDS:
+      cls.dropped += 1
+    else:
+      # sequence number is assigned on flush, once the segments have been scanned
+      struct.pack_into(cls.RECORD_FORMAT, cls.buffer, cls.buffered * cls.RECORD_SIZE,
+          0, time.ticks_ms(), level, code, payload[:cls.PAYLOAD_SIZE])
+      cls.buffered += 1
+    if cls.buffered == cls.BUFFER_RECORDS or level >= cls.ERROR:
+      cls.flush_requested = True
+    cls.lock.release()
+
+  @classmethod
+  def poll(cls) -> None:
+    """ Write buffered records to flash if the buffer is full or an error was logged, called from
+        polling loops, never from callbacks """
+    if cls.flush_requested:
+      cls.flush()
+
+  @classmethod
+  def flush(cls) -> None:
+    """ Write all buffered records to flash, and a record of how many were dropped if any.
+        Should NOT be called from callbacks, use `poll` """
+    cls.flash_lock.acquire()
+    cls.lock.acquire()
+    count = cls.buffered
+    cls.write_view[:count * cls.RECORD_SIZE] = cls.buffer_view[:count * cls.RECORD_SIZE]
+    cls.buffered = 0
+    dropped = cls.dropped
+    cls.dropped = 0
+    cls.flush_requested = False
+    cls.lock.release()
+    if dropped != 0:
+      struct.pack_into(cls.RECORD_FORMAT, cls.write_buffer, count * cls.RECORD_SIZE,
+          0, time.ticks_ms(), cls.WARNING, cls.DROPPED, str(dropped).encode())
+      count += 1
+    try:
+      if not cls.initialized:
+        cls.__begin()
+      for i in range(count):
+        struct.pack_into("<I", cls.write_buffer, i * cls.RECORD_SIZE, cls.seq)
+        cls.seq += 1
+      written = 0
+      while written < count:
+        if cls.segment_records == cls.SEGMENT_RECORDS:
+          # move on to the oldest segment and overwrite it
+          cls.segment = (cls.segment + 1) % cls.SEGMENT_COUNT
+          cls.segment_records = 0
+          open(cls.__segment_path(cls.segment), "wb").close()
+        chunk = min(count - written, cls.SEGMENT_RECORDS - cls.segment_records)
+        with open(cls.__segment_path(cls.segment), "ab") as f:
+          f.write(cls.write_view[written * cls.RECORD_SIZE:(written + chunk) * cls.RECORD_SIZE])
+        cls.segment_records += chunk
+        written += chunk
+    except OSError as e:
+      print(f"Warning: Event log write failed <{e}>")
+    cls.flash_lock.release()
+
+  @classmethod
+  def raw_records(cls):
+    """ Iterate over all records on flash, oldest first, buffered records are flushed first
+        `returns`: generator of records as bytes """
+    cls.flush()
+    segments = []
+    header = bytearray(4)
+    cls.flash_lock.acquire()
+    for segment in range(cls.SEGMENT_COUNT):
+      try:
+        with open(cls.__segment_path(segment), "rb") as f:
+          if f.readinto(header) == 4:
+            segments.append((struct.unpack_from("<I", header)[0], segment))
+      except OSError:
+        pass
+    cls.flash_lock.release()
+    segments.sort()
+    record = bytearray(cls.RECORD_SIZE)
+    for _, segment in segments:
+      try:
+        with open(cls.__segment_path(segment), "rb") as f:
+          while f.readinto(record) == cls.RECORD_SIZE:
+            yield bytes(record)
+      except OSError:
+        pass
+
+  @classmethod
+  def records(cls):
+    """ Iterate over all records, oldest first
+        `returns`: generator of (seq, time_ms, level, code, payload) """
+    for record in cls.raw_records():
+      yield struct.unpack(cls.RECORD_FORMAT, record)
+
+  @classmethod
+  def format_record(cls, record: tuple) -> str:
+    """ Readable form of a record
+        `record`: record as returned by `records`
+        `returns`: one line describing the record """
+    seq, time_ms, level, code, payload = record
+    level = cls.LEVEL_NAMES[level] if level < len(cls.LEVEL_NAMES) else str(level)
+    code = cls.CODE_NAMES[code] if code < len(cls.CODE_NAMES) else str(code)
+    payload = payload.rstrip(b"\x00")
+    try:
+      payload = payload.decode()
+    except Exception:
+      payload = str(payload)
+    return f"{seq} {time_ms // 1000}.{time_ms % 1000:03}s {level} {code} {payload}"
+
+  @classmethod
+  def clear(cls) -> None:
+    """ Remove all records """
+    cls.flash_lock.acquire()
+    for segment in range(cls.SEGMENT_COUNT):
+      try:
+        os.remove(cls.__segment_path(segment))
+      except OSError:
+        pass
+    cls.lock.acquire()
+    cls.buffered = 0
+    cls.dropped = 0
+    cls.flush_requested = False
+    cls.lock.release()
+    cls.segment = 0
+    cls.segment_records = 0
+    cls.flash_lock.release()
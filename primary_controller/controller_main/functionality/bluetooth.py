@@ -12,10 +12,12 @@ ADV_TYPE_UUID16_MORE      = micropython.const(0x2)
 ADV_TYPE_UUID32_MORE      = micropython.const(0x4)
 ADV_TYPE_UUID128_MORE     = micropython.const(0x6)
 ADV_TYPE_APPEARANCE       = micropython.const(0x19)
+ADV_TYPE_CONN_INTERVAL    = micropython.const(0x12)
 # irq
 IRQ_CENTRAL_CONNECT    = micropython.const(1)
 IRQ_CENTRAL_DISCONNECT = micropython.const(2)
 IRQ_GATTS_WRITE        = micropython.const(3)
+IRQ_CONNECTION_UPDATE  = micropython.const(27)
 # flags
 FLAG_READ              = micropython.const(0x0002)
 FLAG_WRITE_NO_RESPONSE = micropython.const(0x0004)
@@ -33,6 +35,17 @@ class BLEPeripheral:
   config_path = "data"
   default_config_storage = "ble_name.settings"
   default_ble_name = "BLECtrl"
+  default_profile_storage = "ble_profile.settings"
+
+  # connection parameter profiles, preferred connection interval published in the scan response
+  #   (min interval us, max interval us)
+  LOW_LATENCY = "low_latency"
+  POWER_SAVING = "power_saving"
+  profiles = {
+    LOW_LATENCY:  (7500, 15000),
+    POWER_SAVING: (100000, 200000),
+  }
+  default_profile = LOW_LATENCY
 
   def __init__(self, ble):
     self.__ble = ble
@@ -42,13 +55,23 @@ class BLEPeripheral:
 
     self.__connection = None
     self.__write_callback = None
+    # negotiated (interval us, slave latency, supervision timeout ms), None if unknown
+    self.__conn_params = None
 
     try:
       with open(f"{BLEPeripheral.config_path}/{BLEPeripheral.default_config_storage}") as f:
         self.__name = f.read()
     except Exception:
       self.__name = BLEPeripheral.default_ble_name
-    self.__adv_payload = self.get_advertising_payload(name=self.__name, services=[UART_UUID])
+    try:
+      with open(f"{BLEPeripheral.config_path}/{BLEPeripheral.default_profile_storage}") as f:
+        self.__profile = f.read().strip()
+    except Exception:
+      self.__profile = BLEPeripheral.default_profile
+    if self.__profile not in BLEPeripheral.profiles:
+      self.__profile = BLEPeripheral.default_profile
+    self.__adv_payload = self.__get_current_advertising_payload()
+    self.__resp_payload = self.__get_current_response_payload()
     # start advertising
     self.__advertise()
 
@@ -61,11 +84,54 @@ class BLEPeripheral:
       f.write(self.__name)
     # change advertise name
     self.__advertise(None)
-    self.__adv_payload = self.get_advertising_payload(name=self.__name, services=[UART_UUID])
+    self.__adv_payload = self.__get_current_advertising_payload()
     # start advertising
     self.__advertise()
     return
 
+  def get_current_profile(self) -> str:
+    return self.__profile
+
+  def change_profile(self, profile: str) -> bool:
+    """ Change the preferred connection parameter profile. The preference is stored and published
+        in the scan response payload, centrals pick it up on the next connection
+        `profile`: one of `BLEPeripheral.profiles`
+        `returns`: whether the profile is valid """
+    if profile not in BLEPeripheral.profiles:
+      utils.EXPECT_TRUE(False, f"Bluetooth invalid profile <{profile}>")
+      return False
+    self.__profile = profile
+    with open(f"{BLEPeripheral.config_path}/{BLEPeripheral.default_profile_storage}", "w") as f:
+      f.write(self.__profile)
+    self.__resp_payload = self.__get_current_response_payload()
+    if self.__connection == None:
+      # restart advertising with new preference
+      self.__advertise(None)
+      self.__advertise()
+    return True
+
+  def get_connection_parameters(self) -> tuple:
+    """ Get the connection parameters actually negotiated with the central
+        `returns`: (interval us, slave latency, supervision timeout ms), None if unknown """
+    return self.__conn_params
+
+  def get_connection_report(self) -> str:
+    """ Get profile and negotiated parameters as text, unknown parameters are left empty
+        `returns`: <profile>,<interval us>,<slave latency>,<supervision timeout ms> """
+    if self.__conn_params == None:
+      return f"{self.__profile},,,"
+    interval_us, latency, timeout_ms = self.__conn_params
+    return f"{self.__profile},{interval_us},{latency},{timeout_ms}"
+
+  def __get_current_advertising_payload(self) -> bytearray:
+    """ Advertising payload using current name """
+    return self.get_advertising_payload(name=self.__name, services=[UART_UUID])
+
+  def __get_current_response_payload(self) -> bytearray:
+    """ Scan response payload using preferred connection interval, flags, name and the 128-bit
+        UART UUID already take up to 31 bytes of the advertising payload """
+    return BLEPeripheral.get_response_payload(conn_interval=BLEPeripheral.profiles[self.__profile])
+
   def get_advertising_payload(limited_disc=False, br_edr=False, name=None, services=None, appearance=0):
     payload = bytearray()
 
@@ -95,18 +161,33 @@ class BLEPeripheral:
 
     return payload
 
+  @staticmethod
+  def get_response_payload(conn_interval=None):
+    """ Scan response payload, carries no flags
+        `conn_interval`: (min interval us, max interval us) preferred by the peripheral
+        `returns`: payload to be passed as `resp_data` """
+    payload = bytearray()
+    # Slave connection interval range, in units of 1.25ms
+    if conn_interval:
+      value = struct.pack("<HH", conn_interval[0] // 1250, conn_interval[1] // 1250)
+      payload += struct.pack("BB", len(value) + 1, ADV_TYPE_CONN_INTERVAL) + value
+
+    return payload
+
   def __irq(self, event, data):
     # Track connections so we can send notifications
     if event == IRQ_CENTRAL_CONNECT:
       conn_handle, _, _ = data
       print("Bluetooth new connection", conn_handle)
       self.__connection = conn_handle
+      self.__conn_params = None
       # Stop advertising 
       self.__advertise(None)
     elif event == IRQ_CENTRAL_DISCONNECT:
       conn_handle, _, _ = data
       print("Bluetooth Disconnected", conn_handle)
       self.__connection = None
+      self.__conn_params = None
       # Start advertising again to allow a new connection
       self.__advertise()
     elif event == IRQ_GATTS_WRITE:
@@ -114,6 +195,12 @@ class BLEPeripheral:
       value = self.__ble.gatts_read(value_handle)
       if value_handle == self.__handle_rx and self.__write_callback:
           self.__write_callback(value)
+    elif event == IRQ_CONNECTION_UPDATE:
+      # Central (re-)negotiated the connection parameters
+      conn_handle, conn_interval, conn_latency, supervision_timeout, status = data
+      if conn_handle == self.__connection and status == 0:
+        self.__conn_params = (conn_interval * 1250, conn_latency, supervision_timeout * 10)
+        print("Bluetooth connection parameters", self.get_connection_report())
 
   def send(self, data):
     if self.__connection != None:
@@ -123,7 +210,7 @@ class BLEPeripheral:
     return self.__connection != None
 
   def __advertise(self, interval_us=int(1e6)):
-    self.__ble.gap_advertise(interval_us, adv_data=self.__adv_payload)
+    self.__ble.gap_advertise(interval_us, adv_data=self.__adv_payload, resp_data=self.__resp_payload)
 
   def on_write(self, callback):
     self.__write_callback = callback
@@ -1,11 +1,14 @@
-import machine, time, bluetooth, json
+import machine, time, bluetooth, json, binascii
 
 import driver.utils as utils
 from driver.status_led import StatusLed
+from driver.event_log import EventLog
 
 from functionality.wt901 import WT901
 from functionality.bluetooth import BLEPeripheral as ble
 from functionality.communication import Communication as Com
+from functionality.config_codec import ConfigCodec
+from functionality.gesture_model import GestureModel
 
 def uart1_rx_callback() -> None:
   """ Callback function that called every time uart1 received message(s) """
@@ -31,10 +34,15 @@ class Board:
   ble = None
   polling_buffer = bytearray(200)
 
+  # on-glove gesture classifier, None if no model is stored
+  gesture_model = None
+  GESTURE_HEADER = ord("G")
+
   class State:
     IDLE = 0
     IMU  = 1
     BLUETOOTH  = 2
+    CONFIG = 3
 
   # controller state
   state = None
@@ -63,6 +71,10 @@ class Board:
     cls.ble = ble(bluetooth.BLE())
     cls.ble.on_write(cls.ble_rx_callback)
 
+    cls.gesture_model = GestureModel.load()
+    if cls.gesture_model == None:
+      print(f"No gesture model at <{GestureModel.default_storage}>, classification left to host")
+
   @classmethod
   def begin_operation(cls) -> None:
     """ Begin operation of all facilities """
@@ -109,8 +121,11 @@ class Board:
 
   @classmethod
   def ble_rx_callback(cls, msg) -> None:
-    print(len(msg))
-    cls.uart1_com.send(Com.BLUETOOTH, *msg.split(b"\n"))
+    if len(msg) != 0 and msg[0] == Com.FEEDBACK_SYNC:
+      # binary feedback may contain delimiters, relay hex encoded as one message
+      cls.uart1_com.send(Com.FEEDBACK, binascii.hexlify(msg))
+    else:
+      cls.uart1_com.send(Com.BLUETOOTH, *msg.split(b"\n"))
 
   @classmethod
   def estimate_polling_rate(cls, imus: list, count: int, quaternion: bool=False) -> float:
@@ -132,6 +147,23 @@ class Board:
       end = time.time_ns()
     return iter_count * len(imus) * 10e8 / (end - start)
 
+  @classmethod
+  def append_gesture_report(cls, index: int) -> int:
+    """ Classify the IMU reports in the polling buffer and append the result as a record of the
+        same size as an IMU record: header, gesture, confidence in percent, padding
+        `index`: end of the IMU reports in the polling buffer
+        `returns`: end of the reports, unchanged if no model or IMUs missing for the model """
+    if cls.gesture_model == None or not cls.gesture_model.load_report(cls.polling_buffer, index):
+      return index
+    cls.gesture_model.compute_features()
+    gesture, confidence = cls.gesture_model.infer()
+    cls.polling_buffer[index] = Board.GESTURE_HEADER
+    cls.polling_buffer[index + 1] = gesture
+    cls.polling_buffer[index + 2] = confidence
+    for i in range(index + 3, index + GestureModel.REPORT_SIZE):
+      cls.polling_buffer[i] = 0
+    return index + GestureModel.REPORT_SIZE
+
   @classmethod
   def send_imu_info_through_uart2(cls, timer: machine.Timer):
     imu: WT901
@@ -139,6 +171,7 @@ class Board:
     index = 0
     for imu in cls.imus:
       index = imu.get_quatacc_report(cls.polling_buffer, index)
+    index = cls.append_gesture_report(index)
     cls.polling_buffer[index:index + 2] = b"\r\n" # termination sequence
     cls.uart2.write(cls.polling_buffer[0:index + 2])
     cls.status_led.change_state(False)
@@ -152,6 +185,7 @@ class Board:
     index = 0
     for imu in cls.imus:
       index = imu.get_quatacc_report(cls.polling_buffer, index)
+    index = cls.append_gesture_report(index)
     cls.polling_buffer[index:index + 2] = b"\r\n" # termination sequence
     cls.ble.send(cls.polling_buffer[0:index + 2])
     cls.status_led.change_state(False)
@@ -180,36 +214,43 @@ class Board:
         cls.uart1_com.send(Com.REJECT, f"IMU disconnected during process")
 
   @classmethod
-  def set_imu_positions(cls):
-    cls.uart1_com.send(Com.CONFIRM, Com.BULK)
+  def set_imu_config(cls) -> None:
+    """ Assign IMU positions and options from a binary config sent by the peripheral in one
+        message, either all IMUs of the config are assigned or none """
+    msg = cls.uart1_com.read(Com.CONFIG)
+    try:
+      records = ConfigCodec.decode(binascii.unhexlify(msg))
+    except Exception:
+      records = None
+    if records == None:
+      warning_msg = f"Invalid WT901 config <{msg}>"
+      utils.EXPECT_TRUE(False, warning_msg)
+      cls.uart1_com.send(Com.REJECT, warning_msg)
+      return
     WT901.detect_imus(cls.i2c)
     WT901.deinit_all_imus()
-    addresses = WT901.detected_imus.keys()
-    while True: # while the peripheral still sending configs
-      msg = cls.uart1_com.blocking_read(Com.IMU)
-      if msg == Com.TERMINATE:
-        cls.uart1_com.send(Com.CONFIRM, Com.TERMINATE)
-        break
-      preprocess = msg.split(b",")
-      position = preprocess[0].decode()
-      address = int(preprocess[1].decode())
-      if address not in addresses:
+    assigned_addresses = set()
+    for position, address, rate, bus in records:
+      warning_msg = None
+      if address not in WT901.detected_imus or address in assigned_addresses:
         warning_msg = f"Invalid WT901 I2C Address <{hex(address)}>"
-        utils.EXPECT_TRUE(False, warning_msg)
-        cls.uart1_com.send(Com.REJECT, warning_msg)
-        continue
-      if position not in WT901.avail_positions:
+      elif position not in WT901.avail_positions:
         warning_msg = f"Invalid WT901 I2C Position <{position}>"
-        utils.EXPECT_TRUE(False, warning_msg)
-        cls.uart1_com.send(Com.REJECT, warning_msg)
-        continue
-      if position in WT901.inited_positions:
+      elif position in WT901.inited_positions:
         warning_msg = f"Duplicated WT901 I2C Position <{position}>"
+      elif bus != ConfigCodec.DEFAULT_BUS:
+        warning_msg = f"Invalid WT901 I2C Bus <{bus}>"
+      if warning_msg != None:
         utils.EXPECT_TRUE(False, warning_msg)
+        WT901.deinit_all_imus()
         cls.uart1_com.send(Com.REJECT, warning_msg)
-        continue
-      cls.uart1_com.send(Com.CONFIRM, "")
-      WT901.detected_imus[address].assign_position(position)
+        return
+      imu = WT901.detected_imus[address]
+      imu.assign_position(position)
+      assigned_addresses.add(address)
+      if rate != ConfigCodec.RATE_UNCHANGED:
+        imu.set_return_rate(rate)
+    cls.uart1_com.send(Com.CONFIRM, "")
 
   @classmethod
   def change_bluetooth_advertise_name(cls) -> None:
@@ -223,6 +264,14 @@ class Board:
       cls.uart1_com.send(Com.REJECT, 
           f"Bluetooth name must have a length between 1 and 8, current name <{name}> has length {len(name)}")
 
+  @classmethod
+  def change_bluetooth_profile(cls) -> None:
+    profile = cls.uart1_com.blocking_read(Com.BLUETOOTH).decode()
+    if cls.ble.change_profile(profile):
+      cls.uart1_com.send(Com.CONFIRM, cls.ble.get_connection_report())
+    else:
+      cls.uart1_com.send(Com.REJECT, f"Invalid bluetooth profile <{profile}>")
+
   @classmethod
   def polling_send_loop(cls):
     cls.uart1_com.send(Com.CONFIRM, Com.BEGIN)
@@ -231,11 +280,14 @@ class Board:
     timer.init(mode=machine.Timer.PERIODIC, period=50, callback=cls.send_imu_info_through_bluetooth)
     cls.in_operation = True
     while True:
-      msg = cls.uart1_com.blocking_read(Com.IMU)
+      msg = cls.uart1_com.read(Com.IMU)
       if msg == Com.TERMINATE:
         timer.deinit()
         cls.uart1_com.send(Com.CONFIRM, Com.TERMINATE)
         break
+      # write records logged during operation to flash outside of the send callback
+      EventLog.poll()
+      time.sleep_ms(100)
     cls.in_operation = False
 
   @classmethod
@@ -248,14 +300,14 @@ class Board:
           cls.state = cls.State.IMU
         elif Com.BLUETOOTH in available_categories:
           cls.state = cls.State.BLUETOOTH
+        elif Com.CONFIG in available_categories:
+          cls.state = cls.State.CONFIG
       elif cls.state == cls.State.IMU: # IMU operations
         msg = cls.uart1_com.read(Com.IMU)
         if msg == Com.ADDRESS: # query I2C address
           cls.query_i2c_addr()
         elif msg == Com.SPEED: # imu polling speed
           cls.query_imu_polling_speed()
-        elif msg == Com.BULK: # setting imu position
-          cls.set_imu_positions()
         elif msg == Com.BEGIN: # begin operation
           cls.polling_send_loop()
         cls.state = cls.State.IDLE
@@ -272,6 +324,15 @@ class Board:
             cls.uart1_com.send(Com.REJECT, "Bluetooth not connected")
         elif msg == Com.BULK:
           cls.change_bluetooth_advertise_name()
+        elif msg == Com.PROFILE:
+          cls.change_bluetooth_profile()
+        elif msg == Com.PARAMS:
+          cls.uart1_com.send(Com.CONFIRM, cls.ble.get_connection_report())
+        cls.state = cls.State.IDLE
+      elif cls.state == cls.State.CONFIG:
+        cls.set_imu_config()
         cls.state = cls.State.IDLE
 
+      # write logged records to flash outside of callbacks
+      EventLog.poll()
       time.sleep_ms(100)
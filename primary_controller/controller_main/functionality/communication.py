@@ -20,6 +20,10 @@ class Communication:
   REJECT = b'rej'
   WARNING = b'warn'
   FATAL = b'ERR'
+  FEEDBACK = b'fb'
+  CONFIG = b'cfg'
+  # First byte of binary feedback messages from the host
+  FEEDBACK_SYNC = 0xFB
   # Control destinations
   BEGIN = b'begin'
   TERMINATE = b'terminate'
@@ -28,6 +32,11 @@ class Communication:
   SPEED = b'speed'
   NAME = b'name'
   CONNECTED = b'connected'
+  PROFILE = b'profile'
+  PARAMS = b'params'
+  # Bluetooth connection profiles
+  LOW_LATENCY = b'low_latency'
+  POWER_SAVING = b'power_saving'
 
   def __init__(self) -> None:
     self.__uart1 = UARTCallback(1, tx=18, rx=17)
@@ -84,6 +93,7 @@ class Communication:
       return None
     ret = self.__message_queue[category]
     self.__message_queue[category] = []
+    self.__pending_categories.remove(category)
     self.__message_lock.release()
     return ret
 
@@ -0,0 +1,61 @@
+import struct
+
+
+class ConfigCodec:
+  """ Compact binary encoding of IMU configs, shared by the main and the peripheral controller so
+      that a stored config can be sent as is. Layout, little-endian:
+        header: magic(2) version(1) count(1) record_size(1)
+        record: position_id(1) i2c_address(1) rate(1) bus(1)
+      Later versions may only append fields to records, readers skip the fields they do not know
+      using `record_size`, so configs written by newer firmware stay readable """
+  MAGIC = b"GC"
+  VERSION = 1
+  HEADER_FORMAT = "<2sBBB"
+  HEADER_SIZE = 5
+  RECORD_FORMAT = "<BBBB"
+  RECORD_SIZE = 4
+
+  # position ids are stored on flash, append only
+  POSITIONS = ("Thumb", "Index", "Middle", "Ring", "Little", "Hand", "Arm")
+
+  # options
+  RATE_UNCHANGED = 0 # keep the return rate configured on the IMU, otherwise a WT901 RRATE code
+  DEFAULT_BUS = 0
+
+  @classmethod
+  def is_encoded(cls, data) -> bool:
+    """ Whether data is a binary config rather than a legacy JSON one """
+    return len(data) >= cls.HEADER_SIZE and data[:2] == cls.MAGIC
+
+  @classmethod
+  def encode(cls, records: list) -> bytes:
+    """ Encode IMU records into a binary config
+        `records`: list of (position, i2c_address, rate, bus)
+        `returns`: encoded config """
+    data = bytearray(cls.HEADER_SIZE + len(records) * cls.RECORD_SIZE)
+    struct.pack_into(cls.HEADER_FORMAT, data, 0, cls.MAGIC, cls.VERSION, len(records), cls.RECORD_SIZE)
+    offset = cls.HEADER_SIZE
+    for position, address, rate, bus in records:
+      struct.pack_into(cls.RECORD_FORMAT, data, offset, cls.POSITIONS.index(position), address, rate, bus)
+      offset += cls.RECORD_SIZE
+    return bytes(data)
+
+  @classmethod
+  def decode(cls, data) -> list:
+    """ Decode a binary config
+        `data`: encoded config
+        `returns`: list of (position, i2c_address, rate, bus), None if data is not a valid config """
+    if not cls.is_encoded(data):
+      return None
+    _, version, count, record_size = struct.unpack_from(cls.HEADER_FORMAT, data, 0)
+    if version == 0 or record_size < cls.RECORD_SIZE or len(data) < cls.HEADER_SIZE + count * record_size:
+      return None
+    records = []
+    offset = cls.HEADER_SIZE
+    for _ in range(count):
+      position_id, address, rate, bus = struct.unpack_from(cls.RECORD_FORMAT, data, offset)
+      offset += record_size
+      if position_id >= len(cls.POSITIONS):
+        return None # position added by a newer version, cannot be placed
+      records.append((cls.POSITIONS[position_id], address, rate, bus))
+    return records
@@ -0,0 +1,157 @@
+import struct, math
+from array import array
+
+
+class GestureModel:
+  """ Fixed-point gesture classifier exported by gesture/export_model.py. Weights are int8 with one
+      scale per layer, activations int8 held in int arrays, hidden layers are requantised with an
+      integer multiplier and shift. All buffers are allocated once when the model is loaded.
+      Blob layout, little-endian:
+        header: magic(2) version(1) layer_count(1) input_scale(f32)
+        layer:  in(u16) out(u16) relu(u8) multiplier(i32) shift(u8) output_scale(f32)
+                weights(int8 x out x in, row-major) biases(int32 x out)
+      Constants must match gesture/export_model.py """
+  MAGIC = b"GM"
+  VERSION = 1
+  HEADER_FORMAT = "<2sBBf"
+  HEADER_SIZE = 8
+  LAYER_FORMAT = "<HHBiBf"
+  LAYER_SIZE = 14
+
+  default_storage = "data/gesture.model"
+
+  # report identifiers of the IMUs features are computed from, same order as the host features
+  POSITIONS = b"TIMRLH"
+  FEATURE_SIZE = 15 # pairwise distances between the positions
+  REPORT_SIZE = 15 # identifier(1) quaternion(8) accelerometer(6)
+
+  @classmethod
+  def load(cls, path: str = default_storage):
+    """ Load a model blob from flash
+        `path`: path of the blob
+        `returns`: the model, None if the blob is missing or invalid """
+    try:
+      with open(path, "rb") as f:
+        data = f.read()
+    except OSError:
+      return None
+    if len(data) < cls.HEADER_SIZE:
+      return None
+    magic, version, layer_count, input_scale = struct.unpack_from(cls.HEADER_FORMAT, data, 0)
+    if magic != cls.MAGIC or version != cls.VERSION or layer_count == 0:
+      return None
+    try:
+      return cls(data, layer_count, input_scale)
+    except (ValueError, IndexError):
+      return None
+
+  def __init__(self, data: bytes, layer_count: int, input_scale: float) -> None:
+    """ Create a model from a validated blob, use `load` instead. Should NOT be called """
+    self.__input_scale = input_scale
+    self.__layers = []
+    offset = GestureModel.HEADER_SIZE
+    width = GestureModel.FEATURE_SIZE
+    max_width = width
+    for _ in range(layer_count):
+      in_size, out_size, relu, multiplier, shift, output_scale = \
+          struct.unpack_from(GestureModel.LAYER_FORMAT, data, offset)
+      offset += GestureModel.LAYER_SIZE
+      if in_size != width:
+        raise ValueError("layer size mismatch")
+      weights = array("b", struct.unpack_from(f"<{in_size * out_size}b", data, offset))
+      offset += in_size * out_size
+      biases = array("i", struct.unpack_from(f"<{out_size}i", data, offset))
+      offset += 4 * out_size
+      self.__layers.append((in_size, out_size, relu, multiplier, shift, output_scale, weights, biases))
+      width = out_size
+      max_width = max(max_width, width)
+    self.output_size = width
+    # preallocated buffers
+    self.__quaternions = array("i", [0] * (4 * len(GestureModel.POSITIONS)))
+    self.__features = array("f", [0] * GestureModel.FEATURE_SIZE)
+    self.__activations = (array("i", [0] * max_width), array("i", [0] * max_width))
+
+  def load_report(self, buf, length: int) -> bool:
+    """ Take the quaternions out of an IMU report
+        `buf`: report buffer, records as produced by `WT901.get_quatacc_report`
+        `length`: number of bytes of records in the buffer
+        `returns`: whether every position needed by the model is in the report """
+    found = 0
+    for start in range(0, length - GestureModel.REPORT_SIZE + 1, GestureModel.REPORT_SIZE):
+      position = 0
+      while position < len(GestureModel.POSITIONS) and GestureModel.POSITIONS[position] != buf[start]:
+        position += 1
+      if position == len(GestureModel.POSITIONS):
+        continue
+      found |= 1 << position
+      for i in range(4):
+        value = buf[start + 2 + 2 * i] << 8 | buf[start + 1 + 2 * i]
+        self.__quaternions[4 * position + i] = value - 65536 if value > 32767 else value
+    return found == (1 << len(GestureModel.POSITIONS)) - 1
+
+  def compute_features(self) -> array:
+    """ Symmetrised geodesic distance between every pair of positions, scale invariant so that
+        raw quaternion readings can be used directly
+        `returns`: feature buffer """
+    q = self.__quaternions
+    k = 0
+    for i in range(1, len(GestureModel.POSITIONS)):
+      for j in range(i):
+        a, b = 4 * i, 4 * j
+        dot = q[a] * q[b] + q[a + 1] * q[b + 1] + q[a + 2] * q[b + 2] + q[a + 3] * q[b + 3]
+        norm_a = math.sqrt(q[a] * q[a] + q[a + 1] * q[a + 1] + q[a + 2] * q[a + 2] + q[a + 3] * q[a + 3])
+        norm_b = math.sqrt(q[b] * q[b] + q[b + 1] * q[b + 1] + q[b + 2] * q[b + 2] + q[b + 3] * q[b + 3])
+        if norm_a == 0 or norm_b == 0:
+          self.__features[k] = 0
+        else:
+          cos = min(1.0, max(-1.0, dot / (norm_a * norm_b)))
+          log_ratio = math.log(norm_b / norm_a)
+          angle = math.acos(cos)
+          self.__features[k] = math.sqrt(log_ratio * log_ratio + angle * angle)
+        k += 1
+    return self.__features
+
+  def infer(self, features=None) -> tuple:
+    """ Classify a feature vector
+        `features`: features to classify, the features of the last report if not given
+        `returns`: (index of the most probable gesture, its probability in percent) """
+    if features == None:
+      features = self.__features
+    x = self.__activations[0]
+    for i in range(GestureModel.FEATURE_SIZE):
+      value = round(features[i] / self.__input_scale)
+      x[i] = -127 if value < -127 else 127 if value > 127 else value
+    current = 0
+    layer_count = len(self.__layers)
+    for n in range(layer_count):
+      in_size, out_size, relu, multiplier, shift, _, weights, biases = self.__layers[n]
+      x = self.__activations[current]
+      y = self.__activations[1 - current]
+      final = n == layer_count - 1
+      rounding = 1 << (shift - 1) if shift > 0 else 0
+      for o in range(out_size):
+        acc = biases[o]
+        row = o * in_size
+        for i in range(in_size):
+          acc += weights[row + i] * x[i]
+        if not final:
+          # requantise to int8 for the next layer, the last layer keeps its accumulators
+          acc = (acc * multiplier + rounding) >> shift
+          if relu and acc < 0:
+            acc = 0
+          acc = -128 if acc < -128 else 127 if acc > 127 else acc
+        y[o] = acc
+      current = 1 - current
+    return self.__softmax(self.__activations[current])
+
+  def __softmax(self, logits) -> tuple:
+    """ Most probable gesture from the output accumulators. Should NOT be called """
+    output_scale = self.__layers[-1][5]
+    best = 0
+    for o in range(1, self.output_size):
+      if logits[o] > logits[best]:
+        best = o
+    total = 0.0
+    for o in range(self.output_size):
+      total += math.exp((logits[o] - logits[best]) * output_scale)
+    return best, round(100 / total)
@@ -45,6 +45,7 @@ class WT901:
   I2CADDR   = 0x1a
   LEDOFF    = 0x1b
   GPSBAUD   = 0x1c
+  KEY       = 0x69
   YYMM      = 0x30
   DDHH      = 0x31
   MMSS      = 0x32
@@ -90,6 +91,8 @@ class WT901:
   DIO_MODE_DOPWM = 4
   DIO_MODE_GPS   = 5
 
+  UNLOCK_KEY = b"\x88\xb5" # written to KEY before changing any setting
+
   @classmethod
   def auxiliary_init(cls):
     identity_test = set(cls.NOT_ASSIGNED[0])
@@ -122,6 +125,12 @@ class WT901:
     self.__report_header = self.__position[0]
     WT901.inited_positions[position] = self
 
+  def set_return_rate(self, rate: int) -> None:
+    """ Change the output rate of the IMU
+        `rate`: RRATE code of the WT901 """
+    self.__i2c.writeto_mem(self.__i2c_addr, WT901.KEY, WT901.UNLOCK_KEY)
+    self.__i2c.writeto_mem(self.__i2c_addr, WT901.RRATE, bytes([rate, 0]))
+
   def unassign_position(self) -> None:
     if self.__position != WT901.NOT_ASSIGNED:
       WT901.inited_positions.pop(self.__position)
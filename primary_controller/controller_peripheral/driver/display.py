@@ -1,6 +1,7 @@
 import machine, _thread, time, random, framebuf, array, gc
 
 from driver.ssd1306 import SSD1306, SSD1306_I2C
+from driver.threading import Thread
 import driver.utils as utils
 
 
@@ -67,6 +68,134 @@ class Drawing:
     canvas = framebuf.FrameBuffer(bytearray(img), 16, 15, framebuf.MONO_VLSB)
     return canvas
 
+class Sprite(framebuf.FrameBuffer):
+  """ Off-screen framebuffer that knows its own size, so that blitting it onto the SSD1306 only
+      marks its own area of the screen as changed """
+
+  def __init__(self, width: int, height: int) -> None:
+    """ Create a blank sprite of given dimension
+        `width`: width of the sprite in pixels
+        `height`: height of the sprite in pixels """
+    self.width = width
+    self.height = height
+    self.buffer = bytearray(width * ((height + 7) // 8))
+    super().__init__(self.buffer, width, height, framebuf.MONO_VLSB)
+
+class RenderScheduler:
+  """ Owns the I2C bus shared by all OLEDs. Once begun, show() on a scheduled display only commits
+      its changed region, and a background thread transmits the pending regions of all displays,
+      each at most at its own frame rate. Commits made faster than the frame rate are coalesced """
+  SDA_PIN, SCL_PIN = 4, 5
+  DEFAULT_MAX_FPS = 30
+  IDLE_SLEEP_MS = 5 # sleep of render thread when no display is due
+
+  bus = None
+  targets = []
+  running = False
+
+  class _Target:
+    """ Refresh state of one scheduled display """
+    def __init__(self, ssd1306: SSD1306, max_fps: int) -> None:
+      """ Create the refresh state of given display
+          `ssd1306`: the display to be refreshed
+          `max_fps`: maximum number of frames transmitted per second """
+      self.ssd1306 = ssd1306
+      self.interval_ms = 1000 // max_fps
+      self.lock = _thread.allocate_lock()
+      self.pending = None # pending region as (x0, x1, p0, p1)
+      # show() copies its region into staging under lock on the drawing thread, flush copies the
+      # pending region out of staging under lock, so that neither drawing nor show() is blocked by the bus
+      self.staging = bytearray(ssd1306.buffer)
+      self.staging_view = memoryview(self.staging)
+      self.sending = bytearray(len(ssd1306.buffer))
+      self.sending_view = memoryview(self.sending)
+      self.source_view = memoryview(ssd1306.buffer)
+      self.last_flush = time.ticks_ms()
+      self.commits = 0
+      self.frames = 0
+      self.last_bus_us = 0
+      self.max_bus_us = 0
+      self.total_bus_us = 0
+
+    def commit(self, x0: int, x1: int, p0: int, p1: int) -> None:
+      """ Copy a changed region into staging and merge it into the pending region, called by
+          SSD1306.show() from the drawing thread """
+      width = self.ssd1306.width
+      self.lock.acquire()
+      self.staging_view[p0 * width:(p1 + 1) * width] = self.source_view[p0 * width:(p1 + 1) * width]
+      if self.pending == None:
+        self.pending = (x0, x1, p0, p1)
+      else:
+        px0, px1, pp0, pp1 = self.pending
+        self.pending = (min(x0, px0), max(x1, px1), min(p0, pp0), max(p1, pp1))
+      self.commits += 1
+      self.lock.release()
+
+    def flush(self) -> None:
+      """ Transmit the pending region and record bus time. Should only be called by render thread """
+      self.lock.acquire()
+      x0, x1, p0, p1 = self.pending
+      self.pending = None
+      width = self.ssd1306.width
+      self.sending_view[p0 * width:(p1 + 1) * width] = self.staging_view[p0 * width:(p1 + 1) * width]
+      self.lock.release()
+      start = time.ticks_us()
+      self.ssd1306.transmit(self.sending_view, x0, x1, p0, p1)
+      self.last_bus_us = time.ticks_diff(time.ticks_us(), start)
+      self.max_bus_us = max(self.max_bus_us, self.last_bus_us)
+      self.total_bus_us += self.last_bus_us
+      self.frames += 1
+      self.last_flush = time.ticks_ms()
+
+  @classmethod
+  def get_bus(cls) -> machine.SoftI2C:
+    """ Get the I2C bus shared by all OLEDs, created on first use
+        `returns`: the shared bus """
+    if cls.bus == None:
+      cls.bus = machine.SoftI2C(sda = machine.Pin(cls.SDA_PIN), scl = machine.Pin(cls.SCL_PIN))
+    return cls.bus
+
+  @classmethod
+  def attach(cls, ssd1306: SSD1306, max_fps: int = DEFAULT_MAX_FPS) -> None:
+    """ Take over refresh of given display, the caller must hold the display
+        `ssd1306`: the display to be refreshed by the scheduler
+        `max_fps`: maximum number of frames transmitted per second """
+    utils.ASSERT_TRUE(max_fps > 0 and max_fps <= 1000, f"Render scheduler invalid frame rate <{max_fps}>")
+    target = RenderScheduler._Target(ssd1306, max_fps)
+    cls.targets.append(target)
+    ssd1306.render_target = target
+
+  @classmethod
+  def begin(cls) -> None:
+    """ Begin the render thread. Notice, ESP32 runs at most 3 threads, the render thread takes the
+        place of the start screen thread, so this waits for it to exit first """
+    if cls.running:
+      return
+    utils.join_start_screen()
+    cls.running = True
+    Thread(cls.render_loop).run()
+
+  @classmethod
+  def render_loop(cls) -> None:
+    """ Flush every display that has a pending region and is due. Should NOT be called """
+    while cls.running:
+      flushed = False
+      now = time.ticks_ms()
+      for target in cls.targets:
+        if target.pending != None and time.ticks_diff(now, target.last_flush) >= target.interval_ms:
+          target.flush()
+          flushed = True
+      time.sleep_ms(1 if flushed else cls.IDLE_SLEEP_MS)
+
+  @classmethod
+  def print_status(cls) -> None:
+    """ Report frame and bus time statistics of every scheduled display, for debug use """
+    for target in cls.targets:
+      average = target.total_bus_us // target.frames if target.frames != 0 else 0
+      print(f"OLED 0x{target.ssd1306.addr:02X}: {target.frames} frames, " + 
+          f"{target.commits - target.frames} coalesced, bus time last {target.last_bus_us} us, " + 
+          f"avg {average} us, max {target.max_bus_us} us")
+
 class OLED:
   """ Drives the SSD1306 OLED using I2C, async operation supported """
   I2C_ADDR = (0x3C, 0x3D) # all available I2C address that SSD1306 can be on
@@ -78,13 +207,20 @@ class OLED:
     """ Create an OLED instance using given I2C address
         `addr`: I2C address of the SSD1306"""
     utils.ASSERT_TRUE(addr in OLED.I2C_ADDR, "Invalid OLED I2C address")
-    self.__i2c = machine.SoftI2C(sda = machine.Pin(4), scl = machine.Pin(5))
+    self.__i2c = RenderScheduler.get_bus()
     self.__ssd1306 = SSD1306_I2C(OLED.WIDTH, OLED.HEIGHT, self.__i2c, addr)
     self.__quit_signal = False
     self.__quit_signal_lock = _thread.allocate_lock()
 
     self.lock = _thread.allocate_lock()
 
+  def begin_scheduled_refresh(self, max_fps: int = RenderScheduler.DEFAULT_MAX_FPS) -> None:
+    """ Hand refresh of the screen over to the render scheduler, show() becomes non-blocking
+        `max_fps`: maximum number of frames transmitted per second """
+    self.lock.acquire()
+    RenderScheduler.attach(self.__ssd1306, max_fps)
+    self.lock.release()
+
   def __read_quit_signal(self, reset: bool = False) -> bool:
     """ Read the quit signal once, non-blocking, should NOT be called
         `reset`: reset the quit signal if asserted
@@ -277,3 +413,77 @@ class OLED:
     if not self.lock.acquire():
       return False
     self.lock.release()
+
+
+class TextCache:
+  """ Caches rendered text runs as sprites keyed by (text, inverse), the least recently used runs
+      are evicted beyond a fixed memory budget. Runs are blitted with transparent background, so
+      that they draw the same pixels as SSD1306.text with color 1, or color 0 if inverse """
+  BUDGET_BYTES = 4096
+
+  runs = {}
+  order = [] # keys of cached runs, least recently used first
+  used_bytes = 0
+  hits = 0
+  misses = 0
+
+  @classmethod
+  def width(cls, text: str) -> int:
+    """ Width of given text on screen in pixels """
+    return len(text) * OLED.CHAR_WIDTH
+
+  @classmethod
+  def get(cls, text: str, inverse: bool = False) -> Sprite:
+    """ Get the rendered run of given text, rendering it if not cached
+        `text`: text to be rendered, must not be empty
+        `inverse`: if the text is drawn in color 0 for placing on a lit background
+        `returns`: the rendered run """
+    key = (text, inverse)
+    sprite = cls.runs.get(key)
+    if sprite != None:
+      cls.hits += 1
+      if cls.order[-1] != key:
+        cls.order.remove(key)
+        cls.order.append(key)
+      return sprite
+    cls.misses += 1
+    sprite = Sprite(cls.width(text), OLED.CHAR_HEIGHT)
+    sprite.fill(int(inverse))
+    sprite.text(text, 0, 0, int(not inverse))
+    size = len(sprite.buffer)
+    if size > cls.BUDGET_BYTES:
+      return sprite
+    while cls.used_bytes + size > cls.BUDGET_BYTES:
+      cls.used_bytes -= len(cls.runs.pop(cls.order.pop(0)).buffer)
+    cls.runs[key] = sprite
+    cls.order.append(key)
+    cls.used_bytes += size
+    return sprite
+
+  @classmethod
+  def draw(cls, display_direct: SSD1306, text: str, x: int, y: int, inverse: bool = False) -> None:
+    """ Draw given text with its left-top corner at (x, y)
+        `display_direct`: the display framebuffer to draw on
+        `text`: text to be drawn
+        `x`, `y`: left-top corner of the text
+        `inverse`: if the text is drawn in color 0 for placing on a lit background """
+    if len(text) != 0:
+      display_direct.blit(cls.get(text, inverse), x, y, int(inverse))
+
+  @classmethod
+  def draw_centered(cls, display_direct: SSD1306, text: str, center_x: int, y: int, 
+      inverse: bool = False) -> None:
+    """ Draw given text horizontally centered at center_x, see `draw` """
+    cls.draw(display_direct, text, center_x - cls.width(text) // 2, y, inverse)
+
+  @classmethod
+  def draw_right(cls, display_direct: SSD1306, text: str, right_x: int, y: int, 
+      inverse: bool = False) -> None:
+    """ Draw given text with its right edge at right_x, see `draw` """
+    cls.draw(display_direct, text, right_x - cls.width(text), y, inverse)
+
+  @classmethod
+  def print_status(cls) -> None:
+    """ Report usage of the cache, for debug use """
+    print(f"Text runs: {len(cls.runs)}, {cls.used_bytes}/{cls.BUDGET_BYTES} bytes, " + 
+        f"hits {cls.hits}, misses {cls.misses}")
@@ -1,4 +1,4 @@
-import machine, _thread, time, array
+import machine, time, array
 
 import driver.utils as utils
 
@@ -42,87 +42,103 @@ class Button:
         self.__rx_callback(self.__id)
 
 
+class PWMSequence:
+  """ Immutable PWM output sequence, compiled once into runs of (value, duration in ms). Consecutive
+      entries of equal value are merged into one run, so that playback only wakes up on changes """
+  TICK_MS = 50 # duration unit of legacy tick sequences
+
+  def __init__(self, runs) -> None:
+    """ Compile a sequence from its runs
+        `runs`: iterable of (value, duration_ms) """
+    values = []
+    durations = []
+    for value, duration_ms in runs:
+      utils.ASSERT_TRUE(duration_ms >= 0, f"PWM Sequence invalid duration <{duration_ms}>")
+      if len(values) != 0 and values[-1] == value:
+        durations[-1] += duration_ms
+      else:
+        values.append(value)
+        durations.append(duration_ms)
+    utils.ASSERT_TRUE(len(values) != 0, "PWM Sequence empty")
+    self.values = tuple(values)
+    self.durations = tuple(durations)
+
+  def __len__(self) -> int:
+    return len(self.values)
+
+  @classmethod
+  def from_ticks(cls, seq, seq_end: int, tick_ms: int = TICK_MS):
+    """ Compile a legacy sequence, the caller's sequence is left untouched
+        `seq`: integer array of (value, duration) pairs, duration counted in ticks of at least one
+        `seq_end`: value the output rests at once the sequence finished, appended if not the last value
+        `tick_ms`: length of one tick in ms
+        `returns`: compiled sequence """
+    utils.ASSERT_TRUE(len(seq) % 2 == 0, "PWM Sequence length not even")
+    runs = [(seq[i], max(1, seq[i + 1]) * tick_ms) for i in range(0, len(seq), 2)]
+    if len(runs) == 0 or runs[-1][0] != seq_end:
+      runs.append((seq_end, tick_ms))
+    return cls(runs)
+
+
 class PWMOutput:
-  """ Controls output devices that uses PWM output """
+  """ Controls output devices that uses PWM output. Sequences queued on every output are played back
+      by one shared one-shot timer, which is armed for the earliest next change of all outputs """
   DUTY_MODE = 0
   FREQ_MODE = 1
-
-  class _Info:
-    """ Internal class used to store PWM related variables """
-    def __init__(self, size: int=50) -> None:
-      """ Create a new PWM Information instance
-          `size`: internal buffer size """
-      if size % 2 != 0:
-        utils.EXPECT_TRUE(False, f"PWM Output buffer size should be even, use {size + 1} instead of {size}")
-        size += 1
-      self.start = 0
-      self.len = 0
-      self.size = size
-      self.seq = array.array('i', (0 for _ in range(size)))
-    
-    def append(self, seq: array.array) -> bool:
-      """ Append sequence to the end of the internal buffer
-          `seq`: sequence to be appended to the internal buffer """
-      if self.size - self.len < len(seq):
-        return False
-      end = (self.start + self.len) % self.size
-      cutoff = self.size - end
-      self.len += len(seq)
-      if cutoff < len(seq):
-        self.seq[end:] = seq[:cutoff]
-        self.seq[:len(seq) - cutoff] = seq[cutoff:]
-      else:
-        self.seq[end:end + len(seq)] = seq
-    
-    def dequeue(self) -> int:
-      """ Get next action from the internal buffer """
-      if self.len == 0:
-        return -1
-      value = self.seq[self.start]
-      duration = self.seq[(self.start + 1) % self.size]
-      if duration <= 1: 
-        self.start = (self.start + 2) % self.size
-        self.len -= 2
-      else:
-        self.seq[(self.start + 1) % self.size] -= 1
-      return value
   
   timer = None
   active_tasks = {}
-  active_tasks_lock = _thread.allocate_lock()
 
   @classmethod
-  def auxiliary_init(cls, timer_period_ms: int=50) -> None:
+  def auxiliary_init(cls) -> None:
     """ Initializations that fulfill full requirements for system to operate """
     cls.timer = machine.Timer(utils.PWM_OUT_TIMER_ID)
-    cls.timer.init(mode=machine.Timer.PERIODIC, period=timer_period_ms, callback=PWMOutput.__update_callback)
 
   @classmethod
   def __update_callback(cls, timer: machine.Timer) -> None:
-    """ Internal irq function that called on timer triggering. Should NOT be called
+    """ Internal irq function that called on timer triggering, applies all due changes and arms the
+        timer for the next one. Should NOT be called
         `timer`: timer instance that triggered the callback """
-    cls.active_tasks_lock.acquire()
-    for id in cls.active_tasks.keys():
-      pwm_pin, mode, info = cls.active_tasks[id]
-      val = info.dequeue()
-      if val == -1:
-        continue
-      if mode == cls.DUTY_MODE:
-        pwm_pin.change_duty_cycle(val)
-      elif mode == cls.FREQ_MODE:
-        pwm_pin.change_frequency(val)
-    cls.active_tasks_lock.release()
-    
-
-  def __init__(self, id: int, mode: int, buf_size: int=50, freq: int=5000, duty: int=0) -> None:
+    now = time.ticks_ms()
+    next_delay = -1
+    for output in cls.active_tasks.values():
+      delay = output.__advance(now)
+      if delay != -1 and (next_delay == -1 or delay < next_delay):
+        next_delay = delay
+    if next_delay != -1:
+      cls.__arm(next_delay)
+    # sequences queued on idle outputs while advancing might have been overridden by the re-arm
+    for output in cls.active_tasks.values():
+      if output.__sequence == None and output.__queue_tail != output.__queue_head:
+        cls.__arm(0)
+        return
+
+  @classmethod
+  def __arm(cls, delay_ms: int) -> None:
+    """ Fire the update callback after the given delay. Should NOT be called """
+    cls.timer.init(mode=machine.Timer.ONE_SHOT, period=max(1, delay_ms), 
+        callback=PWMOutput.__update_callback)
+
+  def __init__(self, id: int, mode: int, queue_size: int=8, freq: int=5000, duty: int=0) -> None:
     """ Initialize a new PWM controlled output using GPIO id
-        `id`: id of the GPIO wished to be controlled using PWM """
+        `id`: id of the GPIO wished to be controlled using PWM
+        `mode`: PWMOutput.DUTY_MODE or PWMOutput.FREQ_MODE, the quantity sequences control
+        `queue_size`: maximum number of sequences waiting to be played """
     utils.ASSERT_TRUE(id not in PWMOutput.active_tasks.keys(), f"Duplicate PWMOut on pin [{id}]")
     utils.ASSERT_TRUE(mode == PWMOutput.DUTY_MODE or mode == PWMOutput.FREQ_MODE, f"Invalid PWMOut mode")
     self.__id = id
+    self.__mode = mode
     self.__pin = machine.Pin(id, machine.Pin.OUT)
     self.__pwm = machine.PWM(self.__pin, freq=freq, duty=duty)
-    PWMOutput.active_tasks[self.__id] = (self, mode, PWMOutput._Info(buf_size))
+    # single-producer single-consumer ring, head only moved by the caller, tail only by the timer
+    self.__queue = [None] * (queue_size + 1)
+    self.__queue_head = 0
+    self.__queue_tail = 0
+    # playback state, only touched by the timer
+    self.__sequence = None
+    self.__run = 0
+    self.__deadline = 0
+    PWMOutput.active_tasks[self.__id] = self
 
   def change_duty_cycle(self, duty: int) -> None:
     """ Change the duty cycle of the PWM output 
@@ -134,34 +150,83 @@ class PWMOutput:
         `freq`: destinated frequency """
     self.__pwm.freq(freq)
 
-  def append_sequence(self, seq: array.array, seq_end: str) -> bool:
-    if seq[-2] != seq_end:
-      seq.append(seq_end)
-      seq.append(1)
-    PWMOutput.active_tasks_lock.acquire()
-    ret = PWMOutput.active_tasks[self.__id][2].append(seq)
-    PWMOutput.active_tasks_lock.release()
-    return ret
+  def append_sequence(self, seq, seq_end: int) -> bool:
+    """ Queue a sequence to be played after all sequences queued before
+        `seq`: compiled PWMSequence, or legacy integer array of (value, ticks) pairs
+        `seq_end`: value the output rests at after a legacy sequence
+        `returns`: whether the sequence is queued, False if the queue is full """
+    if not isinstance(seq, PWMSequence):
+      seq = PWMSequence.from_ticks(seq, seq_end)
+    head = (self.__queue_head + 1) % len(self.__queue)
+    if head == self.__queue_tail:
+      return False
+    self.__queue[self.__queue_head] = seq
+    self.__queue_head = head
+    # the timer clears the playing sequence before looking for the next one, an output seen playing
+    # here will pick the sequence up by itself
+    if self.__sequence == None and PWMOutput.timer != None:
+      PWMOutput.__arm(0)
+    return True
+
+  def __advance(self, now: int) -> int:
+    """ Apply every change of this output due by now, called by the timer. Should NOT be called
+        `now`: current time in ms
+        `returns`: ms until the next change, -1 if nothing is left to play """
+    if self.__sequence == None and not self.__start_next(now):
+      return -1
+    while True:
+      remaining = time.ticks_diff(self.__deadline, now)
+      if remaining > 0:
+        return remaining
+      self.__run += 1
+      if self.__run == len(self.__sequence):
+        self.__sequence = None
+        # queued sequences continue seamlessly from the end of the previous one
+        if not self.__start_next(self.__deadline):
+          return -1
+      else:
+        self.__apply_run()
+
+  def __start_next(self, start: int) -> bool:
+    """ Take the next sequence from the queue and begin playing it. Should NOT be called
+        `start`: time in ms the sequence begins at
+        `returns`: whether there was a sequence to play """
+    if self.__queue_tail == self.__queue_head:
+      return False
+    self.__run = 0
+    self.__deadline = start
+    self.__sequence = self.__queue[self.__queue_tail]
+    self.__queue[self.__queue_tail] = None
+    self.__queue_tail = (self.__queue_tail + 1) % len(self.__queue)
+    self.__apply_run()
+    return True
+
+  def __apply_run(self) -> None:
+    """ Output the value of the current run and set the deadline to its end. Should NOT be called """
+    value = self.__sequence.values[self.__run]
+    self.__deadline = time.ticks_add(self.__deadline, self.__sequence.durations[self.__run])
+    if self.__mode == PWMOutput.DUTY_MODE:
+      self.change_duty_cycle(value)
+    else:
+      self.change_frequency(value)
 
 class VibrationMotor(PWMOutput):
   """ Class extends from PWMOutput that used to control vibration motor """
   SEQ_END = 0
-  slight_seq = array.array('i', [1023, 6,  SEQ_END, 1])
-  medium_seq = array.array('i', [1023, 12,  SEQ_END, 1])
-  heavy_seq  = array.array('i', [1023, 18, SEQ_END, 1])
-  double_seq = array.array('i', [1023, 6, 0, 6, 1023, 6, SEQ_END, 1])
-  triple_seq = array.array('i', [1023, 6, 0, 6, 1023, 6, 0, 6, 1023, 6, SEQ_END, 1])
-
-  def __init__(self, id: int, buf_size: int = 50) -> None:
-    super().__init__(id, PWMOutput.DUTY_MODE, buf_size, freq=2000, duty=0)
+  slight_seq = PWMSequence(((1023, 300), (SEQ_END, 50)))
+  medium_seq = PWMSequence(((1023, 600), (SEQ_END, 50)))
+  heavy_seq  = PWMSequence(((1023, 900), (SEQ_END, 50)))
+  double_seq = PWMSequence(((1023, 300), (0, 300), (1023, 300), (SEQ_END, 50)))
+  triple_seq = PWMSequence(((1023, 300), (0, 300), (1023, 300), (0, 300), (1023, 300), (SEQ_END, 50)))
+
+  def __init__(self, id: int, queue_size: int = 8) -> None:
+    super().__init__(id, PWMOutput.DUTY_MODE, queue_size, freq=2000, duty=0)
     self.__pwm.duty(0)
 
-  def custom_vibration(self, seq: array.array) -> bool:
+  def custom_vibration(self, seq) -> bool:
     """ Command the vibration motor using user defined sequence 
-        `seq`: user defined sequence, should be a integer array, each of the entry is in the range
-            [0, 256), representing a duty cycle of [entry / 1024]. each of the entry represents
-            the vibration strength in consecutive 100ms period """
-    utils.ASSERT_TRUE(len(seq) % 2 == 0, "Vibration Motor Sequence length not even")
+        `seq`: PWMSequence of (duty, ms) runs, or legacy integer array of (duty, ticks) pairs, duty
+            in the range [0, 1024), representing a duty cycle of [entry / 1024], one tick is 50ms """
     return self.append_sequence(seq, VibrationMotor.SEQ_END)
 
 class Buzzer(PWMOutput):
@@ -189,22 +254,22 @@ class Buzzer(PWMOutput):
   VOLUME_MAX = 4000
   VOLUME_GRANULARITY = 10
 
-  bootup = array.array('i', [C[6], 2, D[6], 2, E[6], 2, F[6], 2, G[6], 2, SEQ_END, 2])
-  double_seq = array.array('i', [E[6], 2, PAUSE, 2, E[6], 2, SEQ_END, 2])
-  triple_seq = array.array('i', [E[6], 2, PAUSE, 2, E[6], 2, PAUSE, 2, E[6], 2, SEQ_END, 2])
-  long_seq = array.array('i', [E[6], 10, SEQ_END, 2])
-  double_long_seq = array.array('i', [E[6], 10, PAUSE, 10, E[6], 10, SEQ_END, 2])
+  bootup = PWMSequence.from_ticks([C[6], 2, D[6], 2, E[6], 2, F[6], 2, G[6], 2, SEQ_END, 2], SEQ_END)
+  double_seq = PWMSequence.from_ticks([E[6], 2, PAUSE, 2, E[6], 2, SEQ_END, 2], SEQ_END)
+  triple_seq = PWMSequence.from_ticks([E[6], 2, PAUSE, 2, E[6], 2, PAUSE, 2, E[6], 2, SEQ_END, 2], SEQ_END)
+  long_seq = PWMSequence.from_ticks([E[6], 10, SEQ_END, 2], SEQ_END)
+  double_long_seq = PWMSequence.from_ticks([E[6], 10, PAUSE, 10, E[6], 10, SEQ_END, 2], SEQ_END)
   
-  mystery = array.array("i", [
+  mystery = PWMSequence.from_ticks([
     G[5], 4, A[5], 4, C[6], 4, A[5], 4, E[6], 11, PAUSE, 1, E[6], 12, D[6], 18, 
     G[5], 4, A[5], 4, C[6], 4, A[5], 4, D[6], 11, PAUSE, 1, D[6], 12, C[6], 18, 
     G[5], 4, A[5], 4, C[6], 4, A[5], 4, C[6], 12, D[6], 12, B[5], 4, A[5], 4, G[5], 4, D[6], 8, C[6], 22, 
     G[5], 4, A[5], 4, C[6], 4, A[5], 4, E[6], 11, PAUSE, 1, E[6], 12, D[6], 16, 
     G[5], 4, A[5], 4, C[6], 4, A[5], 4, G[6], 12, B[5], 12, C[6], 18, 
-    G[5], 4, A[5], 4, C[6], 4, A[5], 4, C[6], 12, D[6], 12, B[5], 4, A[5], 4, G[5], 4, D[6], 8, C[6], 22])
+    G[5], 4, A[5], 4, C[6], 4, A[5], 4, C[6], 12, D[6], 12, B[5], 4, A[5], 4, G[5], 4, D[6], 8, C[6], 22], SEQ_END)
 
-  def __init__(self, id: int, volume: int, buf_size: int = 120) -> None:
-    super().__init__(id, PWMOutput.FREQ_MODE, buf_size, freq=1, duty=0)
+  def __init__(self, id: int, volume: int, queue_size: int = 8) -> None:
+    super().__init__(id, PWMOutput.FREQ_MODE, queue_size, freq=1, duty=0)
     self.__volume = volume
     self.set_volume(self.__volume)
   
@@ -223,10 +288,8 @@ class Buzzer(PWMOutput):
   def get_volume(self) -> int:
     return self.__volume
 
-  def custom_sound(self, seq: array.array) -> None:
+  def custom_sound(self, seq) -> bool:
     """ Command the buzzer using user defined sequence 
-        `seq`: user defined sequence, should be a integer array, each of the entry is in the range
-            [0, 256), representing a duty cycle of [entry / 1024]. each of the entry represents
-            the vibration strength in consecutive 100ms period """
-    utils.ASSERT_TRUE(len(seq) % 2 == 0, "Buzzer Sequence length not even")
+        `seq`: PWMSequence of (frequency, ms) runs, or legacy integer array of (frequency, ticks)
+            pairs, one tick is 50ms """
     return self.append_sequence(seq, Buzzer.SEQ_END)
@@ -25,6 +25,9 @@ SET_CHARGE_PUMP = const(0x8D)
 
 # Subclassing FrameBuffer provides support for graphics primitives
 # http://docs.micropython.org/en/latest/pyboard/library/framebuf.html
+# Drawing primitives are wrapped to track the dirty rectangle, so that show() only transmits the
+# columns and pages changed since the last show(). Code writing to the buffer by other means must
+# call mark_dirty() or show(full=True)
 class SSD1306(framebuf.FrameBuffer):
   def __init__(self, width, height, external_vcc):
     self.width = width
@@ -34,6 +37,10 @@ class SSD1306(framebuf.FrameBuffer):
     self.buffer = bytearray(self.pages * self.width)
     super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
     self.__saved_buffer = bytearray(self.pages * self.width)
+    self.__buffer_view = memoryview(self.buffer)
+    self.__page_views = [None] * self.pages
+    self.render_target = None # set once refresh is taken over by the render scheduler
+    self.mark_all_dirty()
     self.init_display()
 
   def init_display(self):
@@ -101,22 +108,130 @@ class SSD1306(framebuf.FrameBuffer):
 
   def redisplay_buffer(self) -> None:
     self.buffer[:] = self.__saved_buffer
+    self.mark_all_dirty()
 
-  def show(self):
-    x0 = 0
-    x1 = self.width - 1
+  # dirty rectangle tracking
+
+  def mark_dirty(self, x: int, y: int, w: int, h: int) -> None:
+    """ Mark a region of the buffer as changed, clipped to the screen
+        `x`, `y`: left-top corner of the region
+        `w`, `h`: width and height of the region """
+    x0 = max(x, 0)
+    x1 = min(x + w, self.width) - 1
+    y0 = max(y, 0)
+    y1 = min(y + h, self.height) - 1
+    if x0 > x1 or y0 > y1:
+      return
+    if self.__dirty_x0 > x0:
+      self.__dirty_x0 = x0
+    if self.__dirty_x1 < x1:
+      self.__dirty_x1 = x1
+    if self.__dirty_p0 > y0 >> 3:
+      self.__dirty_p0 = y0 >> 3
+    if self.__dirty_p1 < y1 >> 3:
+      self.__dirty_p1 = y1 >> 3
+
+  def mark_all_dirty(self) -> None:
+    self.__dirty_x0 = 0
+    self.__dirty_x1 = self.width - 1
+    self.__dirty_p0 = 0
+    self.__dirty_p1 = self.pages - 1
+
+  def is_dirty(self) -> bool:
+    return self.__dirty_x0 <= self.__dirty_x1
+
+  def __clear_dirty(self) -> None:
+    self.__dirty_x0 = self.width
+    self.__dirty_x1 = -1
+    self.__dirty_p0 = self.pages
+    self.__dirty_p1 = -1
+
+  def fill(self, c):
+    super().fill(c)
+    self.mark_all_dirty()
+
+  def fill_rect(self, x, y, w, h, c):
+    super().fill_rect(x, y, w, h, c)
+    self.mark_dirty(x, y, w, h)
+
+  def rect(self, x, y, w, h, c, f=False):
+    super().rect(x, y, w, h, c, f)
+    self.mark_dirty(x, y, w, h)
+
+  def pixel(self, x, y, c=None):
+    if c is None:
+      return super().pixel(x, y)
+    super().pixel(x, y, c)
+    self.mark_dirty(x, y, 1, 1)
+
+  def hline(self, x, y, w, c):
+    super().hline(x, y, w, c)
+    self.mark_dirty(x, y, w, 1)
+
+  def vline(self, x, y, h, c):
+    super().vline(x, y, h, c)
+    self.mark_dirty(x, y, 1, h)
+
+  def line(self, x1, y1, x2, y2, c):
+    super().line(x1, y1, x2, y2, c)
+    self.mark_dirty(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1)
+
+  def text(self, s, x, y, c=1):
+    super().text(s, x, y, c)
+    self.mark_dirty(x, y, len(s) * 8, 8)
+
+  def blit(self, fbuf, x, y, key=-1, palette=None):
+    super().blit(fbuf, x, y, key, palette)
+    # plain FrameBuffers do not expose their size, assume they reach the right-bottom corner
+    self.mark_dirty(x, y, getattr(fbuf, "width", self.width - x), getattr(fbuf, "height", self.height - y))
+
+  def scroll(self, xstep, ystep):
+    super().scroll(xstep, ystep)
+    self.mark_all_dirty()
+
+  def show(self, full=False):
+    """ Transmit the changed region of the buffer to the display, or only commit it to the render
+        scheduler when refresh is scheduled
+        `full`: transmit the whole buffer regardless of changes """
+    if full:
+      self.mark_all_dirty()
+    if not self.is_dirty():
+      return
+    x0 = self.__dirty_x0
+    x1 = self.__dirty_x1
+    p0 = self.__dirty_p0
+    p1 = self.__dirty_p1
+    self.__clear_dirty()
+    if self.render_target != None:
+      self.render_target.commit(x0, x1, p0, p1)
+      return
+    self.transmit(self.__buffer_view, x0, x1, p0, p1)
+
+  def transmit(self, source, x0, x1, p0, p1):
+    """ Transmit a region of a buffer laid out as the framebuffer to the display
+        `source`: memoryview of the buffer, the framebuffer itself or a copy of it
+        `x0`, `x1`: first and last column of the region
+        `p0`, `p1`: first and last page of the region """
+    col_offset = 0
     if self.width != 128:
       # narrow displays use centred columns
       col_offset = (128 - self.width) // 2
-      x0 += col_offset
-      x1 += col_offset
     self.write_cmd(SET_COL_ADDR)
-    self.write_cmd(x0)
-    self.write_cmd(x1)
+    self.write_cmd(x0 + col_offset)
+    self.write_cmd(x1 + col_offset)
     self.write_cmd(SET_PAGE_ADDR)
-    self.write_cmd(0)
-    self.write_cmd(self.pages - 1)
-    self.write_data(self.buffer)
+    self.write_cmd(p0)
+    self.write_cmd(p1)
+    if x0 == 0 and x1 == self.width - 1:
+      # full rows are contiguous in the buffer
+      self.write_data(source[p0 * self.width:(p1 + 1) * self.width])
+      return
+    # the window wraps to its next page after x1, send the slice of every page back to back
+    cnt = p1 - p0 + 1
+    for i in range(cnt):
+      start = (p0 + i) * self.width
+      self.__page_views[i] = source[start + x0:start + x1 + 1]
+    self.write_data_list(self.__page_views, cnt)
 
 
 class SSD1306_I2C(SSD1306):
@@ -136,6 +251,10 @@ class SSD1306_I2C(SSD1306):
     self.write_list[1] = buf
     self.i2c.writevto(self.addr, self.write_list)
 
+  def write_data_list(self, bufs, cnt):
+    # one transaction for all buffers
+    self.i2c.writevto(self.addr, [self.write_list[0]] + bufs[:cnt])
+
 
 class SSD1306_SPI(SSD1306):
   def __init__(self, width, height, spi, dc, res, cs, external_vcc=False):
@@ -171,4 +290,13 @@ class SSD1306_SPI(SSD1306):
     self.cs(0)
     self.spi.write(buf)
     self.cs(1)
+
+  def write_data_list(self, bufs, cnt):
+    self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+    self.cs(1)
+    self.dc(1)
+    self.cs(0)
+    for i in range(cnt):
+      self.spi.write(bufs[i])
+    self.cs(1)
     
\ No newline at end of file
@@ -78,11 +78,18 @@ class Thread:
   def __init__(self, func) -> None:
     """ Create a Thread object using the desired function to be run in a new thread """
     self.__func = func
+    self.__running = False
 
   def run(self, *args: tuple, **kwargs: dict) -> None:
     """ Run the give thread using possible arguments """
+    self.__running = True
     _thread.start_new_thread(self.__thread_wrapper, args, kwargs)
 
+  def is_running(self) -> bool:
+    """ Check if the thread is still running, cleared only right before the thread exits
+        `returns`: whether the thread is running """
+    return self.__running
+
   def __thread_wrapper(self, *args: tuple, **kwargs: dict) -> None:
     """ Wrapper function that used to retrieve properties corresponding to the thread.
         Should NOT be called """
@@ -101,6 +108,7 @@ class Thread:
     Thread.thread_pool_lock.release()
     # manually call garbage collector and exit thread
     gc.collect()
+    self.__running = False
     _thread.exit()
 
   @classmethod
@@ -1,20 +1,23 @@
-import os
+import os, binascii, machine, time
 from functionality.board import Board
 from driver.threading import Thread
+from driver.event_log import EventLog
 
 # Timer IDs used by different utilities
 UART_TIMER_ID = 2
 PWM_OUT_TIMER_ID = 3
 
 start_screen_exit_sig = None # If start screen have exited
+start_screen_thread = None # thread playing the start screen, None if not played
 def execute_main(func, start_screen: bool = True) -> None:
   """ Execute the main function, call all the main_init functions before running the main thread
       `start_screen`: whether the start screen animation is played"""
   # main initializations
   Board.main_init()
+  EventLog.log(EventLog.INFO, EventLog.BOOT, f"reset cause {machine.reset_cause()}")
 
   # display start screen if needed
-  global start_screen_exit_sig
+  global start_screen_exit_sig, start_screen_thread
   start_screen_exit_sig = True
   if start_screen:
     start_screen_exit_sig = False
@@ -31,6 +34,12 @@ def start_screen_exited() -> bool:
   global start_screen_exit_sig
   return start_screen_exit_sig
 
+def join_start_screen() -> None:
+  """ Wait for the start screen thread to exit, its animation exits earlier than the thread,
+      which still waits for the quit signal """
+  while start_screen_thread != None and start_screen_thread.is_running():
+    time.sleep_ms(10)
+
 
 # Assertion -------------------------------------------------------------------
 
@@ -38,12 +47,14 @@ def EXPECT_TRUE(condition: bool, message: str) -> None:
   """ Expect condition to be true, generate a warning if violated, non-blocking """
   if not condition:
     print(f"Warning: {message}")
+    EventLog.log(EventLog.WARNING, EventLog.EXPECT, message)
     Board.status_led.show_warning()
   
 def ASSERT_TRUE(condition: bool, message: str) -> None:
   """ Assert condition to be true, generate an error if violated, blocking """
   if not condition:
     print(f"ERROR: {message}")
+    EventLog.log(EventLog.ERROR, EventLog.ASSERT, message)
     Board.status_led.show_error()
   
 
@@ -67,3 +78,20 @@ def storage_status() -> None:
   print(f"Fragment size:                {fs_frsize} kB")
   print(f"Total size of Filesystem:     {f_blocks} blocks")
   print(f"Available size of Filesystem: {f_bfree} blocks") 
+
+def print_event_log() -> None:
+  """ Print all records of the event log to REPL, oldest first """
+  for record in EventLog.records():
+    print(EventLog.format_record(record))
+
+def dump_event_log() -> None:
+  """ Print all records of the event log to REPL hex encoded, one record per line, to be read by
+      gesture/event_log_dump.py """
+  print("EVENT LOG BEGIN")
+  for record in EventLog.raw_records():
+    print(binascii.hexlify(record).decode())
+  print("EVENT LOG END")
+
+def clear_event_log() -> None:
+  """ Remove all records of the event log """
+  EventLog.clear()
@@ -1,15 +1,17 @@
-import machine, _thread, time, gc
+import machine, _thread, time, gc, binascii
 
 import driver.utils as utils
-from driver.display import OLED, Drawing
+from driver.display import OLED, Drawing, RenderScheduler, TextCache
 from driver.status_led import StatusLed
 from driver.threading import ThreadSafeQueue
+from driver.event_log import EventLog
 from driver.io import Button, Buzzer, PWMOutput, VibrationMotor
 
 from functionality.menu import Menu
 from functionality.snake import SnakeGame
 from functionality.config import Config
 from functionality.text_viewer import TextViewer
+from functionality.feedback import Feedback
 from functionality.communication import Communication as Com
 
 def uart1_rx_callback() -> None:
@@ -30,6 +32,8 @@ class Board:
   # displays
   main_display = None
   secondary_display = None
+  MAIN_DISPLAY_FPS = 30
+  SECONDARY_DISPLAY_FPS = 15
 
   # status led
   status_led = None
@@ -98,6 +102,7 @@ class Board:
     except Exception:
       pass
     cls.buzzer = Buzzer(23, volume)
+    cls.feedback = Feedback(cls.vmotor, cls.buzzer)
 
     cls.text_viewer = TextViewer()
 
@@ -108,6 +113,12 @@ class Board:
     cls.button26.begin(botton_pressed_callback)
     cls.button27.begin(botton_pressed_callback)
 
+    # render thread takes the place of the exited start screen thread
+    cls.main_display.begin_scheduled_refresh(cls.MAIN_DISPLAY_FPS)
+    if cls.secondary_display != None:
+      cls.secondary_display.begin_scheduled_refresh(cls.SECONDARY_DISPLAY_FPS)
+    RenderScheduler.begin()
+
   @classmethod
   def end_operation(cls) -> None:
     """ End operation of all facilities """
@@ -180,7 +191,7 @@ class Board:
         elif message == Board.BUTTON2:
           choice_idx = Menu.RQ_menu.choose(0)
           break
-        Menu.RQ_menu.display_choices(Board.main_display)
+        Menu.RQ_menu.update_highlight(Board.main_display)
 
       time.sleep_ms(10)
 
@@ -211,7 +222,9 @@ class Board:
         elif message == Board.BUTTON2:
           choice_idx = menu.choose(reset_idx)
           break
-        menu.display_choices(display)
+        menu.update_highlight(display)
+      # write logged records to flash outside of callbacks
+      EventLog.poll()
       time.sleep_ms(50)
     if undisplay:
       menu.undisplay_choices(display)
@@ -275,7 +288,7 @@ class Board:
 
     display.lock.acquire()
     display_direct.fill(0)
-    display_direct.text(title, title_x_offset, title_y_offset, 1)
+    TextCache.draw(display_direct, title, title_x_offset, title_y_offset)
 
     user_string = initial_string
     keyboard.change_highlight(Menu.keyboard_sequence.index(initial_key))
@@ -316,10 +329,51 @@ class Board:
         `wrap_content`: whether to wrap the content in case line length exceed screen width
         `delimiter`: used when determine line split point """
     gc.collect()
-    display_direct = display.get_direct_control()
     display.lock.acquire()
     display.display_loading_screen()
     cls.text_viewer.set_text_to_view(text, wrap_content, delimiter)
+    display.lock.release()
+    cls.view_text_and_wait(display)
+
+  @classmethod
+  def begin_file_viewer(cls, display: OLED, path: str, wrap_content: bool=True) -> None:
+    """ Begin the operation of a text viewer on a file, only the displayed page is read into
+        memory, will clear screen after operation is done
+        `display`: the OLED for text to be displayed on
+        `path`: path of the file to be viewed
+        `wrap_content`: whether to wrap the content in case line length exceed screen width """
+    gc.collect()
+    display.lock.acquire()
+    display.display_loading_screen()
+    try:
+      cls.text_viewer.set_file_to_view(path, wrap_content)
+    except OSError:
+      utils.EXPECT_TRUE(False, f"Text viewer cannot open <{path}>")
+      cls.text_viewer.set_text_to_view("", wrap_content, "\n")
+    display.lock.release()
+    cls.view_text_and_wait(display)
+
+  @classmethod
+  def begin_generator_viewer(cls, display: OLED, factory, wrap_content: bool=True) -> None:
+    """ Begin the operation of a text viewer on generated lines, only the displayed page is kept
+        in memory, will clear screen after operation is done
+        `display`: the OLED for text to be displayed on
+        `factory`: callable returning a fresh iterator over the lines each time it is called
+        `wrap_content`: whether to wrap the content in case line length exceed screen width """
+    gc.collect()
+    display.lock.acquire()
+    display.display_loading_screen()
+    cls.text_viewer.set_generator_to_view(factory, wrap_content)
+    display.lock.release()
+    cls.view_text_and_wait(display)
+
+  @classmethod
+  def view_text_and_wait(cls, display: OLED) -> None:
+    """ Helpper function, display the text set to the text viewer and page through it until user
+        exits. Notice, this method is helpper function for <begin_text_viewer>, do NOT call directly
+        `display`: the OLED for text to be displayed on """
+    display_direct = display.get_direct_control()
+    display.lock.acquire()
     display_direct.fill(0)
     display.lock.release()
     cls.text_viewer.view_on_display(display)
@@ -329,16 +383,18 @@ class Board:
         message = Board.get_button_message()
         if message == Board.BUTTON1:
           cls.text_viewer.PNE_menu_rotate(Menu.CHANGE_PREV)
+          cls.text_viewer.PNE_menu_update(display)
         elif message == Board.BUTTON3:
           cls.text_viewer.PNE_menu_rotate(Menu.CHANGE_NEXT)
+          cls.text_viewer.PNE_menu_update(display)
         elif message == Board.BUTTON2:
           should_exit = cls.text_viewer.PNE_menu_choose()
           if should_exit:
             break
-        display.lock.acquire()
-        display.get_direct_control().fill(0)
-        display.lock.release()
-        cls.text_viewer.view_on_display(display)
+          display.lock.acquire()
+          display.get_direct_control().fill(0)
+          display.lock.release()
+          cls.text_viewer.view_on_display(display)
       time.sleep_ms(50)
     display.lock.acquire()
     display_direct.fill(0)
@@ -355,8 +411,8 @@ class Board:
     # acquire display lock and start displaying waiting message
     display.lock.acquire()
     display_direct.fill(0)
-    display_direct.text("Estimation", 24, 20, 1)
-    display_direct.text("In Progress...", 8, 36, 1)
+    TextCache.draw(display_direct, "Estimation", 24, 20)
+    TextCache.draw(display_direct, "In Progress...", 8, 36)
     display_direct.show()
     # wait until main controller responds with reject or confirm
     status, msg = cls.uart1_com.wait_for_reject_or_confirm()
@@ -370,18 +426,14 @@ class Board:
     if status: # confirm and valid report format
       display_direct.fill(0)
       # Euclidean report
-      display_direct.text("Euclidean:", 24, 4, 1)
-      displayed_msg = f"{preprocess[0][1:]} it/s"
-      display_direct.text(displayed_msg, 
-          64 - len(displayed_msg) * OLED.CHAR_WIDTH // 2, 16)
+      TextCache.draw(display_direct, "Euclidean:", 24, 4)
+      TextCache.draw_centered(display_direct, f"{preprocess[0][1:]} it/s", 64, 16)
       # quarternion report
-      display_direct.text("Quarternion:", 16, 28, 1)
-      displayed_msg = f"{preprocess[1][1:]} it/s"
-      display_direct.text(displayed_msg, 
-          64 - len(displayed_msg) * OLED.CHAR_WIDTH // 2, 40)
+      TextCache.draw(display_direct, "Quarternion:", 16, 28)
+      TextCache.draw_centered(display_direct, f"{preprocess[1][1:]} it/s", 64, 40)
     else: # reject
       display_direct.fill(0)
-      display_direct.text("No available IMU", 0, 24, 1)
+      TextCache.draw(display_direct, "No available IMU", 0, 24)
     # display back menu
     display.lock.release()
     Menu.B_menu.change_x_offset(47)
@@ -507,6 +559,13 @@ class Board:
     display.lock.release()
     gc.collect()
 
+  @classmethod
+  def display_event_log(cls, display: OLED) -> None:
+    """ Browse the event log of this controller, oldest first, read from flash page by page
+        `display`: the OLED for the log to be displayed on """
+    cls.begin_generator_viewer(display, 
+        lambda: (EventLog.format_record(record) for record in EventLog.records()))
+
   @classmethod
   def begin_address_assignment(cls, display: OLED, addresses: set, config: Config):
     gc.collect()
@@ -759,8 +818,8 @@ class Board:
       # no default config, report warning
       display.lock.acquire()
       display_direct.fill(0)
-      display_direct.text("No default", 24, 12)
-      display_direct.text("config selected", 4, 28)
+      TextCache.draw(display_direct, "No default", 24, 12)
+      TextCache.draw(display_direct, "config selected", 4, 28)
       display.lock.release()
       Menu.B_menu.change_x_offset(47)
       Menu.B_menu.change_y_offset(43)
@@ -776,19 +835,18 @@ class Board:
       cls.uart1_com.send(Com.BLUETOOTH, Com.NAME)
       display.lock.acquire()
       display_direct.fill(0)
-      display_direct.text("Bluetooth", 16, 4)
-      display_direct.text("Not Connected", 0, 12)
+      TextCache.draw(display_direct, "Bluetooth", 16, 4)
+      TextCache.draw(display_direct, "Not Connected", 0, 12)
       display_direct.blit(Drawing.get_warning_sign(), 108, 3)
-      display_direct.text("Connect to", 24, 24)
+      TextCache.draw(display_direct, "Connect to", 24, 24)
       display.lock.release()
       
       name = cls.uart1_com.blocking_read(Com.CONFIRM)
 
       display.lock.acquire()
-      display_direct.fill_rect(64 - len(name) * OLED.CHAR_WIDTH // 2, 33, 
-          len(name) * OLED.CHAR_WIDTH, 9, 1)
-      display_direct.text(name, 64 - len(name) * OLED.CHAR_WIDTH // 2, 34, 0)
-      display_direct.text("To Continue", 20, 44)
+      display_direct.fill_rect(64 - TextCache.width(name) // 2, 33, TextCache.width(name), 9, 1)
+      TextCache.draw_centered(display_direct, name, 64, 34, inverse=True)
+      TextCache.draw(display_direct, "To Continue", 20, 44)
       display.lock.release()
       Menu.B_menu.change_x_offset(47)
       Menu.B_menu.change_y_offset(53)
@@ -801,29 +859,14 @@ class Board:
     config = Config()
     config.associate_with_file(config_name)
     utils.ASSERT_TRUE(config.read_config_from_file(), "Start Operation association failed")
-    # send to main controller
-    messages = config.get_config_string(readable=False).split("\n")
-    Board.uart1_com.send(Com.IMU, Com.BULK)
-    ret = Board.uart1_com.blocking_read(Com.CONFIRM)
-    utils.ASSERT_TRUE(ret == Com.BULK,
-        f"Operation bulk communication failed at begining, unexpected <{ret.decode()}>")
-    # send config to main controller
-    success = True
-    for message in messages:
-      Board.uart1_com.send(Com.IMU, message)
-      ret, ret_message = Board.uart1_com.wait_for_reject_or_confirm()
-      if not ret: # IMU not detected by main controller
-        cls.display_error_log(cls.second_display_priority(), ret_message)
-        display.lock.acquire()
-        display_direct.fill(0)
-        display.lock.release()
-        success = False
-        break
-    Board.uart1_com.send(Com.IMU, Com.TERMINATE)
-    ret = Board.uart1_com.blocking_read(Com.CONFIRM)
-    utils.ASSERT_TRUE(ret == Com.TERMINATE, 
-        f"Operation bulk communication failed at termination, unexpected <{ret.decode()}>")
-    if not success:
+    # send config to main controller in one message, binary config is hex encoded for UART framing
+    Board.uart1_com.send(Com.CONFIG, binascii.hexlify(config.get_encoded()))
+    ret, ret_message = Board.uart1_com.wait_for_reject_or_confirm()
+    if not ret: # IMU not detected by main controller
+      cls.display_error_log(cls.second_display_priority(), ret_message)
+      display.lock.acquire()
+      display_direct.fill(0)
+      display.lock.release()
       return
     # operation begin
     Board.uart1_com.send(Com.IMU, Com.BEGIN)
@@ -833,59 +876,26 @@ class Board:
 
     display.lock.acquire()
     display_direct.fill(0)
-    display_direct.text("In Operation", 16, 24)
+    TextCache.draw(display_direct, "In Operation", 16, 24)
     display.lock.release()
     Menu.B_menu.change_x_offset(47)
     Menu.B_menu.change_y_offset(43)
     Menu.B_menu.display_choices(display)
     Board.uart1_com.discard_all(Com.BLUETOOTH)
+    Board.uart1_com.discard_all(Com.FEEDBACK)
     while True:
       if Board.is_button_pending():
         if Board.get_button_message() == Board.BUTTON2:
           break
+      # apply all feedback received since last iteration
+      if Com.FEEDBACK in Board.uart1_com.pending_categories():
+        for msg in Board.uart1_com.read_all(Com.FEEDBACK):
+          Board.feedback.handle_frame(msg)
       if Com.BLUETOOTH in Board.uart1_com.pending_categories():
-        msg = Board.uart1_com.read(Com.BLUETOOTH).decode()
-        request, num = msg.split(",")
-        request = request.lower()
-        print(request, num)
-        if request == "m":
-          if num == "0":
-            Board.vmotor.custom_vibration(VibrationMotor.slight_seq)
-          elif num == "1":
-            Board.vmotor.custom_vibration(VibrationMotor.medium_seq)
-          elif num == "2":
-            Board.vmotor.custom_vibration(VibrationMotor.heavy_seq)
-          elif num == "3":
-            Board.vmotor.custom_vibration(VibrationMotor.double_seq)
-          elif num == "4":
-            Board.vmotor.custom_vibration(VibrationMotor.triple_seq)
-          else:
-            utils.EXPECT_TRUE(False, f"Bluetooth invalid vmotor request index <{num}>")
-        elif request == "b":
-          if num == "0":
-            Board.buzzer.custom_sound(Buzzer.double_seq)
-          elif num == "1":
-            Board.buzzer.custom_sound(Buzzer.triple_seq)
-          elif num == "2":
-            Board.buzzer.custom_sound(Buzzer.long_seq)
-          elif num == "3":
-            Board.buzzer.custom_sound(Buzzer.double_long_seq)
-          else:
-            utils.EXPECT_TRUE(False, f"Bluetooth invalid buzzer request index <{num}>")
-        elif request == "vr":
-          try:
-            volume = int(num)
-          except Exception:
-            utils.EXPECT_TRUE(False, f"Bluetooth invalid relative volume <{num}>")
-          Board.buzzer.set_volume(Board.buzzer.get_volume() + volume)
-        elif request == "va":
-          try:
-            volume = int(num)
-          except Exception:
-            utils.EXPECT_TRUE(False, f"Bluetooth invalid absolute volume <{num}>")
-          Board.buzzer.set_volume(volume)
-        else:
-          utils.EXPECT_TRUE(False, f"Bluetooth invalid request <{request}>")
+        for msg in Board.uart1_com.read_all(Com.BLUETOOTH):
+          Board.feedback.handle_text(msg.decode())
+      # write records logged during operation to flash outside of callbacks
+      EventLog.poll()
       time.sleep_ms(100)
     Menu.B_menu.undisplay_choices(display)
     Board.get_all_button_message()
@@ -941,6 +951,51 @@ class Board:
     display_direct.fill(0)
     display.lock.release()
 
+  @classmethod
+  def change_bluetooth_profile(cls, display: OLED) -> None:
+    gc.collect()
+    display_direct = display.get_direct_control()
+    # profiles in the order of choices in the profile menu
+    profiles = (Com.LOW_LATENCY.decode(), Com.POWER_SAVING.decode())
+    choice_y_offsets = (31, 42)
+
+    display.lock.acquire()
+    display.display_loading_screen()
+    display.lock.release()
+
+    while True:
+      # query current profile and negotiated parameters
+      cls.uart1_com.send(Com.BLUETOOTH, Com.PARAMS)
+      _, report = cls.uart1_com.wait_for_reject_or_confirm()
+      profile, interval_us, latency, timeout_ms = report.split(",")
+      display.lock.acquire()
+      display_direct.fill(0)
+      display_direct.text("BLE Profile", 20, 1)
+      if len(interval_us) == 0: # not connected or not negotiated yet
+        display_direct.text("Not Negotiated", 8, 14)
+      else:
+        interval_msg = f"Int:{int(interval_us) / 1000}ms"
+        display_direct.text(interval_msg, 64 - len(interval_msg) * OLED.CHAR_WIDTH // 2, 11)
+        param_msg = f"Lat:{latency} TO:{timeout_ms}ms"
+        display_direct.text(param_msg, 64 - len(param_msg) * OLED.CHAR_WIDTH // 2, 20)
+      if profile in profiles: # current profile indicator
+        display_direct.fill_rect(0, choice_y_offsets[profiles.index(profile)], 2, 8, 1)
+      display.lock.release()
+
+      choice_idx = cls.display_menu_and_get_choice(display, Menu.ble_profile_menu, undisplay=False)
+      if choice_idx == 2: # back
+        break
+      cls.uart1_com.send(Com.BLUETOOTH, Com.PROFILE, profiles[choice_idx])
+      status, msg = cls.uart1_com.wait_for_reject_or_confirm()
+      if not status:
+        cls.display_error_log(cls.second_display_priority(), msg)
+
+    Menu.ble_profile_menu.change_highlight(0) # reset highlight
+    display.lock.acquire()
+    display_direct.fill(0)
+    display.lock.release()
+    gc.collect()
+
   @classmethod
   def display_board_info(cls, display: OLED) -> None:
     display.lock.acquire()
@@ -960,6 +1015,13 @@ class Board:
     else:
       report += f"Ble Status:\n  Unconnected\n"
 
+    cls.uart1_com.send(Com.BLUETOOTH, Com.PARAMS)
+    _, ret = Board.uart1_com.wait_for_reject_or_confirm()
+    profile, interval_us, _, _ = ret.split(",")
+    report += f"Ble Profile:\n  {profile}\n"
+    if len(interval_us) != 0:
+      report += f"Ble Interval:\n  {int(interval_us) / 1000}ms\n"
+
     current_config_name = Config.get_default_config().split(".")[0]
     report += f"Current Config\n  {current_config_name}\n"
 
@@ -1020,10 +1082,13 @@ class Board:
         elif choice_idx == 1: # Change Bluetooth name
           Board.change_bluetooth_advertise_name(Board.main_display)
           current_menu = Menu.general_menu
-        elif choice_idx == 2: # View IMU polling rate
+        elif choice_idx == 2: # Change Bluetooth connection profile
+          Board.change_bluetooth_profile(Board.main_display)
+          current_menu = Menu.general_menu
+        elif choice_idx == 3: # View IMU polling rate
           Board.estimate_polling_rate_and_display(Board.main_display)
           current_menu = Menu.general_menu
-        elif choice_idx == 3: # Back
+        elif choice_idx == 4: # Back
           current_menu.change_highlight(0) # reset highlight
           current_menu = Menu.settings_menu
 
@@ -1050,6 +1115,9 @@ class Board:
           Board.buzzer.custom_sound(Buzzer.mystery)
           current_menu.change_highlight(0) # reset highlight
           current_menu = Menu.main_menu
-        elif choice_idx == 2: # Back
+        elif choice_idx == 2: # Event Log
+          Board.display_event_log(Board.main_display)
+          current_menu = Menu.others_menu
+        elif choice_idx == 3: # Back
           current_menu.change_highlight(0) # reset highlight
           current_menu = Menu.settings_menu
@@ -1,15 +1,23 @@
 import os, json
 import driver.utils as utils
 
+from functionality.config_codec import ConfigCodec
+
 class Config:
-  VERSION = "v0.1"
+  VERSION = "v0.1" # legacy JSON configs, migrated to the binary format of `ConfigCodec` when read
 
   # config files storage specifications
   config_path = "data"
   default_config_storage = "config.settings"
   extension = "config"
   no_default_config = "None"
-  empty_file_string = None
+  empty_file_data = None
+  temp_extension = "tmp" # files being written, renamed to their final name once complete
+
+  # in-memory store, loaded once in `auxiliary_init` and kept in sync with the files
+  config_names = None # names of all config files, with extension
+  default_config = None # name of the default config, with extension
+  config_cache = {} # decoded records of configs read or written, keyed by name
 
   # JSON attributes
   JATTR_VERSION = "Version"
@@ -22,7 +30,7 @@ class Config:
   JATTR_IMU_LITTLE = "Little"
   JATTR_IMU_HAND = "Hand"
   JATTR_IMU_ARM = "Arm"
-  # config file style
+  # legacy config file style
   #
   # {
   #   <VERSION_NAME> : <VERSION>
@@ -46,48 +54,88 @@ class Config:
   @classmethod
   def auxiliary_init(cls):
     """ Initializations that fulfill full requirements for system to operate """
-    cls.empty_file_string = json.dumps(cls.get_empty_config_dict())
+    cls.empty_file_data = ConfigCodec.encode([])
     try:
       with open(f"{cls.config_path}/{cls.default_config_storage}"):
         pass
     except Exception:
       utils.ASSERT_TRUE(False, "Config default config not found")
+    cls.load_index()
 
     utils.ASSERT_TRUE(len(Config.IMU_AVAIL_POSITIONS) <= 10, 
         "Config IMU available positions length should not exceed 12")
     for name in Config.IMU_AVAIL_POSITIONS:
       utils.ASSERT_TRUE(type(name) == str and len(name) <= 7, 
           "Config IMU name length should not exceed 7")
+      utils.ASSERT_TRUE(name in ConfigCodec.POSITIONS, f"Config IMU position <{name}> has no binary id")
+
+  @classmethod
+  def load_index(cls) -> None:
+    """ Scan the config directory once, finishing or discarding writes interrupted by a power cut,
+        and read the default config name """
+    cls.config_names = []
+    cls.config_cache = {}
+    filenames = os.listdir(cls.config_path)
+    temp_suffix = f".{cls.temp_extension}"
+    for filename in filenames:
+      if not filename.endswith(temp_suffix):
+        continue
+      target = filename[:-len(temp_suffix)]
+      if target in filenames:
+        # interrupted before the rename, the target still holds the previous contents
+        os.remove(f"{cls.config_path}/{filename}")
+      else:
+        # interrupted between removing the target and the rename, the temp file is complete
+        os.rename(f"{cls.config_path}/{filename}", f"{cls.config_path}/{target}")
+        filenames.append(target)
+    for filename in filenames:
+      if filename.endswith(f".{Config.extension}"):
+        cls.config_names.append(filename)
+    try:
+      with open(f"{cls.config_path}/{cls.default_config_storage}", "r") as f:
+        cls.default_config = f.read().strip()
+    except Exception:
+      utils.EXPECT_TRUE(False, f"Config <{cls.default_config_storage}> not found")
+      cls.set_default_config(cls.no_default_config)
+    if cls.default_config not in cls.config_names and cls.default_config != cls.no_default_config:
+      # default config not found, reset file
+      utils.EXPECT_TRUE(False, f"Config default config <{cls.default_config}> not found")
+      cls.set_default_config(cls.no_default_config)
+
+  @classmethod
+  def write_file(cls, filename: str, contents) -> None:
+    """ Replace a file in the config directory atomically, the contents are written to a temp file
+        that is renamed over the file once complete, so a power cut leaves either version intact
+        `filename`: name of the file in the config directory
+        `contents`: str or bytes to be written """
+    path = f"{cls.config_path}/{filename}"
+    temp_path = f"{path}.{cls.temp_extension}"
+    with open(temp_path, "wb" if type(contents) != str else "w") as f:
+      f.write(contents)
+    try:
+      os.rename(temp_path, path)
+    except OSError:
+      # filesystems that refuse to rename over an existing file
+      os.remove(path)
+      os.rename(temp_path, path)
 
   @classmethod
   def set_default_config(cls, filename: str) -> bool:
     """ Change the default config to another file, file name must include extension
         `filename`: name of the new default config file, can be `config.no_default_config`
             indicating that there is no default config file """
-    if filename not in cls.get_all_config_names() and filename != cls.no_default_config:
+    if filename not in cls.config_names and filename != cls.no_default_config:
       utils.EXPECT_TRUE(False, f"Config nonexist file {filename}")
       return False
-    with open(f"{cls.config_path}/{cls.default_config_storage}", "w") as f:
-      f.write(filename)
+    cls.write_file(cls.default_config_storage, filename)
+    cls.default_config = filename
     return True
 
   @classmethod
   def get_default_config(cls) -> str:
     """ Get the default config file name , include extension
         `returns`: default config file name, `config.no_default_config` if no or invalid default config """
-    try:
-      # get default config name
-      with open(f"{cls.config_path}/{cls.default_config_storage}", "r") as f:
-        default_config = f.read().strip()
-    except Exception:
-      utils.EXPECT_TRUE(False, f"Config <{cls.default_config_storage}> not found")
-      cls.set_default_config(cls.no_default_config)
-    if default_config not in cls.get_all_config_names():
-      # default config not found, reset file
-      utils.EXPECT_TRUE(False, f"Config default config <{default_config}> not found")
-      default_config = cls.no_default_config
-      cls.set_default_config(cls.no_default_config)
-    return default_config
+    return cls.default_config
 
   @classmethod
   def get_empty_config_dict(cls) -> dict:
@@ -99,42 +147,44 @@ class Config:
   def get_all_config_names(cls) -> list:
     """ Get all the config names, with extension at the end of each name
         `returns`: list of all config names found in the system """
-    ret = []
-    for filename in os.listdir(cls.config_path):
-      if filename.endswith(f".{Config.extension}"):
-        ret.append(filename)
-    return ret
+    return list(cls.config_names)
   
   @classmethod
   def remove_config(cls, filename: str) -> bool:
     """ Remove designated the configs from the system, reset default config if necessary
         `filename`: name of file that desired to be removed 
         `returns`: whether the file exists prior to deletion """
-    configs = cls.get_all_config_names()
-    if cls.get_default_config() == filename:
+    if cls.default_config == filename:
       cls.set_default_config(Config.no_default_config)
-    if filename in configs:
+    if filename in cls.config_names:
       os.remove(f"{cls.config_path}/{filename}")
+      cls.config_names.remove(filename)
+      if filename in cls.config_cache:
+        del cls.config_cache[filename]
       return True
     return False
   
   @classmethod
   def remove_all_configs(cls) -> None:
     """ Remove all the configs from the system """
-    configs = cls.get_all_config_names()
-    for config in configs:
+    if cls.default_config != cls.no_default_config:
+      cls.set_default_config(cls.no_default_config)
+    for config in cls.config_names:
       os.remove(f"{cls.config_path}/{config}")
+    cls.config_names = []
+    cls.config_cache = {}
 
   def __init__(self) -> None:
     """ Initialize an empty config with no associate file """
     self.__associative_file_name = None
     self.__imu_dict = {}
+    self.__imu_options = {} # (rate, bus) by position, positions without entry use defaults
 
   def associate_with_file(self, filename: str) -> bool:
     """ Associate the config with an existing file using its file name with file extension included
         `filename`: name of the config file in the system, include extension 
         `returns`: whether the association is successful """
-    if filename not in Config.get_all_config_names():
+    if filename not in Config.config_names:
       utils.EXPECT_TRUE(False, f"Config <{filename}> does not exist")
       return False
     self.__associative_file_name = filename
@@ -148,9 +198,31 @@ class Config:
       # no associative file
       utils.EXPECT_TRUE(False, "Config read no file associated with this config")
       return False
+    if self.__associative_file_name in Config.config_cache:
+      self.__set_records(Config.config_cache[self.__associative_file_name])
+      return True
+    try:
+      with open(f"{Config.config_path}/{self.__associative_file_name}", "rb") as f:
+        data = f.read()
+    except Exception:
+      utils.EXPECT_TRUE(False, f"Config <{self.__associative_file_name}> cannot be read")
+      return False
+    if ConfigCodec.is_encoded(data):
+      records = ConfigCodec.decode(data)
+      if records == None:
+        utils.EXPECT_TRUE(False, f"Config <{self.__associative_file_name}> invalid binary config")
+        return False
+      self.__set_records(records)
+      Config.config_cache[self.__associative_file_name] = records
+      return True
+    return self.__migrate_legacy_config(data)
+
+  def __migrate_legacy_config(self, data: bytes) -> bool:
+    """ Read a legacy JSON config and rewrite it in the binary format. Should NOT be called
+        `data`: contents of the config file
+        `returns`: `False` if read failed, `True` otherwise """
     try:
-      with open(f"{Config.config_path}/{self.__associative_file_name}") as f:
-        contents = json.loads(f.read())
+      contents = json.loads(data.decode())
     except Exception:
       # cannot be parsed as json
       utils.EXPECT_TRUE(False, "Config invalid file style, cannot be parsed as json file")
@@ -165,16 +237,41 @@ class Config:
           f"Config invalid version <{contents[Config.JATTR_VERSION]}>, expect <{Config.VERSION}>")
       return False
     self.__imu_dict = contents[Config.JATTR_IMU_BY_POSITION]
+    self.__imu_options = {}
+    self.write_config_to_file()
     return True
 
+  def __set_records(self, records: list) -> None:
+    """ Replace contents with decoded records. Should NOT be called """
+    self.__imu_dict = {}
+    self.__imu_options = {}
+    for position, address, rate, bus in records:
+      self.__imu_dict[position] = address
+      if rate != ConfigCodec.RATE_UNCHANGED or bus != ConfigCodec.DEFAULT_BUS:
+        self.__imu_options[position] = (rate, bus)
+
+  def get_records(self) -> list:
+    """ Get the IMUs of the config, in the order of `Config.IMU_AVAIL_POSITIONS`
+        `returns`: list of (position, i2c_address, rate, bus) """
+    records = []
+    for position in Config.IMU_AVAIL_POSITIONS:
+      if position in self.__imu_dict:
+        rate, bus = self.__imu_options.get(position, (ConfigCodec.RATE_UNCHANGED, ConfigCodec.DEFAULT_BUS))
+        records.append((position, self.__imu_dict[position], rate, bus))
+    return records
+
+  def get_encoded(self) -> bytes:
+    """ Get the config in binary format, identical to the file contents and sendable as is
+        `returns`: encoded config """
+    return ConfigCodec.encode(self.get_records())
+
   def write_config_to_file(self) -> None:
     """ Write current config to the associated file, contents are from current `Config` object """
     utils.ASSERT_TRUE(self.__associative_file_name != None, 
         "Config write no file associated with this config")
-    empty_config = Config.get_empty_config_dict()
-    empty_config[Config.JATTR_IMU_BY_POSITION] = self.__imu_dict
-    with open(f"{Config.config_path}/{self.__associative_file_name}", "w") as f:
-      f.write(json.dumps(empty_config))
+    records = self.get_records()
+    Config.write_file(self.__associative_file_name, ConfigCodec.encode(records))
+    Config.config_cache[self.__associative_file_name] = records
 
   def create_and_associate_config_file(self, filename: str) -> bool:
     """ Create a new config file and associate current `Config` object with it, file name must
@@ -182,10 +279,11 @@ class Config:
         `returns`: `False` if file already exists, abort. `True` if file created successfully """
     utils.ASSERT_TRUE(filename.endswith(f".{Config.extension}"), 
         f"Config <{filename}> invalid extension")
-    if filename in Config.get_all_config_names():
+    if filename in Config.config_names:
       return False
-    with open(f"{Config.config_path}/{filename}", "w") as f:
-      f.write(Config.empty_file_string)
+    Config.write_file(filename, Config.empty_file_data)
+    Config.config_names.append(filename)
+    Config.config_cache[filename] = []
     self.__associative_file_name = filename
     return True
 
@@ -201,6 +299,15 @@ class Config:
     self.__imu_dict[imu_pos] = i2c_addr
     return None
 
+  def set_imu_options(self, imu_pos: str, rate: int, bus: int=ConfigCodec.DEFAULT_BUS) -> None:
+    """ Change the options of an IMU already in the config
+        `imu_pos`: IMU position on human body
+        `rate`: WT901 return rate code, `ConfigCodec.RATE_UNCHANGED` to keep the IMU setting
+        `bus`: index of the I2C bus the IMU is on """
+    utils.ASSERT_TRUE(imu_pos in self.__imu_dict, f"Config imu position <{imu_pos}> not in config")
+    utils.ASSERT_TRUE(0 <= rate < 256 and 0 <= bus < 256, f"Config invalid imu options <{rate}, {bus}>")
+    self.__imu_options[imu_pos] = (rate, bus)
+
   def get_config_string(self, readable: bool= True) -> str:
     """ Get config as displayable text, for both human read and transmission 
         `readable`: whether is human-readable text 
@@ -0,0 +1,97 @@
+import binascii
+
+import driver.utils as utils
+from driver.io import Buzzer, VibrationMotor
+
+
+class Feedback:
+  """ Applies haptic and audio feedback requested by the host. A binary feedback message carries
+      several actions at once:
+        sync(1) count(1) count x [opcode(1) argument(int8)]
+      and is relayed by the main controller hex encoded. Legacy text requests "<request>,<argument>"
+      are translated into the same actions. Constants must match gesture/feedback.py """
+  SYNC = 0xFB
+  # opcodes
+  MOTOR = 1           # argument: index of the vibration pattern
+  BUZZER = 2          # argument: index of the sound pattern
+  VOLUME_RELATIVE = 3 # argument: volume change in percent
+  VOLUME_ABSOLUTE = 4 # argument: volume in percent
+  TEXT_OPCODES = {"m": MOTOR, "b": BUZZER, "vr": VOLUME_RELATIVE, "va": VOLUME_ABSOLUTE}
+
+  motor_patterns = (VibrationMotor.slight_seq, VibrationMotor.medium_seq, VibrationMotor.heavy_seq,
+      VibrationMotor.double_seq, VibrationMotor.triple_seq)
+  buzzer_patterns = (Buzzer.double_seq, Buzzer.triple_seq, Buzzer.long_seq, Buzzer.double_long_seq)
+
+  def __init__(self, vmotor: VibrationMotor, buzzer: Buzzer) -> None:
+    self.__vmotor = vmotor
+    self.__buzzer = buzzer
+    # dispatch table indexed by opcode
+    self.__handlers = (None, self.__motor, self.__buzzer_sound, self.__volume_relative,
+        self.__volume_absolute)
+
+  def handle_frame(self, hex_frame: bytes) -> int:
+    """ Apply every action of a hex encoded binary feedback message
+        `hex_frame`: message as relayed by the main controller
+        `returns`: number of actions applied """
+    try:
+      frame = binascii.unhexlify(hex_frame)
+    except Exception:
+      utils.EXPECT_TRUE(False, f"Feedback invalid encoding <{hex_frame}>")
+      return 0
+    if len(frame) < 2 or frame[0] != Feedback.SYNC or len(frame) != 2 + 2 * frame[1]:
+      utils.EXPECT_TRUE(False, f"Feedback invalid frame <{hex_frame}>")
+      return 0
+    applied = 0
+    for i in range(2, len(frame), 2):
+      argument = frame[i + 1] - 256 if frame[i + 1] > 127 else frame[i + 1]
+      if self.apply(frame[i], argument):
+        applied += 1
+    return applied
+
+  def handle_text(self, msg: str) -> bool:
+    """ Apply a legacy text request
+        `msg`: request of form "<request>,<argument>"
+        `returns`: whether the request is applied """
+    try:
+      request, argument = msg.split(",")
+      opcode = Feedback.TEXT_OPCODES[request.lower()]
+      argument = int(argument)
+    except Exception:
+      utils.EXPECT_TRUE(False, f"Bluetooth invalid request <{msg}>")
+      return False
+    return self.apply(opcode, argument)
+
+  def apply(self, opcode: int, argument: int) -> bool:
+    """ Apply one action
+        `opcode`: one of the opcodes of Feedback
+        `argument`: argument of the action
+        `returns`: whether the action is applied """
+    if opcode <= 0 or opcode >= len(self.__handlers):
+      utils.EXPECT_TRUE(False, f"Feedback invalid opcode <{opcode}>")
+      return False
+    return self.__handlers[opcode](argument)
+
+  def __motor(self, index: int) -> bool:
+    """ Play a vibration pattern. Should NOT be called """
+    if index < 0 or index >= len(Feedback.motor_patterns):
+      utils.EXPECT_TRUE(False, f"Bluetooth invalid vmotor request index <{index}>")
+      return False
+    return self.__vmotor.custom_vibration(Feedback.motor_patterns[index])
+
+  def __buzzer_sound(self, index: int) -> bool:
+    """ Play a sound pattern. Should NOT be called """
+    if index < 0 or index >= len(Feedback.buzzer_patterns):
+      utils.EXPECT_TRUE(False, f"Bluetooth invalid buzzer request index <{index}>")
+      return False
+    return self.__buzzer.custom_sound(Feedback.buzzer_patterns[index])
+
+  def __volume_relative(self, change: int) -> bool:
+    """ Change the buzzer volume by given percent. Should NOT be called """
+    volume = self.__buzzer.get_volume() + change
+    self.__buzzer.set_volume(0 if volume < 0 else 100 if volume > 100 else volume)
+    return True
+
+  def __volume_absolute(self, volume: int) -> bool:
+    """ Set the buzzer volume in percent. Should NOT be called """
+    self.__buzzer.set_volume(volume)
+    return True
@@ -1,6 +1,6 @@
 from driver.ssd1306 import SSD1306
 import driver.utils as utils
-from driver.display import OLED
+from driver.display import OLED, Sprite
 import gc
 
 class Menu:
@@ -15,6 +15,7 @@ class Menu:
   configs_menu = None
   others_menu = None
   volume_menu = None
+  ble_profile_menu = None
 
   # special menu
   keyboard = None
@@ -27,6 +28,12 @@ class Menu:
   RQ_menu = None  # Restart Quit
   B_menu = None   # Back 
 
+  # rendered choices of all menus, least recently used first
+  sprite_cache = []
+  sprite_cache_bytes = 0
+  SPRITE_CACHE_LIMIT = 8192 # maximum bytes taken by rendered choices
+  SPRITE_MEM_RESERVE = 16384 # free heap below which rendered choices are evicted
+
   @classmethod
   def auxiliary_init(cls):
     """ Initializations that fulfill full requirements for system to operate """
@@ -42,10 +49,11 @@ class Menu:
     cls.settings_menu.add_choice(48, 49, ["Back"])
 
     cls.general_menu = Menu()
-    cls.general_menu.add_choice(40, 6, ["Volume"])
-    cls.general_menu.add_choice(8, 18, ["Bluetooth Name"])
-    cls.general_menu.add_choice(16, 30, ["Estimate IMU", "Polling Rate"])
-    cls.general_menu.add_choice(48, 50, ["Back"])
+    cls.general_menu.add_choice(40, 3, ["Volume"])
+    cls.general_menu.add_choice(8, 14, ["Bluetooth Name"])
+    cls.general_menu.add_choice(20, 25, ["BLE Profile"])
+    cls.general_menu.add_choice(16, 36, ["Estimate IMU", "Polling Rate"])
+    cls.general_menu.add_choice(48, 55, ["Back"])
 
     cls.configs_menu = Menu()
     cls.configs_menu.add_choice(12, 14, ["Create Config"])
@@ -53,15 +61,21 @@ class Menu:
     cls.configs_menu.add_choice(48, 42, ["Back"])
     
     cls.others_menu = Menu()
-    cls.others_menu.add_choice(44, 14, ["Snake"])
-    cls.others_menu.add_choice(36, 28, ["Mystery"])
-    cls.others_menu.add_choice(48, 42, ["Back"])
+    cls.others_menu.add_choice(44, 7, ["Snake"])
+    cls.others_menu.add_choice(36, 21, ["Mystery"])
+    cls.others_menu.add_choice(28, 35, ["Event Log"])
+    cls.others_menu.add_choice(48, 49, ["Back"])
 
     cls.volume_menu = Menu()
     cls.volume_menu.add_choice(38, 35, ["-"])
     cls.volume_menu.add_choice(82, 35, ["+"])
     cls.volume_menu.add_choice(48, 48, ["Back"])
 
+    cls.ble_profile_menu = Menu()
+    cls.ble_profile_menu.add_choice(20, 31, ["Low Latency"])
+    cls.ble_profile_menu.add_choice(16, 42, ["Power Saving"])
+    cls.ble_profile_menu.add_choice(48, 54, ["Back"])
+
     cls.YN_menu = Menu()
     cls.YN_menu.add_choice(20, 1, ["Yes"])
     cls.YN_menu.add_choice(88, 1, ["No"])
@@ -80,6 +94,66 @@ class Menu:
     cls.B_menu = Menu()
     cls.B_menu.add_choice(1, 1, ["Back"])
 
+    for menu in (cls.main_menu, cls.settings_menu, cls.general_menu, cls.configs_menu, 
+        cls.others_menu, cls.volume_menu, cls.ble_profile_menu, cls.YN_menu, cls.YCN_menu, 
+        cls.RQ_menu, cls.B_menu):
+      menu.prerender()
+
+  @classmethod
+  def render_choice(cls, choice, highlight: bool) -> Sprite:
+    """ Render a choice into a sprite covering its highlight area
+        `choice`: the choice to be rendered
+        `highlight`: if the choice is rendered highlighted
+        `returns`: the rendered sprite """
+    sprite = Sprite(choice.highlight_width, choice.highlight_height)
+    sprite.fill(int(highlight))
+    x_border, y_border = choice.x - choice.highlight_x, choice.y - choice.highlight_y
+    for i in range(len(choice.texts)):
+      sprite.text(choice.texts[i], x_border + choice.horizontal_offset[i], 
+          y_border + i * OLED.CHAR_HEIGHT, int(not highlight))
+    return sprite
+
+  @classmethod
+  def get_sprite(cls, choice, highlight: bool) -> Sprite:
+    """ Get the rendered sprite of a choice, rendering it if not cached
+        `choice`: the choice to be rendered
+        `highlight`: if the choice is rendered highlighted
+        `returns`: the rendered sprite """
+    sprite = choice.sprites[int(highlight)]
+    if sprite == None:
+      sprite = cls.render_choice(choice, highlight)
+      choice.sprites[int(highlight)] = sprite
+      cls.sprite_cache_bytes += len(sprite.buffer)
+      if choice in cls.sprite_cache:
+        cls.sprite_cache.remove(choice)
+      cls.sprite_cache.append(choice)
+      cls.evict_sprites()
+    elif cls.sprite_cache[-1] is not choice:
+      cls.sprite_cache.remove(choice)
+      cls.sprite_cache.append(choice)
+    return sprite
+
+  @classmethod
+  def evict_sprites(cls) -> None:
+    """ Drop least recently used sprites while over the cache limit or short of heap. The most
+        recently used choice is always kept """
+    while len(cls.sprite_cache) > 1:
+      if cls.sprite_cache_bytes <= cls.SPRITE_CACHE_LIMIT and gc.mem_free() >= cls.SPRITE_MEM_RESERVE:
+        return
+      cls.discard_sprites(cls.sprite_cache[0])
+      gc.collect()
+
+  @classmethod
+  def discard_sprites(cls, choice) -> None:
+    """ Drop the rendered sprites of a choice, e.g. when it is no longer part of a menu
+        `choice`: the choice whose sprites are dropped """
+    for sprite in choice.sprites:
+      if sprite != None:
+        cls.sprite_cache_bytes -= len(sprite.buffer)
+    choice.sprites = [None, None]
+    if choice in cls.sprite_cache:
+      cls.sprite_cache.remove(choice)
+
   class _MenuItem:
     """ An item of the menu """
     # alignment methods for multi-line choice
@@ -110,6 +184,7 @@ class Menu:
       self.highlight_y = self.y - y_border_width
       self.highlight_width = self.text_width + 2 * x_border_width
       self.highlight_height = self.text_height + 2 * y_border_width
+      self.sprites = [None, None] # rendered normal and highlighted choice, built on demand
       
       for i in range(len(texts)):
         text = self.texts[i]
@@ -127,14 +202,23 @@ class Menu:
     self.__visible_indexes = set()
     self.__x_offset = 0
     self.__y_offset = 0
+    self.__shown_highlight = -1 # highlighted choice on screen, -1 if screen is out of date
     
   def change_x_offset(self, new_x: int) -> None:
     """ Change the horizontal offset of the whole menu """
     self.__x_offset = new_x
+    self.__shown_highlight = -1
 
   def change_y_offset(self, new_y: int) -> None:
     """ Change the vertical offset of the whole menu """
     self.__y_offset = new_y
+    self.__shown_highlight = -1
+
+  def prerender(self) -> None:
+    """ Render all choices ahead of display, in both normal and highlighted form """
+    for choice in self.__choices:
+      Menu.get_sprite(choice, False)
+      Menu.get_sprite(choice, True)
 
   def add_choice(self, x: int, y: int, texts: list, align: int=_MenuItem.ALIGN_MIDDLE, 
       x_border_width: int=1, y_border_width: int=1) -> int:
@@ -159,7 +243,9 @@ class Menu:
         `align`: alignment methods for multi-line choice
         `border_width`: width of highlight boarder when the choice is highlighted """
     utils.ASSERT_TRUE(idx >= 0 and idx < len(self.__choices), "Menu invalid replace index")
+    Menu.discard_sprites(self.__choices[idx])
     self.__choices[idx] = Menu._MenuItem(x, y, texts, align, x_border_width, y_border_width)
+    self.__shown_highlight = -1
     gc.collect()
 
   def insert_choice(self, idx: int, x: int, y: int, texts: list, align: int=_MenuItem.ALIGN_MIDDLE, 
@@ -179,6 +265,7 @@ class Menu:
     self.__visible_indexes.add(real_idx)
     if real_idx < self.__highlight_index:
       self.__highlight_index += 1
+    self.__shown_highlight = -1
     return real_idx
 
   def remove_choice(self, idx: int) -> _MenuItem:
@@ -191,6 +278,8 @@ class Menu:
     self.__visible_indexes.discard(idx)
     if idx < self.__highlight_index:
       self.__highlight_index -= 1
+    self.__shown_highlight = -1
+    Menu.discard_sprites(self.__choices[idx])
     gc.collect()
     return self.__choices.pop(idx)
 
@@ -199,6 +288,7 @@ class Menu:
         `idx`: the destinated index of the menu item wished its visibility to be changed 
         `visible`: if the menu item is visible """
     if idx >= 0 and idx < len(self.__choices):
+      self.__shown_highlight = -1
       if visible:
         self.__visible_indexes.add(idx)
       else:
@@ -231,6 +321,24 @@ class Menu:
           display_direct.fill_rect(choice.highlight_x, choice.highlight_y, 
               choice.highlight_width, choice.highlight_height, 0)
     self.__display_single_choice(display_direct, self.__choices[self.__highlight_index], highlight=True)
+    self.__shown_highlight = self.__highlight_index
+    display_direct.show()
+    display.lock.release()
+
+  def update_highlight(self, display: OLED) -> None:
+    """ Redraw only the choices whose highlight changed since the menu was last drawn, falls back
+        to display all choices if the menu changed otherwise
+        `display`: the display the menu is shown on """
+    if self.__shown_highlight == -1 or self.__highlight_index not in self.__visible_indexes:
+      self.display_choices(display)
+      return
+    if self.__shown_highlight == self.__highlight_index:
+      return
+    display.lock.acquire()
+    display_direct = display.get_direct_control()
+    self.__display_single_choice(display_direct, self.__choices[self.__shown_highlight])
+    self.__display_single_choice(display_direct, self.__choices[self.__highlight_index], highlight=True)
+    self.__shown_highlight = self.__highlight_index
     display_direct.show()
     display.lock.release()
 
@@ -251,6 +359,7 @@ class Menu:
           self.__display_single_choice_background(display_direct, choice, 0)
     display_direct.show()
     display.lock.release()
+    self.__shown_highlight = -1
     if reset_offsets:
       self.__x_offset = 0
       self.__y_offset = 0
@@ -293,20 +402,18 @@ class Menu:
     display_direct.fill_rect(x, y, choice.highlight_width, choice.highlight_height, color)
 
   def __display_single_choice(self, display_direct: SSD1306, choice: _MenuItem, highlight: bool=False) -> None:
-    """ Display the specified choice 
+    """ Display the specified choice using its rendered sprite
         `display_direct`: the display framebuffer to draw on 
         `choice`: the choice to be rendered
         `highlight`: if the choice is highlighted """
-    self.__display_single_choice_background(display_direct, choice, int(highlight))
-    for i in range(len(choice.texts)):
-      x = self.__x_offset + choice.x + choice.horizontal_offset[i]
-      y = self.__y_offset + choice.y + i * OLED.CHAR_HEIGHT
-      display_direct.text(choice.texts[i], x, y, int(not highlight))
+    display_direct.blit(Menu.get_sprite(choice, highlight), 
+        self.__x_offset + choice.highlight_x, self.__y_offset + choice.highlight_y)
 
   def print_status(self) -> None:
     """ Report status of current menu, for debug use """
     print(f"No. of Choices: {len(self.__choices)}")
     print(f"Visible Choices: {self.__visible_indexes}")
     print(f"Highlight: {self.__highlight_index}")
+    print(f"Sprite cache: {len(Menu.sprite_cache)} choices, {Menu.sprite_cache_bytes} bytes")
     for i, choice in enumerate(self.__choices):
       print(f" Choice: {i}, X: {choice.x}, Y: {choice.y}, Texts: {choice.texts}")
@@ -1,10 +1,115 @@
-import math
+import array
 
-from driver.display import OLED
+from driver.display import OLED, TextCache
 
 from functionality.menu import Menu
 
+class _StringLines:
+  """ Lines of a string in RAM, positions are character offsets """
+  def __init__(self, text: str, delimiter: str) -> None:
+    self.__text = text
+    self.__delimiter = delimiter
+    self.__pos = 0
+
+  def seek(self, pos: int) -> None:
+    self.__pos = pos
+
+  def tell(self) -> int:
+    return self.__pos
+
+  def readline(self) -> str:
+    """ `returns`: next line without delimiter, None at the end """
+    if self.__pos > len(self.__text) or len(self.__text) == 0:
+      return None
+    end = self.__text.find(self.__delimiter, self.__pos)
+    if end == -1:
+      end = len(self.__text)
+    line = self.__text[self.__pos:end]
+    self.__pos = end + len(self.__delimiter)
+    return line
+
+  def close(self) -> None:
+    self.__text = None
+
+class _FileLines:
+  """ Lines of a file read on demand, positions are byte offsets """
+  def __init__(self, path: str) -> None:
+    self.__file = open(path, "rb")
+
+  def seek(self, pos: int) -> None:
+    self.__file.seek(pos)
+
+  def tell(self) -> int:
+    return self.__file.tell()
+
+  def readline(self) -> str:
+    """ `returns`: next line without line ending, None at the end """
+    line = self.__file.readline()
+    if len(line) == 0:
+      return None
+    try:
+      return line.rstrip(b"\r\n").decode()
+    except Exception:
+      return "?" * len(line.rstrip(b"\r\n"))
+
+  def close(self) -> None:
+    self.__file.close()
+
+class _GeneratorLines:
+  """ Lines produced by an iterator, positions are line numbers. The last line read is kept, so
+      that seeking back to it, as the viewer does to the look-ahead line starting the next page, is
+      free. Seeking further backwards restarts the iterator from the factory """
+  def __init__(self, factory) -> None:
+    self.__factory = factory
+    self.__iterator = factory()
+    self.__pos = 0
+    self.__last = None # last line read, at position pos - 1
+    self.__replay = False # whether readline returns the last line again
+
+  def seek(self, pos: int) -> None:
+    if self.__replay and pos == self.__pos:
+      return
+    if self.__last != None and pos == self.__pos - 1:
+      self.__pos = pos
+      self.__replay = True
+      return
+    if self.__replay:
+      # leave the position of the line to be replayed
+      self.__replay = False
+      self.__pos += 1
+    if pos < self.__pos:
+      self.__iterator = self.__factory()
+      self.__pos = 0
+      self.__last = None
+    while self.__pos < pos and self.readline() != None:
+      pass
+
+  def tell(self) -> int:
+    return self.__pos
+
+  def readline(self) -> str:
+    """ `returns`: next line, None at the end """
+    if self.__replay:
+      self.__replay = False
+      self.__pos += 1
+      return self.__last
+    try:
+      line = next(self.__iterator)
+    except StopIteration:
+      return None
+    self.__pos += 1
+    self.__last = line
+    return line
+
+  def close(self) -> None:
+    self.__iterator = None
+    self.__last = None
+
 class TextViewer:
+  """ Pages through text from a string, a file or a generator. Only the current page is held in
+      RAM, the start of every page is indexed as it is first reached, so the page count is only
+      known once the end of the text has been read """
+  UNKNOWN = -1
 
   def __init__(self) -> None:
     self.__PNE_menu = Menu() # <(prev) >(next) Exit
@@ -13,9 +118,14 @@ class TextViewer:
     self.__PNE_menu.add_choice(95, 55, ["Exit"])
     self.__page_num_center = 42 # ((1 + 8 + 1) + (75 - 1)) / 2
     self.__reset_PNE_menu()
-    self.__pages = []
     self.__chars_in_line = OLED.WIDTH // OLED.CHAR_WIDTH
     self.__lines_in_page = OLED.HEIGHT // OLED.CHAR_HEIGHT - 2
+    self.__source = None
+    self.__wrap_content = True
+    # page index, a page starts at a row of a line: (line position, row within line)
+    self.__page_pos = array.array("I")
+    self.__page_row = array.array("H")
+    self.__rows = [] # (first row of line, text) of current page
     self.__current_page = 0
     self.__total_pages = 0
 
@@ -31,84 +141,135 @@ class TextViewer:
 
   def __get_page_num_display(self) -> tuple:
     offset_page = self.__current_page + 1
-    page_num_display = f"{offset_page}/{self.__total_pages}"
+    total = "?" if self.__total_pages == TextViewer.UNKNOWN else self.__total_pages
+    page_num_display = f"{offset_page}/{total}"
     x_offset = self.__page_num_center - OLED.CHAR_WIDTH * (0.5 + len(str(offset_page)))
     y_offset = 55
     return int(x_offset), int(y_offset), page_num_display
 
-  def set_text_to_view(self, text: str, wrap_content: bool, delimiter: str):
-    self.__pages.clear()
-    if text != None and text != "":
-      preprocess = text.split(delimiter)
-      if not wrap_content:
-        for page_num in range(int(math.ceil(len(preprocess) / self.__lines_in_page))):
-          page = []
-          for line_num in range(
-              min(self.__lines_in_page, len(preprocess) - page_num * self.__lines_in_page)):
-            index = page_num * self.__lines_in_page + line_num
-            page.append((True, preprocess[index][:self.__chars_in_line]))
-          self.__pages.append(page)
-      else:
-        page = []
-        for line in preprocess:
-          view_line_num = 0
-          first_line_indicator = True
-          while view_line_num < len(line):
-            page.append((first_line_indicator, line[view_line_num:view_line_num + self.__chars_in_line]))
-            first_line_indicator = False
-            view_line_num += self.__chars_in_line
-          view_line_num = 0
-          while view_line_num < len(page) - self.__lines_in_page:
-            self.__pages.append(page[view_line_num:view_line_num + self.__lines_in_page])
-            view_line_num += self.__lines_in_page
-          page = page[view_line_num:]
-        if len(page) != 0:
-          self.__pages.append(page)
+  def set_text_to_view(self, text: str, wrap_content: bool, delimiter: str) -> None:
+    """ View a string in RAM
+        `text`: text to be viewed
+        `wrap_content`: whether to wrap lines longer than screen width, otherwise truncated
+        `delimiter`: used when determine line split point """
+    self.__set_source(_StringLines(text if text != None else "", delimiter), wrap_content)
+
+  def set_file_to_view(self, path: str, wrap_content: bool) -> None:
+    """ View a text file, read on demand, file stays open until other text is viewed
+        `path`: path of the file to be viewed
+        `wrap_content`: whether to wrap lines longer than screen width, otherwise truncated """
+    self.__set_source(_FileLines(path), wrap_content)
+
+  def set_generator_to_view(self, factory, wrap_content: bool) -> None:
+    """ View lines produced by a generator
+        `factory`: callable returning a fresh iterator over the lines each time it is called
+        `wrap_content`: whether to wrap lines longer than screen width, otherwise truncated """
+    self.__set_source(_GeneratorLines(factory), wrap_content)
+
+  def close(self) -> None:
+    """ Release the viewed text """
+    if self.__source != None:
+      self.__source.close()
+      self.__source = None
+    self.__rows.clear()
+
+  def __set_source(self, source, wrap_content: bool) -> None:
+    """ Reset pagination to the start of a new source. Should NOT be called """
+    self.close()
+    self.__source = source
+    self.__wrap_content = wrap_content
+    self.__page_pos = array.array("I", [0])
+    self.__page_row = array.array("H", [0])
     self.__current_page = 0
-    self.__total_pages = len(self.__pages)
+    self.__total_pages = TextViewer.UNKNOWN
     self.__reset_PNE_menu()
+    self.__read_page()
+
+  def __rows_in_line(self, line: str) -> int:
+    """ Number of screen rows a line takes. Should NOT be called """
+    if not self.__wrap_content:
+      return 1
+    return (len(line) + self.__chars_in_line - 1) // self.__chars_in_line
+
+  def __read_page(self) -> None:
+    """ Read rows of current page, indexing the start of the next page when first reached.
+        Should NOT be called """
+    self.__rows.clear()
+    page = self.__current_page
+    line_pos, row = self.__page_pos[page], self.__page_row[page]
+    self.__source.seek(line_pos)
+    line = self.__source.readline()
+    while line != None:
+      while row < self.__rows_in_line(line):
+        if len(self.__rows) == self.__lines_in_page:
+          # first row of next page
+          if page + 1 == len(self.__page_pos):
+            self.__page_pos.append(line_pos)
+            self.__page_row.append(row)
+          return
+        start = row * self.__chars_in_line
+        self.__rows.append((row == 0, line[start:start + self.__chars_in_line]))
+        row += 1
+      line_pos = self.__source.tell()
+      line = self.__source.readline()
+      row = 0
+    # end of text reached, current page is the last one
+    self.__total_pages = page + 1 if len(self.__rows) != 0 or page != 0 else 0
+
+  def __update_PNE_menu(self) -> None:
+    """ Show prev and next only when such pages exist. Should NOT be called """
+    has_prev = self.__current_page > 0
+    has_next = self.__current_page + 1 < len(self.__page_pos)
+    if not has_prev and not has_next:
+      self.__set_PNE_menu_zero_or_one_page()
+    elif not has_prev: # cannot prev
+      self.__PNE_menu.change_choice_visibility(1, True)
+      self.__PNE_menu.change_highlight(1)
+      self.__PNE_menu.change_choice_visibility(0, False)
+    elif not has_next: # cannot next
+      self.__PNE_menu.change_choice_visibility(0, True)
+      self.__PNE_menu.change_highlight(0)
+      self.__PNE_menu.change_choice_visibility(1, False)
+    else:
+      self.__PNE_menu.change_choice_visibility(0, True)
+      self.__PNE_menu.change_choice_visibility(1, True)
 
   def PNE_menu_rotate(self, direction: int) -> None:
     self.__PNE_menu.rotate_highlight(direction)
 
+  def PNE_menu_update(self, display: OLED) -> None:
+    self.__PNE_menu.update_highlight(display)
+
   def PNE_menu_choose(self) -> bool:
     choice_idx = self.__PNE_menu.choose()
-    if choice_idx == 0: # prev
+    if choice_idx == 0 and self.__current_page > 0: # prev
       self.__current_page -= 1
-    elif choice_idx == 1: # next
+    elif choice_idx == 1 and self.__current_page + 1 < len(self.__page_pos): # next
       self.__current_page += 1
     elif choice_idx == 2: # exit
       self.__reset_PNE_menu()
       self.__current_page = 0
+      self.close()
       return True
-    if self.__current_page == 0: # cannot prev
-      self.__PNE_menu.change_choice_visibility(1, True)
-      self.__PNE_menu.change_highlight(1)
-      self.__PNE_menu.change_choice_visibility(0, False)
-    elif self.__current_page == self.__total_pages - 1: # cannot next
-      self.__PNE_menu.change_choice_visibility(0, True)
-      self.__PNE_menu.change_highlight(0)
-      self.__PNE_menu.change_choice_visibility(1, False)
+    self.__read_page()
     return False
       
   def view_on_display(self, display: OLED) -> None:
     display_direct = display.get_direct_control()
     display.lock.acquire()
+    self.__update_PNE_menu()
     if self.__total_pages == 0:
-      display_direct.text("No Content", 24, 28, 1)
-      self.__set_PNE_menu_zero_or_one_page()
+      TextCache.draw(display_direct, "No Content", 24, 28)
     else:
-      if self.__total_pages == 1:
-        self.__set_PNE_menu_zero_or_one_page()
-      current_page_texts = self.__pages[self.__current_page]
-      for line_num in range(len(current_page_texts)):
-        line_indicator, line = current_page_texts[line_num]
+      for line_num in range(len(self.__rows)):
+        line_indicator, line = self.__rows[line_num]
         y_offset = line_num * (OLED.CHAR_HEIGHT + 1)
         if line_indicator:
           display_direct.pixel(0, y_offset, 1)
-        display_direct.text(line, 0, y_offset)
+        # body lines are mostly seen once, caching them would only evict the static runs
+        display_direct.text(line, 0, y_offset, 1)
       x, y, page_num_display = self.__get_page_num_display()
-      display_direct.text(page_num_display, x, y)
+      TextCache.draw(display_direct, page_num_display, x, y)
     display.lock.release()
 
     self.__PNE_menu.display_choices(display)
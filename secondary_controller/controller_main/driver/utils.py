@@ -1,15 +1,20 @@
-import os, machine
+import os, binascii, machine
 from functionality.board import Board
 from driver.threading import Thread
+from driver.event_log import EventLog
 
 # Timer IDs used by different utilities
 UART_TIMER_ID = 0
+BRIDGE_TIMER_ID = 1
+DEADMAN_TIMER_ID = 2
+ROBOT_SEND_TIMER_ID = 3
 
 def execute_main(func) -> None:
   """ Execute the main function, call all the main_init functions before running the main thread
       `start_screen`: whether the start screen animation is played"""
   # main initializations
   Board.main_init()
+  EventLog.log(EventLog.INFO, EventLog.BOOT, f"reset cause {machine.reset_cause()}")
 
   # LED flash
   Board.status_led.show_bootup()
@@ -25,12 +30,14 @@ def EXPECT_TRUE(condition: bool, message: str) -> None:
   """ Expect condition to be true, generate a warning if violated, non-blocking """
   if not condition:
     print(f"Warning: {message}")
+    EventLog.log(EventLog.WARNING, EventLog.EXPECT, message)
     Board.status_led.show_warning()
   
 def ASSERT_TRUE(condition: bool, message: str) -> None:
   """ Assert condition to be true, generate an error if violated, blocking """
   if not condition:
     print(f"ERROR: {message}")
+    EventLog.log(EventLog.ERROR, EventLog.ASSERT, message)
     Board.status_led.show_error()
   
 
@@ -53,3 +60,20 @@ def storage_status() -> None:
   print(f"Fragment size:                {fs_frsize} kB")
   print(f"Total size of Filesystem:     {f_blocks} blocks")
   print(f"Available size of Filesystem: {f_bfree} blocks") 
+
+def print_event_log() -> None:
+  """ Print all records of the event log to REPL, oldest first """
+  for record in EventLog.records():
+    print(EventLog.format_record(record))
+
+def dump_event_log() -> None:
+  """ Print all records of the event log to REPL hex encoded, one record per line, to be read by
+      gesture/event_log_dump.py """
+  print("EVENT LOG BEGIN")
+  for record in EventLog.raw_records():
+    print(binascii.hexlify(record).decode())
+  print("EVENT LOG END")
+
+def clear_event_log() -> None:
+  """ Remove all records of the event log """
+  EventLog.clear()
@@ -2,8 +2,12 @@ import machine, time, bluetooth, json
 
 import driver.utils as utils
 from driver.status_led import StatusLed
+from driver.event_log import EventLog
 
 from functionality.bluetooth import BLEPeripheral as ble
+from functionality.bridge import Bridge
+from functionality.deadman import Deadman
+from functionality.robot_protocol import RobotDecoder
 
 class Board:
   """ Have only classmethods, interfacing high-level functionalities with lower-level facilities """
@@ -12,11 +16,22 @@ class Board:
 
   # uart1 
   uart1 = None
-  rx_buffer = bytearray(200)
 
   # bluetooth socket
   ble = None
 
+  # uart1 <-> bluetooth relay
+  bridge = None
+  robot_rate_hz = 20
+
+  # validates binary command frames from the host
+  decoder = None
+
+  # stops the robot when the host goes silent
+  deadman = None
+  # timeouts in ms keyed by channel, overridden by data/deadman.settings, 0 never expires
+  deadman_defaults = {"all": 500, "hld": 0, "chs": 400, "gim": 400, "sho": 0}
+
   class State:
     IDLE = 0
     OPERATION = 1
@@ -24,14 +39,15 @@ class Board:
   # controller state
   state = None
 
-  # operation state
-  in_operation = False
-
   HOLD = b"hld"
   CHASSIS = b"chs"
   GIMBAL = b"gim"
   SHOOTER = b"sho"
 
+  # commands sent on timeout, zero speed of the channel
+  CHASSIS_STOP = CHASSIS + b"|" + bytes(6)
+  GIMBAL_STOP = GIMBAL + b"|" + bytes(4)
+
   @classmethod
   def main_init(cls) -> None:
     """ Initializations that fulfill basic requirements for system to operate """
@@ -51,41 +67,80 @@ class Board:
     cls.ble = ble(bluetooth.BLE())
     cls.ble.on_write(cls.ble_rx_callback)
 
+    cls.bridge = Bridge(cls.uart1, cls.ble, rate_hz=cls.robot_rate_hz)
+    cls.decoder = RobotDecoder()
+
+    settings = Deadman.load_settings(cls.deadman_defaults)
+    timeouts = [settings[prefix.decode()] for prefix in Bridge.CHANNEL_PREFIXES]
+    cls.deadman = Deadman(timeouts, settings["all"], cls.deadman_expired)
+
   @classmethod
-  def hold_detect(cls, timer: machine.Timer):
-    if cls.in_operation:
-      cls.in_operation = False
-    else:
-      cls.uart1.write(cls.HOLD + b"|\n")
+  def deadman_expired(cls, channel: int) -> None:
+    """ Stop the channel that timed out, or hold the robot when the host went silent
+        `channel`: channel that timed out, `Deadman.ALL` if no command was received at all """
+    if channel == Deadman.ALL:
+      cls.bridge.forward_to_robot(cls.HOLD + b"|\n")
+    elif channel == Bridge.CHASSIS:
+      cls.bridge.forward_to_robot(cls.CHASSIS_STOP)
+    elif channel == Bridge.GIMBAL:
+      cls.bridge.forward_to_robot(cls.GIMBAL_STOP)
+
+  @classmethod
+  def set_deadman_timeout(cls, channel: int, timeout_ms: int) -> None:
+    """ Change and store the timeout of one channel
+        `channel`: channel index of bridge, or `Deadman.ALL` for the hold timeout
+        `timeout_ms`: new timeout in ms, 0 if the channel never expires on its own """
+    cls.deadman.set_timeout(channel, timeout_ms)
+    settings = {"all": cls.deadman.get_timeout(Deadman.ALL)}
+    for i in range(len(Bridge.CHANNEL_PREFIXES)):
+      settings[Bridge.CHANNEL_PREFIXES[i].decode()] = cls.deadman.get_timeout(i)
+    Deadman.save_settings(settings)
+
+  @classmethod
+  def is_legacy_command(cls, msg: bytes) -> bool:
+    """ Whether the message is a legacy text command of a known channel
+        `msg`: message received from bluetooth
+        `returns`: whether the message starts with a channel prefix """
+    for prefix in Bridge.CHANNEL_PREFIXES:
+      if msg.startswith(prefix):
+        return True
+    return False
 
   @classmethod
   def ble_rx_callback(cls, msg: bytes) -> None:
-    cls.in_operation = True
-    Board.status_led.change_state(True)
-    print(msg)
-    cls.uart1.write(msg)
-    Board.status_led.change_state(False)
+    if RobotDecoder.is_frame(msg):
+      cls.decoder.decode(msg, cls.submit_command)
+    elif cls.is_legacy_command(msg):
+      # legacy text command, forwarded unchecked
+      cls.submit_command(msg)
+    else:
+      # corrupted, truncated or concatenated partial frames, neither sent nor feeding the deadman
+      cls.decoder.rejected_messages += 1
 
   @classmethod
-  def event_loop(cls):
-    timer = machine.Timer(2)
-    timer.init(mode=machine.Timer.PERIODIC, period=500, callback=cls.hold_detect)
+  def submit_command(cls, msg) -> None:
+    """ Forward one robot command and feed the deadman with its channel
+        `msg`: robot command """
+    cls.deadman.feed(cls.bridge.forward_to_robot(msg))
 
+  @classmethod
+  def event_loop(cls):
+    cls.bridge.begin()
+    cls.deadman.begin()
     cls.state = cls.State.IDLE
     while True:
       if cls.state == cls.State.IDLE: # idle
         Board.status_led.change_state(True)
         if cls.ble.is_connected():
+          # host may have restarted its sequence numbers
+          cls.decoder.reset()
           cls.state = cls.State.OPERATION
-      elif cls.state == cls.State.OPERATION: # Bluetooth operations
+      elif cls.state == cls.State.OPERATION: # Bluetooth operations, relayed by bridge
         Board.status_led.change_state(False)
-        while True:
-          msg_length = cls.uart1.readinto(cls.rx_buffer)
-          if not cls.ble.is_connected():
-            break
-          if msg_length != None and msg_length != 0:
-            cls.rx_buffer[msg_length] = b"\n"
-            cls.ble.send(cls.rx_buffer[:msg_length + 1])
-          time.sleep_ms(100)
-        cls.state = cls.State.IDLE
+        if not cls.ble.is_connected():
+          # link lost, stop immediately instead of waiting for timeouts
+          cls.deadman.trip()
+          cls.state = cls.State.IDLE
+      # write logged records to flash outside of callbacks
+      EventLog.poll()
       time.sleep_ms(100)
@@ -0,0 +1,203 @@
+import machine
+
+import driver.utils as utils
+
+
+class Bridge:
+  """ Full-duplex relay between the robot UART and the bluetooth peripheral. Robot-bound commands
+      are coalesced per channel and sent at a fixed robot-side rate, bluetooth-bound frames are
+      forwarded from the UART rx interrupt. No buffer is allocated after construction """
+  DELIMITER = b"\n" # frame boundary of robot telemetry
+  FALLBACK_POLLING_MS = 10 # rx polling interval when UART rx interrupt is unavailable
+  FALLBACK_IDLE_POLLS = 2 # consecutive empty polls that mark the end of a frame when polling
+
+  # robot command channels, in the order they are sent within one robot-side period
+  HOLD, CHASSIS, GIMBAL, SHOOTER = 0, 1, 2, 3
+  CHANNEL_PREFIXES = (b"hld", b"chs", b"gim", b"sho")
+  MOTION_CHANNELS = (CHASSIS, GIMBAL)
+  SLOT_SIZE = 32 # maximum length of a coalesced command
+  DEFAULT_RATE_HZ = 20
+
+  def __init__(self, uart: machine.UART, ble, buf_size: int = 256, rate_hz: int = DEFAULT_RATE_HZ) -> None:
+    """ Create a bridge between given UART and bluetooth peripheral
+        `uart`: UART connected to the robot
+        `ble`: bluetooth peripheral connected to the host
+        `buf_size`: size of the robot telemetry buffer, one byte is reserved for the delimiter
+        `rate_hz`: robot-side command rate """
+    self.__uart = uart
+    self.__ble = ble
+    # latest pending command of each channel
+    channel_cnt = len(Bridge.CHANNEL_PREFIXES)
+    self.__slots = [bytearray(Bridge.SLOT_SIZE) for _ in range(channel_cnt)]
+    self.__slot_views = [memoryview(slot) for slot in self.__slots]
+    self.__slot_lengths = [0] * channel_cnt
+    self.__pending = [False] * channel_cnt
+    self.__rate_hz = rate_hz
+    self.__send_timer = None
+    self.__rx_buffer = bytearray(buf_size)
+    self.__rx_view = memoryview(self.__rx_buffer)
+    self.__rx_start = 0 # start of the pending partial frame
+    self.__rx_end = 0   # end of received bytes
+    self.__timer = None
+    self.__empty_polls = 0 # consecutive polls without received bytes
+    # per-direction counters
+    self.robot_bytes = 0 # bluetooth -> robot
+    self.robot_frames = 0
+    self.coalesced_frames = 0 # superseded before being sent
+    self.ble_bytes = 0   # robot -> bluetooth
+    self.ble_frames = 0
+    self.dropped_bytes = 0
+
+  def begin(self) -> None:
+    """ Begin forwarding robot telemetry to bluetooth and sending coalesced commands to robot """
+    self.__send_timer = machine.Timer(utils.ROBOT_SEND_TIMER_ID)
+    self.set_rate(self.__rate_hz)
+    if hasattr(machine.UART, "IRQ_RXIDLE"):
+      # fires once the robot pauses, i.e. at the end of every burst of telemetry
+      self.__uart.irq(handler=self.__uart_rx_irq, trigger=machine.UART.IRQ_RXIDLE)
+    else:
+      utils.EXPECT_TRUE(False, "Bridge UART rx interrupt unavailable, fall back to polling")
+      self.__timer = machine.Timer(utils.BRIDGE_TIMER_ID)
+      self.__timer.init(mode=machine.Timer.PERIODIC, period=Bridge.FALLBACK_POLLING_MS,
+          callback=self.__uart_rx_polling)
+
+  def set_rate(self, rate_hz: int) -> None:
+    """ Change the robot-side command rate
+        `rate_hz`: number of robot-side sends per second """
+    if rate_hz <= 0 or rate_hz > 1000:
+      utils.EXPECT_TRUE(False, f"Bridge invalid robot rate <{rate_hz}>")
+      return
+    self.__rate_hz = rate_hz
+    if self.__send_timer != None:
+      self.__send_timer.init(mode=machine.Timer.PERIODIC, period=1000 // self.__rate_hz,
+          callback=self.__send_pending)
+
+  def get_rate(self) -> int:
+    return self.__rate_hz
+
+  def forward_to_robot(self, msg: bytes) -> int:
+    """ Forward a message received from bluetooth to the robot, one message is one frame. Only
+        the latest command of each channel is kept until the next robot-side send, a hold
+        discards pending motion commands. Messages of unknown channels are sent immediately
+        `msg`: message to be forwarded
+        `returns`: channel of the message, -1 if not a known channel """
+    channel = -1
+    for i in range(len(Bridge.CHANNEL_PREFIXES)):
+      if msg.startswith(Bridge.CHANNEL_PREFIXES[i]):
+        channel = i
+        break
+    if channel == -1 or len(msg) > Bridge.SLOT_SIZE:
+      self.__write_to_robot(msg)
+      return channel
+    # bluetooth and timer callbacks are both run by the scheduler, never preempting each other
+    if self.__pending[channel]:
+      self.coalesced_frames += 1
+    self.__slots[channel][:len(msg)] = msg
+    self.__slot_lengths[channel] = len(msg)
+    self.__pending[channel] = True
+    if channel == Bridge.HOLD:
+      for motion in Bridge.MOTION_CHANNELS:
+        if self.__pending[motion]:
+          self.__pending[motion] = False
+          self.coalesced_frames += 1
+    return channel
+
+  def __send_pending(self, timer: machine.Timer) -> None:
+    """ Send the latest pending command of every channel, triggered by the robot-side rate timer.
+        Should NOT be called """
+    for channel in range(len(self.__pending)):
+      if self.__pending[channel]:
+        self.__pending[channel] = False
+        self.__write_to_robot(self.__slot_views[channel][:self.__slot_lengths[channel]])
+
+  def __write_to_robot(self, msg) -> None:
+    """ Write one frame to the robot. Should NOT be called """
+    self.__uart.write(msg)
+    self.robot_bytes += len(msg)
+    self.robot_frames += 1
+
+  def reset(self) -> None:
+    """ Discard the pending partial frame, e.g. after the bluetooth link is lost """
+    self.__rx_start = 0
+    self.__rx_end = 0
+
+  def __uart_rx_polling(self, timer: machine.Timer) -> None:
+    """ UART rx polling, triggered by a periodic timer when interrupt is unavailable.
+        Should NOT be called """
+    if self.__uart.any():
+      self.__empty_polls = 0
+      self.__drain(self.__uart)
+      return
+    # a frame may arrive across several polls, it only ends once the line stays idle
+    self.__empty_polls += 1
+    if self.__empty_polls == Bridge.FALLBACK_IDLE_POLLS:
+      self.__terminate_partial_frame()
+
+  def __uart_rx_irq(self, uart: machine.UART) -> None:
+    """ UART rx interrupt, fires on idle line, drains the UART and forwards all frames.
+        Should NOT be called """
+    self.__drain(uart)
+    # idle line marks end of frame
+    self.__terminate_partial_frame()
+
+  def __terminate_partial_frame(self) -> None:
+    """ Forward the pending partial frame with a delimiter appended. Should NOT be called """
+    if self.__rx_end != self.__rx_start:
+      self.__send_frame(self.__rx_start, self.__rx_end, True)
+    self.reset()
+
+  def __drain(self, uart: machine.UART) -> None:
+    """ Read everything the UART holds into the buffer and forward all delimited frames.
+        Should NOT be called """
+    capacity = len(self.__rx_buffer) - 1 # last byte reserved for delimiter
+    while True:
+      if self.__rx_end == capacity:
+        if self.__rx_start == 0:
+          # a single frame overflows the buffer, forward as is
+          self.__send_frame(self.__rx_start, self.__rx_end, True)
+        else:
+          self.__compact()
+      received = uart.readinto(self.__rx_view[self.__rx_end:capacity])
+      if not received:
+        break
+      scan = self.__rx_end
+      self.__rx_end += received
+      self.__forward_complete_frames(scan)
+
+  def __forward_complete_frames(self, scan: int) -> None:
+    """ Forward all delimited frames in the buffer, MicroPython's bytearray has no find
+        `scan`: bytes before it are already known to hold no delimiter. Should NOT be called """
+    delimiter = Bridge.DELIMITER[0]
+    view = self.__rx_view
+    for i in range(scan, self.__rx_end):
+      if view[i] == delimiter:
+        self.__send_frame(self.__rx_start, i + 1, False)
+
+  def __send_frame(self, start: int, end: int, terminate: bool) -> None:
+    """ Send buffer[start:end] through bluetooth, appending delimiter if `terminate`.
+        Should NOT be called """
+    if terminate:
+      self.__rx_buffer[end] = Bridge.DELIMITER[0]
+      end += 1
+    if self.__ble.is_connected():
+      self.__ble.send(self.__rx_view[start:end])
+      self.ble_bytes += end - start
+      self.ble_frames += 1
+    else:
+      self.dropped_bytes += end - start
+    self.__rx_start = end if not terminate else 0
+    if terminate:
+      self.__rx_end = 0
+
+  def __compact(self) -> None:
+    """ Move the pending partial frame to the start of the buffer. Should NOT be called """
+    length = self.__rx_end - self.__rx_start
+    self.__rx_buffer[:length] = self.__rx_view[self.__rx_start:self.__rx_end]
+    self.__rx_start = 0
+    self.__rx_end = length
+
+  def print_status(self) -> None:
+    """ Report counters of both directions, for debug use """
+    print(f"BLE -> Robot: {self.robot_frames} frames, {self.robot_bytes} bytes, " +
+        f"coalesced {self.coalesced_frames} frames, {self.__rate_hz} Hz")
+    print(f"Robot -> BLE: {self.ble_frames} frames, {self.ble_bytes} bytes, dropped {self.dropped_bytes} bytes")
@@ -0,0 +1,125 @@
+import machine, time, json
+
+import driver.utils as utils
+
+
+class Deadman:
+  """ Stops the robot when the host stops commanding it. Every command channel has its own timeout,
+      a channel not fed within its timeout expires once until fed again. When no channel at all is
+      fed within the hold timeout, a hold is issued and repeated every hold timeout until the host
+      resumes. Timer and clock are injectable so that timing can be exercised with fake ones """
+  config_path = "data"
+  default_config_storage = "deadman.settings"
+  ALL = -1 # channel reported on hold timeout
+  MIN_CHECK_PERIOD_MS = 10
+
+  @classmethod
+  def load_settings(cls, defaults: dict) -> dict:
+    """ Load timeouts in ms from the settings file, entries missing from the file use defaults
+        `defaults`: default timeouts keyed by channel name
+        `returns`: timeouts keyed by channel name """
+    settings = dict(defaults)
+    try:
+      with open(f"{cls.config_path}/{cls.default_config_storage}") as f:
+        settings.update(json.loads(f.read()))
+    except Exception:
+      pass
+    return settings
+
+  @classmethod
+  def save_settings(cls, settings: dict) -> None:
+    """ Store timeouts in ms to the settings file
+        `settings`: timeouts keyed by channel name """
+    with open(f"{cls.config_path}/{cls.default_config_storage}", "w") as f:
+      f.write(json.dumps(settings))
+
+  def __init__(self, channel_timeouts: list, hold_timeout_ms: int, expire_callback,
+               timer=None, clock=None) -> None:
+    """ Create a deadman, not running until `begin` is called
+        `channel_timeouts`: timeout in ms of each channel, 0 if the channel never expires on its own
+        `hold_timeout_ms`: time in ms without any command before a hold is issued
+        `expire_callback`: called with the expired channel index, or `Deadman.ALL` on hold timeout
+        `timer`: timer that drives the checks, `machine.Timer` or any object with the same `init`
+        `clock`: millisecond tick source, `time.ticks_ms` if not given """
+    utils.ASSERT_TRUE(hold_timeout_ms > 0, f"Deadman invalid hold timeout <{hold_timeout_ms}>")
+    self.__clock = clock if clock != None else time.ticks_ms
+    self.__timer = timer
+    self.__callback = expire_callback
+    self.__timeouts = list(channel_timeouts)
+    self.__hold_timeout = hold_timeout_ms
+    now = self.__clock()
+    self.__last_fed = [now] * len(self.__timeouts)
+    self.__armed = [False] * len(self.__timeouts)
+    self.__last_any = now
+    self.__last_hold = now
+    self.__held = True # robot is considered held until the first command
+    self.expired_count = 0
+
+  def begin(self) -> None:
+    """ Begin periodic checks, using a hardware timer if none was given """
+    if self.__timer == None:
+      self.__timer = machine.Timer(utils.DEADMAN_TIMER_ID)
+    self.__restart_timer()
+
+  def set_timeout(self, channel: int, timeout_ms: int) -> None:
+    """ Change the timeout of one channel
+        `channel`: index of the channel, or `Deadman.ALL` for the hold timeout
+        `timeout_ms`: new timeout in ms, 0 if the channel never expires on its own """
+    if channel == Deadman.ALL:
+      utils.EXPECT_TRUE(timeout_ms > 0, f"Deadman invalid hold timeout <{timeout_ms}>")
+      if timeout_ms <= 0:
+        return
+      self.__hold_timeout = timeout_ms
+    else:
+      self.__timeouts[channel] = timeout_ms
+      self.__armed[channel] = self.__armed[channel] and timeout_ms > 0
+    if self.__timer != None:
+      self.__restart_timer()
+
+  def get_timeout(self, channel: int) -> int:
+    return self.__hold_timeout if channel == Deadman.ALL else self.__timeouts[channel]
+
+  def feed(self, channel: int) -> None:
+    """ Record a command received from the host
+        `channel`: index of the channel commanded, `Deadman.ALL` if not a known channel """
+    now = self.__clock()
+    self.__last_any = now
+    self.__held = False
+    if channel != Deadman.ALL and self.__timeouts[channel] > 0:
+      self.__last_fed[channel] = now
+      self.__armed[channel] = True
+
+  def trip(self) -> None:
+    """ Expire all channels and issue a hold immediately, e.g. when the link is lost """
+    for channel in range(len(self.__timeouts)):
+      if self.__armed[channel]:
+        self.__armed[channel] = False
+        self.__callback(channel)
+    self.__held = True
+    self.__last_hold = self.__clock()
+    self.__callback(Deadman.ALL)
+
+  def check(self, timer=None) -> None:
+    """ Expire every channel whose timeout elapsed, triggered by the timer """
+    now = self.__clock()
+    for channel in range(len(self.__timeouts)):
+      if self.__armed[channel] and time.ticks_diff(now, self.__last_fed[channel]) >= self.__timeouts[channel]:
+        self.__armed[channel] = False
+        self.expired_count += 1
+        self.__callback(channel)
+    if time.ticks_diff(now, self.__last_any) >= self.__hold_timeout:
+      if not self.__held or time.ticks_diff(now, self.__last_hold) >= self.__hold_timeout:
+        if not self.__held:
+          self.expired_count += 1
+        self.__held = True
+        self.__last_hold = now
+        self.__callback(Deadman.ALL)
+
+  def __restart_timer(self) -> None:
+    """ (Re)start the check timer with a period well below the shortest timeout. Should NOT be called """
+    shortest = self.__hold_timeout
+    for timeout in self.__timeouts:
+      if timeout > 0 and timeout < shortest:
+        shortest = timeout
+    period = max(Deadman.MIN_CHECK_PERIOD_MS, shortest // 8)
+    self.__timer.init(mode=machine.Timer.PERIODIC, period=period, callback=self.check)
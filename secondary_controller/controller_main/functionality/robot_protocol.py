@@ -0,0 +1,103 @@
+class RobotDecoder:
+  """ Validates binary robot command frames from the host and translates them into robot
+      commands. Frames have fixed size and carry any subset of channels:
+        sync(1) seq(1) mask(1) chassis(3 x int16) gimbal(2 x int16) crc8(1), big-endian
+      Frames failing the checksum, or whose sequence number is not newer than the last accepted
+      one, are dropped. Constants must match gesture/robot_protocol.py """
+  SYNC = 0xA5
+  FRAME_SIZE = 14
+  CRC8_POLY = 0x07
+  CHASSIS_BIT, GIMBAL_BIT, SHOOTER_BIT, HOLD_BIT = 0x01, 0x02, 0x04, 0x08
+  SEQ_WINDOW = 128 # sequence numbers less than half the range ahead are newer
+  RESYNC_DROPS = 8 # consecutive stale frames after which the host is assumed restarted
+
+  # robot commands the frames are translated into
+  HOLD_CMD = b"hld|"
+  SHOOTER_CMD = b"sho|"
+
+  crc_table = None
+
+  @classmethod
+  def build_crc_table(cls) -> None:
+    """ Build the CRC-8 lookup table once, shared by all decoders """
+    if cls.crc_table != None:
+      return
+    cls.crc_table = bytearray(256)
+    for i in range(256):
+      crc = i
+      for _ in range(8):
+        crc = ((crc << 1) ^ cls.CRC8_POLY) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+      cls.crc_table[i] = crc
+
+  @classmethod
+  def is_frame(cls, msg) -> bool:
+    """ Whether the message consists of binary frames rather than a legacy text command """
+    return len(msg) >= cls.FRAME_SIZE and len(msg) % cls.FRAME_SIZE == 0 and msg[0] == cls.SYNC
+
+  def __init__(self) -> None:
+    RobotDecoder.build_crc_table()
+    # translated commands, payload copied in place from the frames
+    self.__chassis = bytearray(b"chs|" + bytes(6))
+    self.__gimbal = bytearray(b"gim|" + bytes(4))
+    self.__last_seq = -1
+    self.__stale_run = 0
+    self.accepted_frames = 0
+    self.corrupted_frames = 0
+    self.stale_frames = 0
+    self.rejected_messages = 0 # neither whole frames nor legacy commands, counted by the board
+
+  def reset(self) -> None:
+    """ Accept any sequence number next, e.g. after the host reconnected """
+    self.__last_seq = -1
+    self.__stale_run = 0
+
+  def decode(self, msg, submit) -> int:
+    """ Decode every frame in the message, submitting commands of accepted frames in the order
+        hold, chassis, gimbal, shooter
+        `msg`: message consisting of whole frames
+        `submit`: called with every robot command
+        `returns`: number of accepted frames """
+    accepted = 0
+    for start in range(0, len(msg) - RobotDecoder.FRAME_SIZE + 1, RobotDecoder.FRAME_SIZE):
+      if self.__decode_frame(msg, start, submit):
+        accepted += 1
+    return accepted
+
+  def __decode_frame(self, msg, start: int, submit) -> bool:
+    """ Validate and translate one frame. Should NOT be called """
+    end = start + RobotDecoder.FRAME_SIZE - 1 # position of crc
+    crc = 0
+    for i in range(start, end):
+      crc = RobotDecoder.crc_table[crc ^ msg[i]]
+    if msg[start] != RobotDecoder.SYNC or crc != msg[end]:
+      self.corrupted_frames += 1
+      return False
+    seq = msg[start + 1]
+    if self.__last_seq != -1:
+      ahead = (seq - self.__last_seq) & 0xFF
+      if ahead == 0 or ahead >= RobotDecoder.SEQ_WINDOW:
+        self.stale_frames += 1
+        self.__stale_run += 1
+        if self.__stale_run < RobotDecoder.RESYNC_DROPS:
+          return False
+    self.__stale_run = 0
+    self.__last_seq = seq
+    self.accepted_frames += 1
+    mask = msg[start + 2]
+    if mask & RobotDecoder.HOLD_BIT:
+      submit(RobotDecoder.HOLD_CMD)
+    # frames and robot commands share the big-endian int16 layout, payload is copied as is
+    if mask & RobotDecoder.CHASSIS_BIT:
+      self.__chassis[4:10] = msg[start + 3:start + 9]
+      submit(self.__chassis)
+    if mask & RobotDecoder.GIMBAL_BIT:
+      self.__gimbal[4:8] = msg[start + 9:start + 13]
+      submit(self.__gimbal)
+    if mask & RobotDecoder.SHOOTER_BIT:
+      submit(RobotDecoder.SHOOTER_CMD)
+    return True
+
+  def print_status(self) -> None:
+    """ Report frame counters, for debug use """
+    print(f"Robot frames: accepted {self.accepted_frames}, corrupted {self.corrupted_frames}, " +
+        f"stale {self.stale_frames}, rejected messages {self.rejected_messages}")
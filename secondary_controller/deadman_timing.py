@@ -0,0 +1,221 @@
+import argparse, sys, os, types
+
+# Host harness for the deadman of the secondary controller: drives Deadman.check with a fake
+# millisecond clock and a fake timer, the expiries go through Board.deadman_expired into a recording
+# bridge, so that the stop and hold frames actually sent to the robot are checked together with
+# when they are sent. Run with CPython from any directory: python deadman_timing.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "controller_main"))
+
+TICKS_PERIOD = 1 << 30 # ticks_ms wraps around at 2^30 on the ESP32
+
+
+class FakeClock:
+  """ ticks_ms and ticks_diff of MicroPython's time, advanced by hand """
+  def __init__(self, start: int) -> None:
+    self.now = start % TICKS_PERIOD
+
+  def ticks_ms(self) -> int:
+    return self.now
+
+  def ticks_diff(self, a: int, b: int) -> int:
+    return (a - b + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2
+
+  def advance(self, ms: int) -> None:
+    self.now = (self.now + ms) % TICKS_PERIOD
+
+
+class FakeTimer:
+  """ machine.Timer stand-in, only remembers how the deadman configured it """
+  PERIODIC = 1
+
+  def __init__(self, *args) -> None:
+    self.period = None
+    self.callback = None
+
+  def init(self, mode=None, period=None, callback=None) -> None:
+    self.period = period
+    self.callback = callback
+
+
+class RecordingBridge:
+  """ Records every frame the board forwards to the robot with the elapsed time it was sent at """
+  def __init__(self, clock: FakeClock) -> None:
+    self.clock = clock
+    self.start = clock.now
+    self.frames = []
+
+  def forward_to_robot(self, msg) -> int:
+    self.frames.append((self.clock.ticks_diff(self.clock.now, self.start), bytes(msg)))
+    return -1
+
+
+def install_stand_ins(warnings: list) -> None:
+  """ Modules only found on the board, just what importing the board module needs """
+  machine = types.ModuleType("machine")
+  machine.Timer = FakeTimer
+  machine.UART = type("UART", (), {})
+  micropython = types.ModuleType("micropython")
+  micropython.const = lambda value: value
+  bluetooth = types.ModuleType("bluetooth")
+  bluetooth.UUID = lambda value: value
+  bluetooth.FLAG_READ = bluetooth.FLAG_WRITE = bluetooth.FLAG_NOTIFY = 0
+  utils = types.ModuleType("driver.utils")
+  utils.DEADMAN_TIMER_ID = 2
+  utils.EXPECT_TRUE = lambda condition, message: None if condition else warnings.append(message)
+  def ASSERT_TRUE(condition, message):
+    if not condition:
+      raise AssertionError(message)
+  utils.ASSERT_TRUE = ASSERT_TRUE
+  status_led = types.ModuleType("driver.status_led")
+  status_led.StatusLed = object
+  event_log = types.ModuleType("driver.event_log")
+  event_log.EventLog = type("EventLog", (), {"log": staticmethod(lambda *args: None),
+                                             "poll": staticmethod(lambda: None)})
+  driver = types.ModuleType("driver")
+  driver.utils = utils
+  driver.status_led = status_led
+  driver.event_log = event_log
+  sys.modules.update({"machine": machine, "micropython": micropython, "bluetooth": bluetooth,
+                      "driver": driver, "driver.utils": utils, "driver.status_led": status_led,
+                      "driver.event_log": event_log})
+
+
+class Harness:
+  """ One board with a deadman built from `Board.deadman_defaults`, the timer fires every period """
+  def __init__(self, args) -> None:
+    self.clock = FakeClock(args.start)
+    deadman_module.time = self.clock
+    self.timer = FakeTimer()
+    Board.bridge = RecordingBridge(self.clock)
+    defaults = Board.deadman_defaults
+    timeouts = [defaults[prefix.decode()] for prefix in Bridge.CHANNEL_PREFIXES]
+    self.deadman = Deadman(timeouts, defaults["all"], Board.deadman_expired,
+                           timer=self.timer, clock=self.clock.ticks_ms)
+    Board.deadman = self.deadman
+    self.deadman.begin()
+    self.elapsed = 0
+    self.last_feed = None
+
+  def feed(self, channel: int) -> None:
+    self.deadman.feed(channel)
+    self.last_feed = self.elapsed
+
+  def run(self, ms: int, feeds=(), feed_every=0) -> None:
+    """ Let `ms` elapse, firing the timer on its period and feeding channels `feeds` every `feed_every` ms """
+    end = self.elapsed + ms
+    next_check = self.timer.period
+    next_feed = feed_every
+    while self.elapsed < end:
+      step = min(next_check, next_feed if feeds and feed_every else next_check, end - self.elapsed)
+      self.clock.advance(step)
+      self.elapsed += step
+      next_check -= step
+      next_feed -= step
+      if feeds and feed_every and next_feed <= 0:
+        for channel in feeds:
+          self.feed(channel)
+        next_feed = feed_every
+      if next_check <= 0:
+        self.timer.callback(self.timer)
+        next_check = self.timer.period
+
+  def frames(self, frame: bytes) -> list:
+    return [t for t, sent in Board.bridge.frames if sent == frame]
+
+
+HOLD_FRAME = None # set once the board module is imported
+
+
+def within(times: list, expected: list, slack: int) -> bool:
+  """ Whether frames were sent at the expected times, late by at most `slack` ms """
+  return len(times) == len(expected) and all(0 <= t - e <= slack for t, e in zip(times, expected))
+
+
+def check_hold_repeat(args) -> dict:
+  h = Harness(args)
+  hold = Board.deadman_defaults["all"]
+  slack = h.timer.period
+  h.feed(Bridge.CHASSIS)
+  h.run(hold * 4 + hold // 2)
+  # the chassis stops once, then holds follow every hold timeout until commands resume
+  results = {
+    "chassis stop once": within(h.frames(Board.CHASSIS_STOP), [Board.deadman_defaults["chs"]], slack),
+    "hold repeated": within(h.frames(HOLD_FRAME), [hold * i for i in range(1, 5)], slack),
+  }
+  # resumed on a channel that never expires on its own, nothing is sent before the next hold timeout
+  sent = len(Board.bridge.frames)
+  h.feed(Bridge.SHOOTER)
+  h.run(hold - slack)
+  results["silent after resume"] = len(Board.bridge.frames) == sent
+  return results
+
+
+def check_channel_expiry(args) -> dict:
+  h = Harness(args)
+  slack = h.timer.period
+  gimbal = Board.deadman_defaults["gim"]
+  # chassis keeps being commanded, gimbal and shooter are commanded once
+  for channel in (Bridge.GIMBAL, Bridge.SHOOTER):
+    h.feed(channel)
+  h.run(gimbal * 3, feeds=(Bridge.CHASSIS,), feed_every=50)
+  return {
+    "gimbal stop once": within(h.frames(Board.GIMBAL_STOP), [gimbal], slack),
+    "chassis fed, no stop": h.frames(Board.CHASSIS_STOP) == [],
+    "host alive, no hold": h.frames(HOLD_FRAME) == [],
+    "only stop frames sent": all(frame == Board.GIMBAL_STOP for _, frame in Board.bridge.frames),
+  }
+
+
+def check_set_timeout(args) -> dict:
+  warnings = WARNINGS
+  del warnings[:]
+  h = Harness(args)
+  results = {}
+  # a shorter timeout speeds the checks up so that it is still met
+  h.deadman.set_timeout(Bridge.GIMBAL, 40)
+  results["check period follows timeout"] = h.timer.period <= 40 // 4
+  h.feed(Bridge.GIMBAL)
+  h.run(100, feeds=(Bridge.CHASSIS,), feed_every=20)
+  results["new timeout used"] = within(h.frames(Board.GIMBAL_STOP), [40], h.timer.period)
+  # a channel whose timeout drops to 0 while armed never expires
+  h.feed(Bridge.CHASSIS)
+  h.deadman.set_timeout(Bridge.CHASSIS, 0)
+  h.run(Board.deadman_defaults["chs"] * 2, feeds=(Bridge.SHOOTER,), feed_every=50)
+  results["disabled channel never stops"] = h.frames(Board.CHASSIS_STOP) == []
+  # invalid hold timeouts are refused with a warning
+  h.deadman.set_timeout(Deadman.ALL, 0)
+  results["invalid hold timeout refused"] = (h.deadman.get_timeout(Deadman.ALL) == Board.deadman_defaults["all"]
+                                             and len(warnings) == 1)
+  h.deadman.set_timeout(Deadman.ALL, 200)
+  sent = len(h.frames(HOLD_FRAME))
+  h.run(450)
+  results["new hold timeout used"] = within(h.frames(HOLD_FRAME)[sent:],
+                                            [h.last_feed + 200, h.last_feed + 400], h.timer.period)
+  return results
+
+
+def main(args) -> None:
+  failed = False
+  for check in (check_hold_repeat, check_channel_expiry, check_set_timeout):
+    print(check.__name__[len("check_"):])
+    for name, ok in check(args).items():
+      failed |= not ok
+      print(f"  {name:30s} {'ok' if ok else 'FAIL'}")
+  if failed:
+    exit(1)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Check deadman stop and hold timing with a fake clock")
+  parser.add_argument("--start", type=int, default=TICKS_PERIOD - 700,
+                      help="initial tick, close to the wrap around of ticks_ms by default")
+  args = parser.parse_args()
+  WARNINGS = []
+  install_stand_ins(WARNINGS)
+  import functionality.deadman as deadman_module
+  from functionality.board import Board
+  from functionality.bridge import Bridge
+  from functionality.deadman import Deadman
+  HOLD_FRAME = Board.HOLD + b"|\n"
+  main(args)